@@ -1,6 +1,22 @@
 import hashlib
+import logging
 import os
-from calc_api.models import FileCache
+import select
+import time
+from pathlib import Path
+from django.db import connection
+from django.utils import timezone
+
+from climada.util.constants import SYSTEM_DIR
+
+from calc_api.config import ClimadaCalcApiConfig
+from calc_api.vizz.models import FileCache
+from calc_api.job_management import eviction
+from calc_api.api import serial
+
+conf = ClimadaCalcApiConfig()
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(getattr(logging, conf.LOG_LEVEL))
 
 
 def hash(string: str):
@@ -10,11 +26,27 @@ def hash(string: str):
 
 
 files = dict()
-CACHEDIR = 'filecache'
+CACHEDIR = Path(SYSTEM_DIR, 'calc_api', 'filecache')
 LOCKED = 'locked'
+NOTIFY_CHANNEL = 'file_cache'
+RECHECK_INTERVAL = 10  # seconds between checks on a locked entry when no notification arrives
+
+
+def cache_path(key_hash):
+    # Two levels of hash-prefix directories, so no directory holds more than a few hundred entries
+    return Path(CACHEDIR, key_hash[:2], key_hash[2:4], key_hash)
 
 
 def cached(serialize, deserialize):
+    """
+    Cache a function's results in files, one per set of arguments.
+
+    serialize turns a result into bytes and deserialize turns the bytes back into a result, e.g. the binary
+    serialisers in api/serial.py: see cached_ndarray and cached_csr_matrix. The first caller with a new set of
+    arguments computes the result while its FileCache row is locked. Other callers wait for a notification that it
+    has finished, and if it failed they compute it themselves. A lock held for longer than lock-timeout minutes is
+    assumed to belong to a dead process and is removed.
+    """
     def sd_cached(func):
         def cached_func(*args, **kargs):
             key = ' '.join(
@@ -22,44 +54,120 @@ def cached(serialize, deserialize):
                 + [f"'{a}'" for a in args]
                 + [f"'{ka}'" for ka in kargs.items()]
             )
-            path = f'{CACHEDIR}/{hash(key)}'
-            try:
-                fc = FileCache.objects.get(key=key)
-                if not os.path.isfile(fc.path):
-                    fc.delete()
-                    raise FileCache.DoesNotExist
-            except FileCache.DoesNotExist:
-                fc = FileCache(
+            key_hash = hash(key)
+            while True:
+                fc, created = FileCache.objects.get_or_create(
                     key=key,
-                    function=func.__name__,
-                    args=','.join([f'{a}' for a in args]) if args else None,
-                    kargs=','.join([f'{k}={v}' for k, v in kargs.items()]),
-                    path=path,
-                    locked=True)
-                fc.save()
-
-                try:
-                    # here's the call to func in case the result isn't cached
-                    result = func(*args, **kargs)
-
-                    with open(path, 'w') as cached_file:
-                        cached_file.write(serialize(result))
-
-                    fc.locked = False
-                    fc.save()
-                except Exception:
-                    fc.delete()
-                    raise
+                    defaults={
+                        'function': func.__name__,
+                        'args': ','.join([f'{a}' for a in args]) if args else None,
+                        'kargs': ','.join([f'{k}={v}' for k, v in kargs.items()]),
+                        'path': str(cache_path(key_hash)),
+                        'locked': True,
+                        'created_at': timezone.now()
+                    }
+                )
+                if created:
+                    return _compute(fc, key_hash, func, args, kargs, serialize)
 
-            while fc.locked:
-                from time import sleep
-                del fc  # perhaps that's not the proper way to do it, however
-                #         the idea is to avoid locking any other process down
-                sleep(1)
-                fc = FileCache.objects.get(key=key)
+                if fc.locked:
+                    fc = _wait_for_unlock(key)
+                    if fc is None:
+                        continue  # the computation failed and removed its entry
+                    if fc.locked:
+                        LOGGER.warning(f'Removing FileCache lock held for over {conf.LOCK_TIMEOUT} minutes: {fc}')
+                        FileCache.objects.filter(pk=fc.pk, locked=True).delete()
+                        continue
+
+                if not os.path.isfile(fc.path):
+                    fc.delete()
+                    continue
 
-            with open(fc.path) as cached_file:
-                return deserialize(cached_file)
+                eviction.record_filecache_access(fc.pk)
+                with open(fc.path, 'rb') as cached_file:
+                    return deserialize(cached_file.read())
 
         return cached_func
     return sd_cached
+
+
+def _compute(fc, key_hash, func, args, kargs, serialize):
+    path = Path(fc.path)
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.part')
+    try:
+        # here's the call to func in case the result isn't cached
+        start = time.perf_counter()
+        result = func(*args, **kargs)
+        fc.compute_time = time.perf_counter() - start
+
+        # Write to a temporary file and rename so that readers never see a partial file
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp_path, 'wb') as cached_file:
+            cached_file.write(serialize(result))
+        os.replace(tmp_path, path)
+
+        # Only unlock the row if we still hold its lock. If a waiter decided our lock was stale and took the entry
+        # over, the row is gone or belongs to the new owner: keep our result, but leave the entry to them.
+        unlocked = FileCache.objects.filter(pk=fc.pk, locked=True).update(
+            locked=False,
+            compute_time=fc.compute_time,
+            result_size=os.path.getsize(path),
+            last_accessed=timezone.now()
+        )
+        if not unlocked:
+            LOGGER.warning(f'Lost the FileCache lock while computing {fc.key}: another process took it over')
+        return result
+    except Exception:
+        if tmp_path.exists():
+            os.remove(tmp_path)
+        FileCache.objects.filter(pk=fc.pk, locked=True).delete()
+        raise
+    finally:
+        _notify(key_hash)
+
+
+def _notify(key_hash):
+    # Wake every process waiting on a FileCache entry. Notifications are only available with PostgreSQL.
+    if connection.vendor != 'postgresql':
+        return
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [NOTIFY_CHANNEL, key_hash])
+    except Exception as err:
+        LOGGER.warning(f'Could not notify FileCache waiters. They will recheck shortly. Error: {err}')
+
+
+def _wait_for_unlock(key):
+    """
+    Wait for a locked FileCache entry to be unlocked or removed, for up to lock-timeout minutes.
+
+    Returns the entry as it was last read, or None if it was removed. With PostgreSQL the wait is woken by the
+    computing process's notification. We listen before checking the entry, so a notification sent in between
+    isn't missed. With other databases the entry is checked every second.
+    """
+    notifications = connection.vendor == 'postgresql'
+    if notifications:
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {NOTIFY_CHANNEL}')
+    deadline = time.monotonic() + conf.LOCK_TIMEOUT * 60
+    try:
+        while True:
+            fc = FileCache.objects.filter(key=key).first()
+            remaining = deadline - time.monotonic()
+            if fc is None or not fc.locked or remaining <= 0:
+                return fc
+            if notifications:
+                pg_connection = connection.connection
+                select.select([pg_connection], [], [], min(remaining, RECHECK_INTERVAL))
+                pg_connection.poll()
+                pg_connection.notifies.clear()
+            else:
+                time.sleep(min(remaining, 1))
+    finally:
+        if notifications:
+            with connection.cursor() as cursor:
+                cursor.execute(f'UNLISTEN {NOTIFY_CHANNEL}')
+
+
+cached_ndarray = cached(serial.ndarray_to_bytes, serial.ndarray_from_bytes)
+cached_csr_matrix = cached(serial.csr_matrix_to_bytes, serial.csr_matrix_from_bytes)
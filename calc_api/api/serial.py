@@ -1,7 +1,7 @@
 import base64
 import io
 from scipy import sparse
-from numpy import ndarray, frombuffer
+from numpy import ndarray, frombuffer, save, load
 
 
 def serialize_ndarray(arr: ndarray) -> dict:
@@ -16,12 +16,42 @@ def deserialize_ndarray(data: dict) -> ndarray:
 
 
 def serialize_csr_matrix(csr: sparse.csr_matrix) -> str:
+    return base64.b64encode(csr_matrix_to_bytes(csr)).decode('ascii')
+
+
+def deserialize_csr_matrix(data: str) -> sparse.csr_matrix:
+    return csr_matrix_from_bytes(base64.b64decode(data))
+
+
+# Binary forms, for payloads that are stored rather than sent as JSON
+
+def ndarray_to_bytes(arr: ndarray) -> bytes:
+    # The .npy format keeps the array's shape as well as its dtype
+    with io.BytesIO() as bio:
+        save(bio, arr, allow_pickle=False)
+        return bio.getvalue()
+
+
+def ndarray_from_bytes(data: bytes) -> ndarray:
+    with io.BytesIO(data) as bio:
+        return load(bio, allow_pickle=False)
+
+
+def ndarray_to_base64(arr: ndarray) -> str:
+    # The binary form as text, for payloads that are stored as JSON
+    return base64.b64encode(ndarray_to_bytes(arr)).decode('ascii')
+
+
+def ndarray_from_base64(data: str) -> ndarray:
+    return ndarray_from_bytes(base64.b64decode(data))
+
+
+def csr_matrix_to_bytes(csr: sparse.csr_matrix) -> bytes:
     with io.BytesIO() as bio:
         sparse.save_npz(bio, csr)
-        return base64.b64encode(bio.getvalue()).decode('ascii')
+        return bio.getvalue()
 
 
-def deserialize_csr_matrix(data: str) -> sparse.csr_matrix:
-    byt = base64.b64decode(data)
-    with io.BytesIO(byt) as bio:
+def csr_matrix_from_bytes(data: bytes) -> sparse.csr_matrix:
+    with io.BytesIO(data) as bio:
         return sparse.load_npz(bio)
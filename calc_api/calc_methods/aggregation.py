@@ -0,0 +1,165 @@
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
+import shapely
+
+import climada.util.coordinates as u_coord
+from climada.util.constants import SYSTEM_DIR
+
+from calc_api.config import ClimadaCalcApiConfig
+from calc_api.calc_methods import util, points
+
+conf = ClimadaCalcApiConfig()
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(getattr(logging, conf.LOG_LEVEL))
+
+# Administrative region of each point in a country's exposure or hazard grid, one file per grid and admin level
+REGION_DIR = Path(SYSTEM_DIR, 'calc_api', 'admin_regions')
+
+# TODO admin2: we don't have a source for admin2 boundaries yet
+ADMIN_SCALES = ['admin1']
+AGGREGATION_METHODS = ['sum', 'mean', 'median', 'max']
+
+
+def get_region_ids(country, aggregation_scale, lat, lon):
+    """
+    Return the admin region of every point in a country grid as (region_ids, region_names).
+
+    region_ids is an integer array with an index into region_names for each point, or -1 where a point couldn't be
+    placed in any region. With aggregation_scale 'all' every point is in one region. Admin assignments are stored on
+    disk, keyed by country, admin level and the point coordinates, so each exposure and hazard grid is only assigned
+    once.
+    """
+    if aggregation_scale == 'all':
+        return np.zeros(len(lat), dtype=np.int32), [country]
+    if aggregation_scale not in ADMIN_SCALES:
+        raise ValueError(f"API can't aggregate output to {aggregation_scale} yet. "
+                         f"Aggregation scales available: 'all', {ADMIN_SCALES}")
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    path = Path(REGION_DIR, f'{country}_{aggregation_scale}_{util.coords_hash(lat, lon)}.npz')
+
+    if path.exists():
+        try:
+            with np.load(path) as npz:
+                region_ids, region_names = npz['region_ids'], npz['region_names'].tolist()
+            if len(region_ids) == len(lat):
+                return region_ids, region_names
+            LOGGER.warning(f'Stored region assignment {path.name} has the wrong length. Recalculating')
+        except (OSError, ValueError, KeyError) as err:
+            LOGGER.warning(f'Could not read stored region assignment {path.name}. Recalculating. Error: {err}')
+
+    region_ids, region_names = _assign_admin1(country, lat, lon)
+    _save_regions(path, region_ids, region_names)
+    return region_ids, region_names
+
+
+def _assign_admin1(country, lat, lon):
+    LOGGER.debug(f'Assigning {len(lat)} points to admin1 regions of {country}')
+    admin1_info, admin1_shapes = u_coord.get_admin1_info([country])
+    region_names = [record['name'] for record in admin1_info[country]]
+
+    region_ids = np.full(len(lat), -1, dtype=np.int32)
+    for i, shape in enumerate(admin1_shapes[country]):
+        lonmin, latmin, lonmax, latmax = shape.bounds
+        candidates = np.flatnonzero(
+            (region_ids == -1) & (lat >= latmin) & (lat <= latmax) & (lon >= lonmin) & (lon <= lonmax)
+        )
+        if len(candidates) > 0:
+            inside = shapely.contains_xy(shape, lon[candidates], lat[candidates])
+            region_ids[candidates[inside]] = i
+
+    # Grid cells on the coast can fall just outside every region's outline: give them their nearest neighbour's region
+    unassigned = region_ids == -1
+    if unassigned.any() and not unassigned.all():
+        tree = cKDTree(np.column_stack([lat[~unassigned], lon[~unassigned]]))
+        _, nearest = tree.query(np.column_stack([lat[unassigned], lon[unassigned]]))
+        region_ids[unassigned] = region_ids[~unassigned][nearest]
+    return region_ids, region_names
+
+
+def _save_regions(path, region_ids, region_names):
+    # Write to a temporary file and rename so that other processes never read a partial file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.part')
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, region_ids=region_ids, region_names=np.array(region_names, dtype=str))
+    os.replace(tmp_path, path)
+
+
+def region_matrix(region_ids, n_regions):
+    """Sparse (n_points, n_regions) indicator matrix: multiplying point values by it sums them by region."""
+    valid = np.flatnonzero(region_ids >= 0)
+    return sparse.csr_matrix(
+        (np.ones(len(valid)), (valid, region_ids[valid])),
+        shape=(len(region_ids), n_regions)
+    )
+
+
+def aggregate(values, region_ids, n_regions, aggregation_method):
+    """
+    Aggregate point values to regions in one pass.
+
+    values has shape (n_points,) or (n_rows, n_points), e.g. one row per return period. Returns an array of shape
+    (n_regions,) or (n_rows, n_regions). Regions with no points get NaN, except for sums, which are zero.
+    """
+    if aggregation_method not in AGGREGATION_METHODS:
+        raise ValueError(f'aggregation method must be one of {", ".join(AGGREGATION_METHODS)}')
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 2:
+        return np.stack([aggregate(row, region_ids, n_regions, aggregation_method) for row in values])
+
+    valid = region_ids >= 0
+    groups, values = region_ids[valid], values[valid]
+    counts = np.bincount(groups, minlength=n_regions)
+
+    if aggregation_method == 'sum':
+        return np.bincount(groups, weights=values, minlength=n_regions)
+
+    out = np.full(n_regions, np.nan)
+    has_points = counts > 0
+    if aggregation_method == 'mean':
+        out[has_points] = np.bincount(groups, weights=values, minlength=n_regions)[has_points] / counts[has_points]
+        return out
+
+    # Sort by region, then by value: each region's values are then a contiguous, sorted block
+    order = np.lexsort((values, groups))
+    sorted_values = values[order]
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[has_points]
+    n = counts[has_points]
+    if aggregation_method == 'max':
+        out[has_points] = sorted_values[starts + n - 1]
+    else:
+        out[has_points] = (sorted_values[starts + (n - 1) // 2] + sorted_values[starts + n // 2]) / 2
+    return out
+
+
+def regions_to_columnar(lat, lon, region_ids, region_names, **region_columns):
+    """
+    Build a columnar payload with one entry per region that has points, located at the median of its points.
+
+    region_columns are already aggregated, with shape (n_regions,) or (n_rows, n_regions).
+    """
+    n_regions = len(region_names)
+    present = np.flatnonzero(np.bincount(region_ids[region_ids >= 0], minlength=n_regions))
+    return points.make_columnar(
+        aggregate(lat, region_ids, n_regions, 'median')[present],
+        aggregate(lon, region_ids, n_regions, 'median')[present],
+        labels={'region': [region_names[i] for i in present]},
+        **{name: np.asarray(values)[..., present] for name, values in region_columns.items()}
+    )
+
+
+def aggregate_points(country, aggregation_scale, aggregation_method, lat, lon, **columns):
+    """Aggregate gridded point columns for a country to admin regions and return them as a columnar payload."""
+    region_ids, region_names = get_region_ids(country, aggregation_scale, lat, lon)
+    region_columns = {
+        name: aggregate(values, region_ids, len(region_names), aggregation_method)
+        for name, values in columns.items()
+    }
+    return regions_to_columnar(lat, lon, region_ids, region_names, **region_columns)
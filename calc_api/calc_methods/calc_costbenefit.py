@@ -11,7 +11,8 @@ import calc_api.vizz.schemas as schemas
 from calc_api.config import ClimadaCalcApiConfig
 from calc_api.vizz.enums import get_rp_options, exposure_type_from_impact_type, EXPOSURE_TO_UNIT_TYPE
 from calc_api.vizz import units
-from calc_api.calc_methods.calc_impact import get_impact_event, get_impact_by_return_period
+from calc_api.calc_methods.calc_impact import get_impact_event, get_impact_by_return_period, \
+    get_measure_impacts_by_return_period
 from calc_api.job_management import standardise_schema
 from calc_api.job_management.job_management import database_job
 
@@ -94,6 +95,11 @@ def set_up_costbenefit_calculations(request: schemas.CostBenefitRequest):
         #     })
         #     job_config_list = job_config_list.append(all_measures)
 
+    if conf.COSTBENEFIT_ENGINE == 'batched':
+        return job_config_list, _set_up_batched_measure_calculations(request, job_config_list)
+    if conf.COSTBENEFIT_ENGINE != 'chord':
+        raise ValueError(f'Could not process the configuration parameter costbenefit.engine. Value: {conf.COSTBENEFIT_ENGINE}')
+
     chord_header = [
         get_impact_by_return_period.s(
             country=request.geocoding.country_id,
@@ -117,12 +123,61 @@ def set_up_costbenefit_calculations(request: schemas.CostBenefitRequest):
     return job_config_list, chord_header
 
 
+def _set_up_batched_measure_calculations(request, job_config_list):
+    # One task per (haz_year, exp_year) pair calculates the no-measure impact and every measure for those years.
+    # Each job config records which task result ('batch') and which entry of it ('batch_index') holds its impact.
+    batches = []
+    batch_ids = {}
+    for job_config in job_config_list:
+        year_pair = (job_config['haz_year'], job_config['exp_year'])
+        if year_pair not in batch_ids:
+            batch_ids[year_pair] = len(batches)
+            batches.append({'haz_year': job_config['haz_year'], 'exp_year': job_config['exp_year'], 'measures': []})
+        batch = batches[batch_ids[year_pair]]
+        job_config['batch'] = batch_ids[year_pair]
+        if job_config['measures']:
+            if len(job_config['measures']) > 1:
+                raise ValueError('The batched measure calculations only handle one measure at a time')
+            batch['measures'].append(job_config['measures'][0])
+            job_config['batch_index'] = len(batch['measures'])
+        else:
+            job_config['batch_index'] = 0
+
+    return [
+        get_measure_impacts_by_return_period.s(
+            country=request.geocoding.country_id,
+            hazard_type=request.hazard_type,
+            return_periods='aai',
+            exposure_type=request.exposure_type,
+            impact_type=request.impact_type,
+            scenario_name=request.scenario_name,
+            scenario_growth=request.scenario_growth,
+            scenario_climate=request.scenario_climate,
+            measures=batch['measures'],
+            hazard_year=batch['haz_year'],
+            exposure_year=batch['exp_year'],
+            location_poly=request.location_poly,
+            aggregation_scale='all',
+            save_frequency_curve=False
+        )
+        for batch in batches
+    ]
+
+
+def unpack_measure_impacts(impacts_list, job_config_list):
+    # Results from the batched engine come one list per batch: pick out the impact for each job config
+    if len(job_config_list) == 0 or 'batch' not in job_config_list[0]:
+        return impacts_list
+    return [impacts_list[job_config['batch']][job_config['batch_index']] for job_config in job_config_list]
+
+
 @shared_task()
 def combine_impacts_to_costbenefit(impacts_list, job_config_list):
     return combine_impacts_to_costbenefit_no_celery(impacts_list, job_config_list)
 
 
 def combine_impacts_to_costbenefit_no_celery(impacts_list, job_config_list):
+    impacts_list = unpack_measure_impacts(impacts_list, job_config_list)
     if len(impacts_list) != len(job_config_list):
         raise ValueError(f'impacts and configs are not the same length: {len(impacts_list)} vs {len(job_config_list)}')
 
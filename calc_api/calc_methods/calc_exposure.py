@@ -1,12 +1,10 @@
 import logging
+import copy
 from cache_memoize import cache_memoize
 from celery import shared_task
 from celery_singleton import Singleton
 import numpy as np
-import pandas as pd
-import geopandas as gpd
 from pathlib import Path
-from time import sleep
 from shapely import wkt
 from shapely.geometry import Polygon
 
@@ -20,7 +18,8 @@ from calc_api.vizz.enums import exposure_type_from_impact_type
 from calc_api.calc_methods.util import standardise_scenario
 from calc_api.vizz.enums import ScenarioGrowthEnum, ExposureTypeEnum, ApiExposureTypeEnum
 from calc_api.job_management.job_management import database_job
-from calc_api.calc_methods import util
+from calc_api.calc_methods import util, aggregation, data_api, exposure_totals, points, spatial_index
+from calc_api.calc_methods.worker_cache import WorkerCache
 
 conf = ClimadaCalcApiConfig()
 
@@ -28,6 +27,14 @@ LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(getattr(logging, conf.LOG_LEVEL))
 
 
+def _exposure_nbytes(exp):
+    return int(exp.gdf.memory_usage(index=True, deep=True).sum())
+
+
+# Unscaled exposures loaded by this worker process, keyed on their Data API request properties
+EXPOSURE_CACHE = WorkerCache('exposure', conf.EXPOSURE_CACHE_MEMORY, _exposure_nbytes)
+
+
 # TODO organise these functions better. get_exposure should just be admin, get_exposure_from_api should do the work
 # TODO split this into two functions, once that gets aggregated exposure, one that gets gridded exposure.
 #  We don't want to be saving gridded results to our database, and besides, they return different sorts of objects.
@@ -49,22 +56,26 @@ def get_exposure(
 
     LOGGER.debug('Starting get_exposure calculation. Locals: ' + str(locals()))
 
-    exp = get_exposure_from_api(country, exposure_type, impact_type, scenario_name, scenario_growth, scenario_year)
+    exp, scaling = get_base_exposure_from_api(
+        country, exposure_type, impact_type, scenario_name, scenario_growth, scenario_year, location_poly
+    )
 
     if drop_zeroes:
+        exp = copy.copy(exp)
         exp.gdf = exp.gdf[exp.gdf['value'] != 0]
 
-    # TODO handle polygons, be sure it's not more efficient to make this another link of the chain
-
-    if location_poly:
-        exp = subset_exposure_extent(exp, location_poly)
-
-    # TODO implement, consider splitting from the chain
     if aggregation_scale:
         if not aggregation_method:
             raise ValueError("Need an aggregation method when aggregation_scale is set")
         if aggregation_scale != 'all':
-            raise ValueError("API doesn't aggregate output to sublevels yet: set aggregation_scale to 'all'")
+            return aggregation.aggregate_points(
+                country,
+                aggregation_scale,
+                aggregation_method,
+                exp.gdf['latitude'].to_numpy(),
+                exp.gdf['longitude'].to_numpy(),
+                value=exp.gdf['value'].to_numpy() * scaling
+            )
         else:
             if aggregation_method == 'sum':
                 aggregation_method = np.sum
@@ -78,12 +89,13 @@ def get_exposure(
                 raise ValueError('aggregation method must be one of sum, mean, median or max')
         return [{'lat': float(np.median(exp.gdf['latitude'])),
                  'lon': float(np.median(exp.gdf['longitude'])),
-                 'value': float(aggregation_method(exp.gdf['value']))}]
+                 'value': float(aggregation_method(exp.gdf['value']) * scaling)}]
 
-    return [
-        {"lat": float(row['latitude']), "lon": float(row['longitude']), "value": float(row['value'])}
-        for _, row in exp.gdf.iterrows()
-    ]
+    return points.make_columnar(
+        exp.gdf['latitude'].to_numpy(),
+        exp.gdf['longitude'].to_numpy(),
+        value=exp.gdf['value'].to_numpy() * scaling
+    )
 
 
 def get_api_exposure_properties(
@@ -141,7 +153,71 @@ def get_exposure_from_api(
         scenario_name=None,
         scenario_growth=None,
         scenario_year=None):
+    exp, scaling = get_base_exposure_from_api(
+        country, exposure_type, impact_type, scenario_name, scenario_growth, scenario_year
+    )
+    return scale_exposure(exp, scaling)
+
 
+def get_base_exposure_from_api(
+        country,
+        exposure_type=None,
+        impact_type=None,
+        scenario_name=None,
+        scenario_growth=None,
+        scenario_year=None,
+        location_poly=None,
+        buffer=150):  # arcseconds
+    """
+    Get an unscaled exposure and the scalar factor that should be applied to its values for the requested year.
+
+    The exposure is shared with other calls in this worker process, so it must not be modified in place. Subset it
+    first (subset_exposure_extent returns a new object) and call scale_exposure when a private, scaled copy is needed.
+
+    With location_poly, only the exposure within the polygon's buffered bounding box is returned, as a new object.
+    It is subset from this worker's cached copy of the country if there is one, and otherwise read from the
+    dataset's spatial tiles without loading the rest of the country.
+    """
+    properties, scaling = resolve_exposure_request(
+        country, exposure_type, impact_type, scenario_name, scenario_growth, scenario_year
+    )
+    dataset = get_exposure_dataset_info(properties)
+    # Key on the resolved dataset version, not 'newest', so a newly published version replaces cached copies
+    cache_key = (tuple(sorted(properties.items())), dataset.version)
+    table_key = exposure_totals.table_key(properties)
+
+    if location_poly:
+        exp = EXPOSURE_CACHE.get(cache_key)
+        if exp is not None:
+            return subset_exposure_extent(exp, location_poly, buffer), scaling
+        LOGGER.debug(f'Requesting exposure tiles from Data API. Request details: {properties}')
+        return _load_exposure_from_api(dataset, table_key, location_poly, buffer), scaling
+
+    LOGGER.debug(f'Requesting exposure from Data API. Request details: {properties}')
+    exp = EXPOSURE_CACHE.get_or_load(cache_key, lambda: _load_exposure_from_api(dataset, table_key))
+    return exp, scaling
+
+
+def get_exposure_dataset_info(properties):
+    """The Data API dataset that an exposure request (from resolve_exposure_request) currently resolves to."""
+    request_properties = dict(properties)
+    exposures_type = request_properties.pop('data_type')
+    status = request_properties.pop('status')
+    version = request_properties.pop('version')
+    try:
+        return data_api.get_dataset_info(exposures_type, request_properties, status, version)
+    except Client.NoResult as err:
+        raise Client.NoResult(f'No result found for exposure request {properties}. Error: {err}')
+
+
+def resolve_exposure_request(
+        country,
+        exposure_type=None,
+        impact_type=None,
+        scenario_name=None,
+        scenario_growth=None,
+        scenario_year=None):
+    """Return the Data API request properties for an exposure and the scaling to apply to its values."""
     if not scenario_year and scenario_growth == 'historic':
         scenario_year = '2020'
 
@@ -152,38 +228,69 @@ def get_exposure_from_api(
 
     properties = get_api_exposure_properties(exposure_type, scenario_name, scenario_year, scenario_growth, country)
 
-    LOGGER.debug(f'Requesting exposure from Data API. Request details: {properties}')
-    exposures_type = properties.pop('data_type')
-    status = properties.pop('status')
-    version = properties.pop('version')
-
-    client = Client()
-
-    # TODO use a sane way of sharing data across processes
-    i, exp = 0, None
-    while exp is None:
-        try:
-            exp = client.get_exposures(
-                exposures_type=exposures_type,
-                properties=properties,
-                status=status,
-                version=version
-            )
-        except Client.NoResult as err:
-            raise Client.NoResult(err)
-        except Exception as err:
-            LOGGER.debug(f'Waiting for exposure file to free up: {err}')
-            i = i + 1
-            if i == 20:
-                raise IOError("Couldn't access exposure file in a reasonable amount of time")
-            sleep(2)
-
     if exposure_type == 'economic_assets' and str(scenario_year) != '2020':
         scaling = get_gdp_scaling(country, scenario_year)
     else:
         scaling = 1
-    exp.gdf['value'] = exp.gdf['value'] * scaling
 
+    return properties, scaling
+
+
+def get_exposure_total(
+        country,
+        exposure_type=None,
+        impact_type=None,
+        scenario_name=None,
+        scenario_growth=None,
+        scenario_year=None,
+        location_poly=None):
+    """
+    Total exposure value in a location from the exposure's summed-area table, without loading the exposure.
+
+    Returns the same output as get_exposure with aggregation_scale 'all' and aggregation_method 'sum', or None when
+    no worker has loaded this exposure yet, in which case the caller should run get_exposure instead. The table is
+    found from the request alone, without a Data API lookup: it's replaced when a worker loads a newer version.
+    """
+    properties, scaling = resolve_exposure_request(
+        country, exposure_type, impact_type, scenario_name, scenario_growth, scenario_year
+    )
+    return exposure_totals.exposure_total(exposure_totals.table_key(properties), scaling, location_poly)
+
+
+def get_exposures_in_extent(exposures_type, properties, status, version, location_poly, buffer=150):
+    """
+    Load only the part of a Data API exposure dataset within a location polygon's buffered bounding box, reading
+    just the dataset's spatial tiles that intersect it.
+    """
+    exp = data_api.get_exposures(
+        exposures_type, properties, status, version, bounds=util.buffered_bounds(location_poly, buffer)
+    )
+    if exp.gdf.shape[0] == 0:
+        raise ValueError('Subsetting the exposure went wrong: no exposure points found')
+    return exp
+
+
+def _load_exposure_from_api(dataset, table_key, location_poly=None, buffer=150):
+    # Concurrent requests for the same file are coordinated across processes by data_api.download_dataset
+    if location_poly:
+        exp = data_api.load_exposures_in_extent(dataset, util.buffered_bounds(location_poly, buffer), table_key)
+        if exp.gdf.shape[0] == 0:
+            raise ValueError('Subsetting the exposure went wrong: no exposure points found')
+        return exp
+    exp = data_api.load_exposures(dataset)
+
+    # First time this version of the exposure is loaded: store its summed-area table for get_exposure_total. Requests
+    # for locations build it in data_api.tile_exposures instead.
+    if not exposure_totals.table_is_current(table_key, dataset):
+        data_api.save_exposure_table(dataset, exp, table_key)
+    return exp
+
+
+def scale_exposure(exp, scaling=1):
+    """Materialise a private copy of an exposure with its values multiplied by the given scaling."""
+    exp = exp.copy(deep=True)
+    if scaling != 1:
+        exp.gdf['value'] = exp.gdf['value'] * scaling
     return exp
 
 
@@ -194,9 +301,8 @@ def subset_exposure_extent(
         buffer=150,  # arcseconds
         latlon_names=('latitude', 'longitude')
 ):
-    df_query = _make_df_subset_query(location_poly, buffer, latlon_names)
-
-    exp.gdf = gpd.GeoDataFrame(exp.gdf.query(df_query))
+    exp = copy.copy(exp)  # don't modify the input: it may be shared through the exposure cache
+    exp.gdf = _subset_rows(exp.gdf, location_poly, buffer, latlon_names)
     if exp.gdf.shape[0] == 0:
         raise ValueError('Subsetting the exposure went wrong: no exposure points found')
     return exp
@@ -208,30 +314,15 @@ def subset_dataframe_extent(
         buffer=150,  # arcseconds
         latlon_names=('latitude', 'longitude')
 ):
-    df_query = _make_df_subset_query(location_poly, buffer, latlon_names)
-    exp = pd.DataFrame(exp.query(df_query))
+    exp = _subset_rows(exp, location_poly, buffer, latlon_names)
     if exp.shape[0] == 0:
         raise ValueError('Subsetting the exposure went wrong: no exposure points found')
     return exp
 
 
-def _make_df_subset_query(
-        location_poly,
-        buffer,
-        latlon_names
-):
-    # In this tool location_poly and bbox are always stored as well-known text,
-    # except at the point of geometric operations:
-    location_poly = util.convert_to_polygon(location_poly)
-
-    buffer_deg = buffer / (60 * 60)
-    lonmin, latmin, lonmax, latmax = location_poly.bounds
-    latmin = latmin - buffer_deg
-    lonmin = lonmin - buffer_deg
-    latmax = latmax + buffer_deg
-    lonmax = lonmax + buffer_deg
-
-    return f'{latlon_names[0]} >= {latmin} & \
-        {latlon_names[0]} <= {latmax} & \
-        {latlon_names[1]} >= {lonmin} & \
-        {latlon_names[1]} <= {lonmax}'
+def _subset_rows(df, location_poly, buffer, latlon_names):
+    # The latitude-sorted index is built once per dataframe, e.g. once for each exposure in the worker cache, so
+    # repeat lookups are a binary search and a mask over one latitude band rather than a scan of every point
+    lonmin, latmin, lonmax, latmax = util.buffered_bounds(location_poly, buffer)
+    index = spatial_index.get_index(df, df[latlon_names[0]].to_numpy(), df[latlon_names[1]].to_numpy())
+    return df.take(index.query(lonmin, latmin, lonmax, latmax))
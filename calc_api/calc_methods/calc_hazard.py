@@ -1,3 +1,4 @@
+import copy
 import logging
 import numpy as np
 from cache_memoize import cache_memoize
@@ -12,7 +13,8 @@ from climada.hazard import Hazard, Centroids, Tag
 
 from calc_api.calc_methods.profile import profile
 from calc_api.config import ClimadaCalcApiConfig
-from calc_api.calc_methods import util
+from calc_api.calc_methods import util, aggregation, data_api, hazard_memmap, points, return_period_grids, spatial_index
+from calc_api.calc_methods.worker_cache import WorkerCache
 from calc_api.vizz.enums import ScenarioClimateEnum, HazardTypeEnum
 from calc_api.job_management.job_management import database_job
 
@@ -22,6 +24,18 @@ LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(getattr(logging, conf.LOG_LEVEL))
 
 
+def _hazard_nbytes(haz):
+    # Memory-mapped arrays live in the shared page cache, not this process: they don't count against the cache budget
+    arrays = [haz.frequency, haz.event_id, haz.date, haz.orig, haz.centroids.lat, haz.centroids.lon]
+    for mat in [haz.intensity, haz.fraction]:
+        arrays += [mat.data, mat.indices, mat.indptr]
+    return sum(getattr(arr, 'nbytes', 0) for arr in arrays if not hazard_memmap.is_mapped(arr))
+
+
+# Hazards loaded by this worker process, keyed on the Data API request that produced them
+HAZARD_CACHE = WorkerCache('hazard', conf.HAZARD_CACHE_MEMORY, _hazard_nbytes)
+
+
 # TODO split this into get_hazard_by_return_period and get_hazard and make get_hazard_from_api an internal function
 # i.e. this handles all the processing and decoding of a mess of different parameters
 # TODO make this work for multiple return periods too
@@ -48,26 +62,96 @@ def get_hazard_by_return_period(
             scenario_climate=scenario_climate,
             scenario_year=scenario_year
         )
-    haz = get_hazard_from_api(hazard_type, country, scenario_name, scenario_year)
-    # TODO handle polygons, be sure it's not more efficient to make this another link of the chain
-    if location_poly:
-        haz = subset_hazard_extent(haz, location_poly)
 
-    # TODO implement, consider splitting from the chain
-    if aggregation_scale:
-        raise ValueError("API doesn't aggregate output yet")
+    if aggregation_scale and not aggregation_method:
+        raise ValueError("Need an aggregation method when aggregation_scale is set")
 
     if return_period == "aai":
         raise ValueError("Can't calculate average annual statistics for hazard data")
+    return_period = [float(rp) for rp in return_period] if isinstance(return_period, list) else [float(return_period)]
+
+    # Use the precomputed grid for this request where it has every requested return period
+    grid_result = None
+    if hazard_type != "extreme_heat":
+        grid = return_period_grids.load_grid(
+            return_period_grids.grid_key(hazard_type, country, scenario_name, scenario_year))
+        if grid is not None:
+            grid_result = return_period_grids.lookup_grid(grid, return_period, location_poly)
+
+    if grid_result is not None:
+        lat, lon, rp_intensity = grid_result
     else:
-        return_period = [float(rp) for rp in return_period] if isinstance(return_period, list) else [float(return_period)]
-        rp_intensity = haz.local_exceedance_inten(return_period)[[0]].flatten()
+        # TODO be sure it's not more efficient to make this another link of the chain
+        haz = get_hazard_in_extent(hazard_type, country, scenario_name, scenario_year, location_poly)
+        lat, lon = haz.centroids.lat, haz.centroids.lon
+        rp_intensity = local_exceedance_intensity(haz, return_period)
+
+    if aggregation_scale:
+        return aggregation.aggregate_points(
+            country, aggregation_scale, aggregation_method, lat, lon,
+            intensity=rp_intensity[0], intensity_by_rp=rp_intensity
+        )
+
+    # 'intensity' is the first requested return period, 'intensity_by_rp' has all of them
+    return points.make_columnar(lat, lon, intensity=rp_intensity[0], intensity_by_rp=rp_intensity)
+
+
+def local_exceedance_intensity(haz, return_periods):
+    """
+    Vectorised equivalent of Hazard.local_exceedance_inten, for every centroid and any number of return periods.
+
+    As in CLIMADA, each centroid's intensities above the hazard's intensity threshold are sorted in descending order,
+    paired with their cumulative event frequencies, and fitted with a linear regression of intensity on
+    log(frequency). Here the sort and all the regressions are done in one pass over the sparse intensity data instead
+    of centroid by centroid. Centroids whose events above the threshold all have the same frequency, such as those
+    with only one, get np.polyfit's minimum-norm line through their mean intensity, and negative extrapolations are
+    set to zero when the hazard has no negative intensities. Returns an array of shape (n_return_periods,
+    n_centroids).
+    """
+    return_periods = np.asarray(return_periods, dtype=float)
+    inten = haz.intensity.tocsc()
+    n_cen = inten.shape[1]
+    n_per_cen = np.diff(inten.indptr)
+
+    # Sort the nonzero intensities by centroid, then by descending intensity. Groups stay where indptr puts them.
+    cen = np.repeat(np.arange(n_cen), n_per_cen)
+    order = np.lexsort((-inten.data, cen))
+    cen = cen[order]
+    data = inten.data[order]
+    cum_freq = np.cumsum(haz.frequency[inten.indices[order]])
+    cum_freq -= np.repeat(np.concatenate([[0], cum_freq])[inten.indptr[:-1]], n_per_cen)
+
+    above_thres = data > haz.intensity_thres
+    cen = cen[above_thres]
+    y = data[above_thres]
+    x = np.log(cum_freq[above_thres])
+
+    n = np.bincount(cen, minlength=n_cen)
+    sum_x = np.bincount(cen, weights=x, minlength=n_cen)
+    sum_y = np.bincount(cen, weights=y, minlength=n_cen)
+    sum_xx = np.bincount(cen, weights=x * x, minlength=n_cen)
+    sum_xy = np.bincount(cen, weights=x * y, minlength=n_cen)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = n * sum_xx - sum_x ** 2
+        fit = (n > 1) & (denominator > 0)
+        slope = np.where(fit, (n * sum_xy - sum_x * sum_y) / denominator, 0)
+        intercept = np.where(n > 0, (sum_y - slope * sum_x) / n, 0)
+
+        # With a single distinct log frequency x0 the regression is underdetermined. np.polyfit scales both columns
+        # to unit norm before its least squares solve, so its minimum-norm answer splits the mean intensity equally
+        # between them: slope mean / (2 x0) and intercept mean / 2. At x0 = 0 there's only the intercept to fit.
+        mean_x = sum_x / n
+        degenerate = (n > 0) & ~fit & (mean_x != 0)
+        slope = np.where(degenerate, intercept / (2 * mean_x), slope)
+        intercept = np.where(degenerate, intercept / 2, intercept)
 
-    return [
-        {"lat": float(lat), "lon": float(lon), "intensity": float(intensity)}
-        for lat, lon, intensity
-        in zip(haz.centroids.lat, haz.centroids.lon, rp_intensity)
-    ]
+    rp_intensity = intercept[np.newaxis, :] + slope[np.newaxis, :] * np.log(1 / return_periods)[:, np.newaxis]
+    rp_intensity[:, n == 0] = 0
+    # As in CLIMADA, extrapolating the fit can't give negative intensities for a hazard that has none
+    if haz.intensity.min() >= 0:
+        rp_intensity[rp_intensity < 0] = 0
+    return rp_intensity
 
 
 
@@ -84,10 +168,7 @@ def get_hazard_by_location(
         location_poly=None,
         aggregation_scale=None,
         aggregation_method=None):
-    haz = get_hazard_from_api(hazard_type, country, scenario_name, scenario_year)
-    # TODO the location bit
-    if location_poly:
-        haz = subset_hazard_extent(haz, location_poly)
+    haz = get_hazard_in_extent(hazard_type, country, scenario_name, scenario_year, location_poly)
     if aggregation_scale:
         raise ValueError("API doesn't aggregate output yet")
 
@@ -99,19 +180,6 @@ def get_hazard_from_api(
         country,
         scenario_climate: ScenarioClimateEnum,
         scenario_year):
-    client = Client()
-    request_properties = {
-        'spatial_coverage': 'country',
-        'country_iso3alpha': country,
-        'nb_synth_tracks': str(conf.DEFAULT_N_TRACKS),
-        'climate_scenario': scenario_climate
-    }
-    if scenario_climate != 'historical':
-        request_properties['ref_year'] = str(scenario_year)
-
-    status = 'preliminary' if hazard_type == "extreme_heat" else "active"
-    version = 'newest'
-
     if hazard_type == "extreme_heat":
         LOGGER.debug('Using dummy extreme heat data')
         centroids = Centroids()
@@ -131,14 +199,125 @@ def get_hazard_from_api(
         haz.check()
         return haz
 
+    dataset = get_hazard_dataset_info(hazard_type, country, scenario_climate, scenario_year)
+
+    # The returned hazard is shared with later calls in this process: don't modify it in place
+    cache_key = _hazard_cache_key(hazard_type, country, scenario_climate, scenario_year, dataset)
+    grid_key = return_period_grids.grid_key(hazard_type, country, scenario_climate, scenario_year)
+    return HAZARD_CACHE.get_or_load(cache_key, lambda: _load_hazard_dataset(hazard_type, dataset, grid_key))
+
+
+def get_hazard_in_extent(
+        hazard_type: HazardTypeEnum,
+        country,
+        scenario_climate: ScenarioClimateEnum,
+        scenario_year,
+        location_poly=None,
+        buffer=300      # arcseconds
+):
+    """
+    Return a hazard with only the centroids inside the buffered location polygon's bounding box.
+
+    If this process already holds the country's hazard it's subset in memory. Otherwise only the dataset's spatial
+    chunks around the location are read from disk, so a small location doesn't load the whole country. Either way
+    the result matches subset_hazard_extent.
+    """
+    if hazard_type == "extreme_heat" or not location_poly:
+        haz = get_hazard_from_api(hazard_type, country, scenario_climate, scenario_year)
+        return subset_hazard_extent(haz, location_poly, buffer) if location_poly else haz
+
+    dataset = get_hazard_dataset_info(hazard_type, country, scenario_climate, scenario_year)
+    cache_key = _hazard_cache_key(hazard_type, country, scenario_climate, scenario_year, dataset)
+    haz = HAZARD_CACHE.get(cache_key)
+    if haz is not None:
+        return subset_hazard_extent(haz, location_poly, buffer)
+
+    def on_full_load(full_haz):
+        # This request is the one chunking the dataset, so it has the full country anyway
+        if not conf.HAZARD_MEMMAP:
+            HAZARD_CACHE.put(cache_key, full_haz)
+        grid_key = return_period_grids.grid_key(hazard_type, country, scenario_climate, scenario_year)
+        ensure_return_period_grid(full_haz, hazard_type, dataset, grid_key)
+
+    return data_api.load_hazard_in_extent(dataset, util.buffered_bounds(location_poly, buffer), on_full_load)
+
+
+def _hazard_cache_key(hazard_type, country, scenario_climate, scenario_year, dataset):
+    return (
+        hazard_type,
+        country,
+        scenario_climate,
+        None if scenario_climate == 'historical' else str(scenario_year),
+        str(conf.DEFAULT_N_TRACKS),
+        dataset.version
+    )
+
+
+def get_hazard_dataset_info(
+        hazard_type: HazardTypeEnum,
+        country,
+        scenario_climate: ScenarioClimateEnum,
+        scenario_year):
+    request_properties = {
+        'spatial_coverage': 'country',
+        'country_iso3alpha': country,
+        'nb_synth_tracks': str(conf.DEFAULT_N_TRACKS),
+        'climate_scenario': scenario_climate
+    }
+    if scenario_climate != 'historical':
+        request_properties['ref_year'] = str(scenario_year)
+
+    status = 'preliminary' if hazard_type == "extreme_heat" else "active"
+    version = 'newest'
+
     LOGGER.debug(f'Requesting {status} {hazard_type} hazard from Data API. Request properties: {request_properties}')
     try:
-        return client.get_hazard(hazard_type, properties=request_properties, status=status, version=version)
+        return data_api.get_dataset_info(hazard_type, request_properties, status, version)
     except Client.NoResult as e:
         raise Client.NoResult(f'No result found for request {status} {hazard_type} hazard from Data API. '
                               f'\nRequest properties: {request_properties}'
                               f'\nError: {e}')
 
+
+def _load_hazard_dataset(hazard_type, dataset, grid_key):
+    if conf.HAZARD_MEMMAP:
+        haz = data_api.load_hazard_memmap(dataset)
+    else:
+        haz = data_api.load_hazard(dataset)
+    # First time this dataset is fetched: store its return period grid for get_hazard_by_return_period
+    ensure_return_period_grid(haz, hazard_type, dataset, grid_key)
+    return haz
+
+
+def ensure_return_period_grid(haz, hazard_type, dataset, grid_key):
+    """Build a request's return period grid from its full country hazard, unless it's current for the dataset."""
+    if return_period_grids.grid_is_current(grid_key, dataset):
+        return
+    try:
+        save_return_period_grid(haz, hazard_type, dataset, grid_key)
+    except OSError as err:
+        LOGGER.warning(f'Could not save return period grid {grid_key}. Error: {err}')
+
+
+def save_return_period_grid(haz, hazard_type, dataset, grid_key):
+    return_periods = return_period_grids.grid_return_periods(hazard_type)
+    rp_intensity = local_exceedance_intensity(haz, return_periods)
+    return_period_grids.save_grid(
+        grid_key, dataset, haz.centroids.lat, haz.centroids.lon, return_periods, rp_intensity)
+
+
+def precompute_return_period_grid(hazard_type, country, scenario_climate, scenario_year, overwrite=False):
+    """Make sure the return period grid for a hazard request is current, loading the hazard only if it isn't."""
+    dataset = get_hazard_dataset_info(hazard_type, country, scenario_climate, scenario_year)
+    grid_key = return_period_grids.grid_key(hazard_type, country, scenario_climate, scenario_year)
+    if return_period_grids.grid_is_current(grid_key, dataset) and not overwrite:
+        LOGGER.debug(f'Return period grid {grid_key} is current for dataset {dataset.uuid}')
+        return dataset
+    haz = data_api.load_hazard(dataset)
+    save_return_period_grid(haz, hazard_type, dataset, grid_key)
+    return dataset
+
+
 def get_hazard_event(hazard_type,
                      country,
                      scenario_name,
@@ -163,20 +342,32 @@ def subset_hazard_extent(
         location_poly,
         buffer=300      # arcseconds
 ):
-    location_poly = util.convert_to_polygon(location_poly)
+    """
+    Return a hazard with only the centroids inside the buffered location polygon's bounding box.
 
-    buffer_deg = buffer / (60 * 60)
-    lonmin, latmin, lonmax, latmax = location_poly.bounds
-    latmin = latmin - buffer_deg
-    lonmin = lonmin - buffer_deg
-    latmax = latmax + buffer_deg
-    lonmax = lonmax + buffer_deg
+    Centroids are found with a spatial index that is built once per hazard object. The new hazard shares its event
+    attributes with the original and only the selected columns of the intensity and fraction matrices are copied, so
+    the original must be treated as read-only (as cached hazards already are).
+    """
+    lonmin, latmin, lonmax, latmax = util.buffered_bounds(location_poly, buffer)
 
-    extent = (lonmin, lonmax, latmin, latmax)
+    if not haz.centroids.lat.size:
+        # Raster centroids: let CLIMADA handle them
+        haz = haz.select(extent=(lonmin, lonmax, latmin, latmax))
+        if not haz:
+            raise ValueError('The hazard did not intersect with the requested polygon: no centroids matched')
+        return haz
 
-    haz = haz.select(extent=extent)
-    if not haz:
+    index = spatial_index.get_index(haz, haz.centroids.lat, haz.centroids.lon)
+    sel_cen = index.query(lonmin, latmin, lonmax, latmax)
+    if len(sel_cen) == 0:
         raise ValueError('The hazard did not intersect with the requested polygon: no centroids matched')
-    return haz
+
+    haz_subset = copy.copy(haz)
+    haz_subset.centroids = haz.centroids.select(sel_cen=sel_cen)
+    haz_subset.intensity = haz.intensity[:, sel_cen]
+    if haz.fraction.shape == haz.intensity.shape:
+        haz_subset.fraction = haz.fraction[:, sel_cen]
+    return haz_subset
 
 
@@ -1,20 +1,26 @@
+import hashlib
 import logging
 from cache_memoize import cache_memoize
 from celery import shared_task
 from celery_singleton import Singleton
 import numpy as np
 import copy
+from concurrent.futures import ThreadPoolExecutor
 from scipy import interpolate
 
 from climada.entity import Exposures, ImpactFunc, ImpactFuncSet, ImpfTropCyclone, Entity, MeasureSet, Measure
 from climada.engine import Impact
+from climada.entity.exposures.base import INDICATOR_CENTR
 
-from calc_api.calc_methods.profile import profile
+from calc_api.calc_methods.profile import profile, timed
 from calc_api.config import ClimadaCalcApiConfig
-from calc_api.calc_methods.calc_hazard import get_hazard_from_api, subset_hazard_extent
-from calc_api.calc_methods.calc_exposure import get_exposure_from_api, subset_exposure_extent
+from calc_api.calc_methods.calc_hazard import get_hazard_from_api, get_hazard_in_extent, get_hazard_dataset_info
+from calc_api.calc_methods.centroid_assignment import assign_centroids
+from calc_api.calc_methods.calc_exposure import get_exposure_from_api, get_base_exposure_from_api, scale_exposure, \
+    resolve_exposure_request, get_exposure_dataset_info
 from calc_api.vizz.enums import exposure_type_from_impact_type, HAZARD_TO_ABBREVIATION
 from calc_api.calc_methods.util import standardise_scenario
+from calc_api.calc_methods import aggregation, impact_matrices, impf_lookup, points
 from calc_api.vizz import units
 from calc_api.job_management.job_management import database_job
 
@@ -43,33 +49,204 @@ def get_impact_by_return_period(
         measures=None,
         location_poly=None,
         aggregation_scale=None,
-        save_frequency_curve=False):
+        save_frequency_curve=False,
+        aggregation_method=None):
 
     LOGGER.debug('Starting impact by RP calculation. Locals: ' + str(locals()))
 
+    if conf.IMPACT_REUSE_COUNTRY_MATRIX and location_poly and not measures:
+        imp = get_location_impact_from_country(
+            country, hazard_type, exposure_type, impact_type, scenario_name, scenario_growth, scenario_climate,
+            hazard_year, exposure_year, location_poly
+        )
+        return summarise_impact(
+            imp, None, return_periods, aggregation_scale, save_frequency_curve, country, aggregation_method
+        )
+
+    haz, exp, exposure_type = _load_impact_inputs(
+        country, hazard_type, exposure_type, impact_type, scenario_name, scenario_growth, scenario_climate,
+        hazard_year, exposure_year, location_poly
+    )
+
+    save_mat = save_frequency_curve or aggregation_scale != 'all'
+    summary_args = _summary_args(return_periods, country, aggregation_scale, aggregation_method)
+    imp = calculate_impact(haz, exp, hazard_type, exposure_type, impact_type, measures, save_mat, summary_args)
+    return summarise_impact(
+        imp, exp, return_periods, aggregation_scale, save_frequency_curve, country, aggregation_method
+    )
+
+
+@shared_task(base=Singleton)
+@database_job
+def get_measure_impacts_by_return_period(
+        country,
+        hazard_type,
+        return_periods,
+        exposure_type=None,
+        impact_type=None,
+        scenario_name=None,
+        scenario_growth=None,
+        scenario_climate=None,
+        hazard_year=None,
+        exposure_year=None,
+        measures=None,
+        location_poly=None,
+        aggregation_scale=None,
+        save_frequency_curve=False,
+        aggregation_method=None):
+    """
+    Batched version of get_impact_by_return_period for adaptation measures.
+
+    Loads the hazard and exposure once and returns a list of get_impact_by_return_period results: the baseline
+    (no measures) first, then one result for each measure in measures, each applied on its own.
+    """
+    LOGGER.debug('Starting batched measure impact calculation. Locals: ' + str(locals()))
+
+    haz, exp, exposure_type = _load_impact_inputs(
+        country, hazard_type, exposure_type, impact_type, scenario_name, scenario_growth, scenario_climate,
+        hazard_year, exposure_year, location_poly
+    )
+
+    save_mat = save_frequency_curve or aggregation_scale != 'all'
+    summary_args = _summary_args(return_periods, country, aggregation_scale, aggregation_method)
+    imp_list = calculate_measure_impacts(
+        haz, exp, hazard_type, exposure_type, impact_type, measures, save_mat, summary_args
+    )
+    return [
+        summarise_impact(
+            imp, exp, return_periods, aggregation_scale, save_frequency_curve, country, aggregation_method
+        )
+        for imp in imp_list
+    ]
+
+
+def _load_impact_inputs(
+        country,
+        hazard_type,
+        exposure_type,
+        impact_type,
+        scenario_name,
+        scenario_growth,
+        scenario_climate,
+        hazard_year,
+        exposure_year,
+        location_poly):
+    exposure_type, scenario_name, scenario_growth, scenario_climate = _standardise_impact_inputs(
+        exposure_type, impact_type, scenario_name, scenario_growth, scenario_climate, hazard_year, exposure_year
+    )
+    haz, exp = load_hazard_and_exposure(
+        country, hazard_type, exposure_type, impact_type, scenario_name, scenario_growth, scenario_climate,
+        hazard_year, exposure_year, location_poly
+    )
+    return haz, exp, exposure_type
+
+
+def _standardise_impact_inputs(
+        exposure_type,
+        impact_type,
+        scenario_name,
+        scenario_growth,
+        scenario_climate,
+        hazard_year,
+        exposure_year):
     if not exposure_type:
         exposure_type = exposure_type_from_impact_type(impact_type)
 
     scenario_name, scenario_growth, scenario_climate = standardise_scenario(scenario_name, scenario_growth, scenario_climate)
     scenario_climate = scenario_climate if int(hazard_year) != 2020 else 'historical'
     scenario_growth = scenario_growth if int(exposure_year) != 2020 else 'historical'
+    return exposure_type, scenario_name, scenario_growth, scenario_climate
 
-    # TODO: consider making these simultaneous calls?
-    haz = get_hazard_from_api(hazard_type, country, scenario_climate, hazard_year)
-    exp = get_exposure_from_api(country, exposure_type, impact_type, scenario_name, scenario_growth, exposure_year)
 
-    if location_poly:
-        haz = subset_hazard_extent(haz, location_poly)
-        exp = subset_exposure_extent(exp, location_poly)
-
-    save_mat = save_frequency_curve or aggregation_scale != 'all'
+def get_location_impact_from_country(
+        country,
+        hazard_type,
+        exposure_type,
+        impact_type,
+        scenario_name,
+        scenario_growth,
+        scenario_climate,
+        hazard_year,
+        exposure_year,
+        location_poly):
+    """
+    The impact for a location, taken from the columns of the stored country-wide impact matrix.
+
+    The first request in a country calculates the impact for the whole country with save_mat=True and stores its
+    event x exposure point matrix. Every later location in the country sums the columns for its exposure points
+    instead of loading and calculating anything. Points get the impacts they have in the country-wide run, which
+    can differ at the edges of a location from a run on the subset hazard, where a point's nearest centroid may lie
+    outside the location's buffer.
+    """
+    exposure_type, scenario_name, scenario_growth, scenario_climate = _standardise_impact_inputs(
+        exposure_type, impact_type, scenario_name, scenario_growth, scenario_climate, hazard_year, exposure_year
+    )
+    # The key has everything the matrix depends on, including the dataset versions the request currently resolves to,
+    # so a newly published dataset or a changed impact function gets a new matrix
+    if hazard_type == 'extreme_heat':
+        hazard_version = 'dummy'
+    else:
+        hazard_version = get_hazard_dataset_info(hazard_type, country, scenario_climate, hazard_year).version
+    exposure_properties, _ = resolve_exposure_request(
+        country, exposure_type, impact_type, scenario_name, scenario_growth, exposure_year
+    )
+    key = impact_matrices.matrix_key(
+        country=country,
+        hazard_type=hazard_type,
+        exposure_type=exposure_type,
+        impact_type=impact_type,
+        scenario_name=scenario_name,
+        scenario_growth=scenario_growth,
+        scenario_climate=scenario_climate,
+        hazard_year=str(hazard_year),
+        exposure_year=str(exposure_year),
+        n_tracks=str(conf.DEFAULT_N_TRACKS),
+        hazard_version=str(hazard_version),
+        exposure_version=str(get_exposure_dataset_info(exposure_properties).version),
+        impact_function=_impact_function_key(hazard_type, exposure_type, impact_type),
+        min_dist_to_centroids=str(conf.DEFAULT_MIN_DIST_TO_CENTROIDS)
+    )
+    stored = impact_matrices.get_matrix(key)
+    if stored is None:
+        # Only one process calculates a country's matrix: the others wait for it and read the stored matrix
+        with impact_matrices.matrix_lock(key):
+            stored = impact_matrices.get_matrix(key)
+            if stored is None:
+                LOGGER.debug(f'No stored impact matrix for {country}: calculating it for the whole country')
+                haz, exp = load_hazard_and_exposure(
+                    country, hazard_type, exposure_type, impact_type, scenario_name, scenario_growth,
+                    scenario_climate, hazard_year, exposure_year
+                )
+                imp = calculate_impact(haz, exp, hazard_type, exposure_type, impact_type, save_mat=True)
+                stored = impact_matrices.save_matrix(key, imp)
+    return impact_matrices.location_impact(stored, location_poly)
+
+
+def _impact_function_key(hazard_type, exposure_type, impact_type):
+    impf = infer_impactfuncset(hazard_type, exposure_type, impact_type).get_func(fun_id=1)[0]
+    curve = [np.asarray(arr, dtype=float).tobytes() for arr in (impf.intensity, impf.mdd, impf.paa)]
+    return hashlib.md5(impf.haz_type.encode() + b''.join(curve)).hexdigest()
+
+
+def calculate_impact(
+        haz,
+        exp,
+        hazard_type,
+        exposure_type,
+        impact_type,
+        measures=None,
+        save_mat=False,
+        summary_args=None):
+    # exp gets an impact function column (and a centroid column from Impact.calc): it must be a private copy
+    # summary_args describe what summarise_impact will be asked for: see calc_impact_chunked
     impact_funcs = infer_impactfuncset(hazard_type, exposure_type, impact_type)
     impf_name = impact_funcs.get_func(haz_type=haz.tag.haz_type, fun_id=1).name
     exp.gdf[impf_name] = 1
+    if INDICATOR_CENTR + haz.tag.haz_type not in exp.gdf:
+        assign_centroids(exp, haz)
 
     if not measures:
-        imp = Impact()
-        imp.calc(exp, impact_funcs, haz, save_mat=save_mat)
+        imp = _impact_calc(exp, impact_funcs, haz, save_mat, summary_args)
     else:
         measure_set = MeasureSet()
         basic_impf = impact_funcs.get_func(fun_id=1)[0]
@@ -77,18 +254,10 @@ def get_impact_by_return_period(
             LOGGER.warning('Currently we only apply the first measure. Combined measures comes later.')
         for measure_dict in measures:
             # TODO wrap this in another method (or write an __init__ for the climada class)
-            gonna_need_a_new_impf = measure_dict['hazard_cutoff'] is not None and measure_dict['hazard_cutoff'] > 0
+            gonna_need_a_new_impf = _needs_cutoff_impf(measure_dict)
             if gonna_need_a_new_impf:
-                new_impf = copy.deepcopy(basic_impf)
+                new_impf = make_cutoff_impf(basic_impf, measure_dict['hazard_cutoff'])
                 new_impf.id = 2
-                cutoff = measure_dict['hazard_cutoff']
-                extra_points = np.array([cutoff, cutoff])
-                new_impf.intensity = np.sort(np.append(basic_impf.intensity, extra_points))
-                f_interpolate_mdd = interpolate.interp1d(basic_impf.intensity, basic_impf.mdd)
-                cutoff_mdd_value = f_interpolate_mdd(cutoff)
-                ix = np.array(basic_impf.intensity < cutoff)
-                new_impf.mdd = np.append(np.append(np.zeros(sum(ix) + 1), cutoff_mdd_value), basic_impf.mdd[~ix])
-                new_impf.paa = np.ones_like(new_impf.mdd)
                 impact_funcs.append(new_impf)
 
             m = Measure()
@@ -130,6 +299,174 @@ def get_impact_by_return_period(
 
             imp, _ = m.calc_impact(exposures=exp, imp_fun_set=impact_funcs, hazard=haz)
 
+    return imp
+
+
+def calculate_measure_impacts(
+        haz,
+        exp,
+        hazard_type,
+        exposure_type,
+        impact_type,
+        measures=None,
+        save_mat=False,
+        summary_args=None):
+    """
+    Calculate the baseline impact and the impact of each measure in a list, sharing one hazard and exposure.
+
+    Measures that only change hazard intensities or raise the impact function cutoff are applied to the impact
+    function set, the equivalent of CLIMADA's Measure.apply, so the hazard and exposure are never copied. Measures
+    with a return period cutoff need a full CLIMADA measure calculation and fall back to calculate_impact.
+    Returns a list of Impacts: the baseline first, then one per measure.
+    """
+    impact_funcs = infer_impactfuncset(hazard_type, exposure_type, impact_type)
+    impf_name = impact_funcs.get_func(haz_type=haz.tag.haz_type, fun_id=1).name
+    exp.gdf[impf_name] = 1
+    if INDICATOR_CENTR + haz.tag.haz_type not in exp.gdf:
+        assign_centroids(exp, haz)
+
+    imp_list = [_impact_calc(exp, impact_funcs, haz, save_mat, summary_args)]
+
+    for measure_dict in measures or []:
+        if measure_dict['return_period_cutoff']:
+            imp_list.append(calculate_impact(haz, exp, hazard_type, exposure_type, impact_type, [measure_dict], save_mat))
+            continue
+        if measure_dict['percentage_coverage'] != 100:
+            raise ValueError('Percentage coverage not yet implemented')
+        if measure_dict['percentage_effectiveness'] != 100:
+            raise ValueError('Percentage assets affected not yet implemented')
+
+        measure_funcs = _measure_impactfuncset(impact_funcs, measure_dict)
+        imp_list.append(_impact_calc(exp, measure_funcs, haz, save_mat, summary_args))
+
+    return imp_list
+
+
+def _summary_args(return_periods, country=None, aggregation_scale=None, aggregation_method=None):
+    return {
+        'return_periods': return_periods,
+        'country': country,
+        'aggregation_scale': aggregation_scale,
+        'aggregation_method': aggregation_method
+    }
+
+
+def _impact_calc(exp, impact_funcs, haz, save_mat=False, summary_args=None):
+    # With impact.chunked set, and when the caller has said how the impact will be summarised, stream the exposure
+    if conf.IMPACT_CHUNKED and summary_args is not None:
+        return calc_impact_chunked(exp, impact_funcs, haz, **summary_args)
+    imp = Impact()
+    imp.calc(exp, impact_funcs, haz, save_mat=save_mat)
+    return imp
+
+
+def calc_impact_chunked(
+        exp,
+        impact_funcs,
+        haz,
+        return_periods=None,
+        country=None,
+        aggregation_scale=None,
+        aggregation_method=None):
+    """
+    Equivalent of Impact.calc that streams the exposure through the calculation in blocks of conf.CHUNK_SIZE points.
+
+    Only one block's impact matrix exists at a time. at_event and eai_exp are accumulated as in Impact.calc, which
+    is all that summaries over the whole area and frequency curves need. Anything else summarise_impact will need is
+    reduced block by block into imp.chunk_summary: each region's total impact per event for summed regional
+    aggregation, or each point's impacts by return period otherwise. The returned Impact has no imp_mat, so peak
+    memory depends on the block size and the number of events, not on the size of the country.
+    """
+    n_points, n_events = exp.gdf.shape[0], haz.intensity.shape[0]
+    lat = exp.gdf['latitude'].to_numpy(dtype=float)
+    lon = exp.gdf['longitude'].to_numpy(dtype=float)
+
+    summary = {}
+    region_matrix = None
+    if aggregation_scale and aggregation_scale != 'all' and (aggregation_method or 'sum') == 'sum':
+        region_ids, region_names = aggregation.get_region_ids(country, aggregation_scale, lat, lon)
+        region_matrix = aggregation.region_matrix(region_ids, len(region_names))
+        summary['region_event_imp'] = np.zeros((n_events, len(region_names)))
+    elif aggregation_scale != 'all' and return_periods is not None:
+        summary['return_periods'] = list(return_periods)
+        summary['rp_imp'] = np.zeros((len(summary['return_periods']), n_points))
+    save_mat = bool(summary)
+
+    imp = Impact()
+    imp.at_event = np.zeros(n_events)
+    imp.eai_exp = np.zeros(n_points)
+    exp_chunk = copy.copy(exp)
+    for start in range(0, n_points, conf.CHUNK_SIZE):
+        stop = min(start + conf.CHUNK_SIZE, n_points)
+        exp_chunk.gdf = exp.gdf.iloc[start:stop]
+        imp_chunk = Impact()
+        imp_chunk.calc(exp_chunk, impact_funcs, haz, save_mat=save_mat)
+        imp.at_event += imp_chunk.at_event
+        imp.eai_exp[start:stop] = imp_chunk.eai_exp
+        imp.tot_value += imp_chunk.tot_value
+        if 'region_event_imp' in summary:
+            summary['region_event_imp'] += (imp_chunk.imp_mat @ region_matrix[start:stop]).toarray()
+        elif 'rp_imp' in summary:
+            summary['rp_imp'][:, start:stop] = pointwise_rp_impacts(imp_chunk, summary['return_periods'])
+    LOGGER.debug(f'Calculated impacts for {n_points} exposure points in blocks of {conf.CHUNK_SIZE}')
+
+    imp.unit = exp.value_unit
+    imp.event_id = haz.event_id
+    imp.event_name = haz.event_name
+    imp.date = haz.date
+    imp.frequency = haz.frequency
+    imp.coord_exp = np.stack([lat, lon], axis=1)
+    imp.tag = {'exp': exp.tag, 'impf_set': impact_funcs.tag, 'haz': haz.tag}
+    imp.crs = exp.crs
+    imp.aai_agg = np.sum(imp.at_event * haz.frequency)
+    imp.chunk_summary = summary
+    return imp
+
+
+def _needs_cutoff_impf(measure_dict):
+    return measure_dict['hazard_cutoff'] is not None and measure_dict['hazard_cutoff'] > 0
+
+
+def make_cutoff_impf(basic_impf, cutoff):
+    # A copy of the impact function with no impacts below the cutoff intensity
+    new_impf = copy.deepcopy(basic_impf)
+    extra_points = np.array([cutoff, cutoff])
+    new_impf.intensity = np.sort(np.append(basic_impf.intensity, extra_points))
+    f_interpolate_mdd = interpolate.interp1d(basic_impf.intensity, basic_impf.mdd)
+    cutoff_mdd_value = f_interpolate_mdd(cutoff)
+    ix = np.array(basic_impf.intensity < cutoff)
+    new_impf.mdd = np.append(np.append(np.zeros(sum(ix) + 1), cutoff_mdd_value), basic_impf.mdd[~ix])
+    new_impf.paa = np.ones_like(new_impf.mdd)
+    return new_impf
+
+
+def _measure_impactfuncset(impact_funcs, measure_dict):
+    # Build the impact function set that a measure would give, without remapping the exposure's impact function ids:
+    # the cutoff function replaces function 1, then the hazard intensity change is applied the same way as CLIMADA's
+    # Measure._change_imp_func, i.e. intensity * multiplier - constant
+    basic_impf = impact_funcs.get_func(fun_id=1)[0]
+    if _needs_cutoff_impf(measure_dict):
+        measure_impf = make_cutoff_impf(basic_impf, measure_dict['hazard_cutoff'])
+    else:
+        measure_impf = copy.deepcopy(basic_impf)
+
+    multiplier = measure_dict['hazard_change_multiplier'] or 1
+    constant = measure_dict['hazard_change_constant'] or 0
+    measure_impf.intensity = np.maximum(measure_impf.intensity * multiplier - constant, 0.0)
+
+    measure_funcs = ImpactFuncSet()
+    measure_funcs.append(measure_impf)
+    return measure_funcs
+
+
+def summarise_impact(
+        imp,
+        exp,
+        return_periods,
+        aggregation_scale=None,
+        save_frequency_curve=False,
+        country=None,
+        aggregation_method=None):
     if isinstance(return_periods, list):
         return_periods = np.array(return_periods)
     if isinstance(return_periods, (int, float, str)):
@@ -141,6 +478,11 @@ def get_impact_by_return_period(
     if any(return_periods_int):
         rps = [int(rp) for i, rp in enumerate(return_periods) if return_periods_int[i]]
 
+    if aggregation_scale and aggregation_scale != 'all':
+        return summarise_impact_by_region(
+            imp, return_periods, country, aggregation_scale, aggregation_method or 'sum'
+        )
+
     if aggregation_scale:
         if aggregation_scale == 'all':
             imp_by_rp = np.full(len(return_periods), None, dtype=float)
@@ -181,8 +523,8 @@ def get_impact_by_return_period(
         mean_imp = np.average(imp.at_event, weights=imp.frequency)
 
         return [
-            {"lat": float(np.median(exp.gdf['latitude'])),
-             "lon": float(np.median(exp.gdf['longitude'])),
+            {"lat": float(np.median(imp.coord_exp[:, 0])),
+             "lon": float(np.median(imp.coord_exp[:, 1])),
              "value": list(imp_by_rp),
              "total_freq": total_freq,
              "mean_imp": mean_imp,
@@ -195,24 +537,142 @@ def get_impact_by_return_period(
     # TODO should this be a separate celery job? with the (admittedly large) result above cached?
     # The code here hasn't been used operationally ... activate with care
     LOGGER.warning("THIS CODE ISN'T READY YET: EDIT calc_impact.py")
+    combined_rp_imp = pointwise_rp_impacts(imp, return_periods)
+
+    return points.make_columnar(
+        imp.coord_exp[:, 0],
+        imp.coord_exp[:, 1],
+        value=combined_rp_imp[0],
+        value_by_rp=combined_rp_imp
+    )
+
+
+def pointwise_rp_impacts(imp, return_periods):
+    """Impact at each exposure point for each return period (or 'aai'), shape (n_return_periods, n_points)."""
+    summary = getattr(imp, 'chunk_summary', None) or {}
+    if 'rp_imp' in summary and summary['return_periods'] == list(return_periods):
+        return summary['rp_imp']
+    return_periods_aai = np.array([rp == 'aai' for rp in return_periods])
+    rp_imp = np.zeros((len(return_periods), len(imp.eai_exp)))
     if any(return_periods_aai):
-        imp_rp_aai = imp.eai_exp
+        rp_imp[return_periods_aai] = imp.eai_exp
+    if not all(return_periods_aai):
+        rps = [int(rp) for rp, is_aai in zip(return_periods, return_periods_aai) if not is_aai]
+        rp_imp[~return_periods_aai] = imp.local_exceedance_imp(return_periods=rps)
+    return rp_imp
+
+
+def summarise_impact_by_region(imp, return_periods, country, aggregation_scale, aggregation_method='sum'):
+    """
+    Impacts by return period for each admin region of a country, as a columnar payload with one entry per region.
+
+    Summed impacts are calculated from each region's total impact per event, so a region's 100-year impact is the
+    100-year value of its total impact rather than the sum of its points' 100-year impacts, which would overstate
+    it. Other aggregation methods summarise the pointwise impacts. Needs an Impact calculated with save_mat=True,
+    or by calc_impact_chunked with the same aggregation.
+    """
+    lat, lon = imp.coord_exp[:, 0], imp.coord_exp[:, 1]
+    region_ids, region_names = aggregation.get_region_ids(country, aggregation_scale, lat, lon)
+    n_regions = len(region_names)
+
+    summary = getattr(imp, 'chunk_summary', None) or {}
+    if aggregation_method == 'sum':
+        if 'region_event_imp' in summary:
+            region_event_imp = summary['region_event_imp']
+        else:
+            region_event_imp = (imp.imp_mat @ aggregation.region_matrix(region_ids, n_regions)).toarray()
+        rp_imp = _rp_impacts_from_event_impacts(region_event_imp, imp.frequency, return_periods)
     else:
-        imp_rp_aai = []
+        rp_imp = aggregation.aggregate(pointwise_rp_impacts(imp, return_periods), region_ids, n_regions,
+                                       aggregation_method)
 
-    if any(return_periods_int):
-        imp_rp_int = imp.local_exceedance_imp(return_periods=rps)
-    else:
-        imp_rp_int = []
-    combined_rp_imp = np.empty_like(return_periods)
-    combined_rp_imp[return_periods_aai] = imp_rp_aai
-    combined_rp_imp[return_periods_int] = imp_rp_int
+    return aggregation.regions_to_columnar(lat, lon, region_ids, region_names, value=rp_imp[0], value_by_rp=rp_imp)
 
-    return [
-        {"lat": float(coords[0]), "lon": float(coords[1]), "value": np.array(value)}
-        for coords, value
-        in zip(imp.coord_exp, zip(combined_rp_imp))
-    ]
+
+def _rp_impacts_from_event_impacts(event_imp, frequency, return_periods):
+    # event_imp has shape (n_events, n_regions). As in Impact.calc_freq_curve, each region's event impacts are sorted
+    # and paired with their exceedance frequencies, then interpolated to the requested return periods.
+    return_periods_aai = np.array([rp == 'aai' for rp in return_periods])
+    rp_imp = np.zeros((len(return_periods), event_imp.shape[1]))
+    if any(return_periods_aai):
+        rp_imp[return_periods_aai] = frequency @ event_imp
+    if not all(return_periods_aai):
+        rps = [int(rp) for rp, is_aai in zip(return_periods, return_periods_aai) if not is_aai]
+        order = np.argsort(event_imp, axis=0)
+        sorted_imp = np.take_along_axis(event_imp, order, axis=0)
+        exceedance_freq = np.cumsum(frequency[order][::-1], axis=0)[::-1]
+        with np.errstate(divide='ignore'):
+            return_per = 1 / exceedance_freq
+        rp_imp[~return_periods_aai] = np.stack([
+            np.interp(rps, return_per[:, i], sorted_imp[:, i])
+            for i in range(event_imp.shape[1])
+        ], axis=1)
+    return rp_imp
+
+
+def load_hazard_and_exposure(
+        country,
+        hazard_type,
+        exposure_type,
+        impact_type,
+        scenario_name,
+        scenario_growth,
+        scenario_climate,
+        hazard_year,
+        exposure_year,
+        location_poly=None):
+    """
+    Load and subset the hazard and exposure for an impact calculation.
+
+    With impact.concurrent-loading set in the config the two loads run in a thread pool, so the time taken is roughly
+    the slower of the two rather than their sum. The time spent in each stage is logged either way.
+    """
+    timings = {}
+
+    def load_haz():
+        return load_hazard(country, hazard_type, scenario_climate, hazard_year, location_poly, timings)
+
+    def load_exp():
+        return load_exposure(
+            country, exposure_type, impact_type, scenario_name, scenario_growth, exposure_year, location_poly, timings
+        )
+
+    with timed('hazard and exposure load', timings):
+        if conf.IMPACT_CONCURRENT_LOADING:
+            with ThreadPoolExecutor(max_workers=conf.IMPACT_LOADING_THREADS) as executor:
+                haz_future = executor.submit(load_haz)
+                exp_future = executor.submit(load_exp)
+                haz, exp = haz_future.result(), exp_future.result()
+        else:
+            haz, exp = load_haz(), load_exp()
+
+    LOGGER.info('Impact data loading times (s): ' + ', '.join([f'{k}: {v:.3f}' for k, v in timings.items()]))
+    return haz, exp
+
+
+def load_hazard(country, hazard_type, scenario_climate, hazard_year, location_poly=None, timings=None):
+    # With a location, only the hazard around it is loaded (or subset, if this worker already holds the country)
+    with timed('hazard load', timings):
+        return get_hazard_in_extent(hazard_type, country, scenario_climate, hazard_year, location_poly)
+
+
+def load_exposure(
+        country,
+        exposure_type,
+        impact_type,
+        scenario_name,
+        scenario_growth,
+        exposure_year,
+        location_poly=None,
+        timings=None):
+    # Returns a private, scaled copy of the exposure that can be modified by the impact calculation
+    with timed('exposure load', timings):
+        exp, exp_scaling = get_base_exposure_from_api(
+            country, exposure_type, impact_type, scenario_name, scenario_growth, exposure_year, location_poly
+        )
+    with timed('exposure scale', timings):
+        exp = scale_exposure(exp, exp_scaling)
+    return exp
 
 
 def get_impact_event(
@@ -224,7 +684,8 @@ def get_impact_event(
         scenario_year,
         event_name,
         location_poly=None,
-        aggregation_scale=None):
+        aggregation_scale=None,
+        aggregation_method=None):
 
     # TODO
     haz = get_hazard_from_api(hazard_type, country, scenario_name, scenario_year)
@@ -275,6 +736,9 @@ def infer_impactfuncset(
     else:
         raise ValueError("exposure_type must be either 'economic_assets' or 'people'")
 
+    if conf.IMPACT_FUNCTION_LOOKUP:
+        impf = impf_lookup.LookupImpactFunc.from_impf(impf)
+
     abbrv = HAZARD_TO_ABBREVIATION[hazard_type]
     impf.name = 'impf_' + abbrv
     impf.id = 1
@@ -0,0 +1,60 @@
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+
+from climada.util.constants import SYSTEM_DIR
+from climada.entity.exposures.base import INDICATOR_CENTR
+
+from calc_api.config import ClimadaCalcApiConfig
+from calc_api.calc_methods import util
+
+conf = ClimadaCalcApiConfig()
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(getattr(logging, conf.LOG_LEVEL))
+
+ASSIGNMENT_DIR = Path(SYSTEM_DIR, 'calc_api', 'centroid_assignments')
+
+
+def assign_centroids(exp, haz):
+    """
+    Add the exposure -> hazard centroid assignment column to exp, reusing a stored assignment where one exists.
+
+    Every year, scenario and measure calculated for a location uses the same exposure points and hazard centroids, so
+    the nearest-neighbour search only needs to run once. Assignments are stored on disk, keyed by the exposure
+    coordinates, the hazard centroid coordinates and conf.DEFAULT_MIN_DIST_TO_CENTROIDS.
+    """
+    column = INDICATOR_CENTR + haz.tag.haz_type
+    path = Path(ASSIGNMENT_DIR, f'{assignment_key(exp, haz)}.npy')
+
+    if path.exists():
+        try:
+            assignment = np.load(path)
+            if len(assignment) == exp.gdf.shape[0]:
+                LOGGER.debug(f'Using stored centroid assignment {path.name}')
+                exp.gdf[column] = assignment
+                return exp
+            LOGGER.warning(f'Stored centroid assignment {path.name} has the wrong length. Recalculating')
+        except (OSError, ValueError) as err:
+            LOGGER.warning(f'Could not read stored centroid assignment {path.name}. Recalculating. Error: {err}')
+
+    exp.assign_centroids(haz, threshold=conf.DEFAULT_MIN_DIST_TO_CENTROIDS)
+    _save_assignment(path, exp.gdf[column].to_numpy())
+    return exp
+
+
+def assignment_key(exp, haz):
+    exp_hash = util.coords_hash(exp.gdf['latitude'], exp.gdf['longitude'])
+    centroids_hash = util.coords_hash(haz.centroids.lat, haz.centroids.lon)
+    return f'{exp_hash}_{centroids_hash}_{conf.DEFAULT_MIN_DIST_TO_CENTROIDS:g}'
+
+
+def _save_assignment(path, assignment):
+    # Write to a temporary file and rename so that other processes never read a partial file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.part')
+    with open(tmp_path, 'wb') as f:
+        np.save(f, assignment)
+    os.replace(tmp_path, path)
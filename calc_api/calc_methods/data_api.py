@@ -0,0 +1,249 @@
+import fcntl
+import json
+import logging
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+import requests
+
+from climada.util.api_client import Client
+from climada.util.constants import SYSTEM_DIR
+from climada.hazard import Hazard
+from climada.entity.exposures import Exposures
+
+from calc_api.config import ClimadaCalcApiConfig
+from calc_api.util import file_checksum, HASH_FUNCS
+from calc_api.calc_methods import exposure_tiles, exposure_totals, hazard_chunks, hazard_memmap
+
+conf = ClimadaCalcApiConfig()
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(getattr(logging, conf.LOG_LEVEL))
+
+# Downloads are shared by every worker process on the machine: one directory per Data API dataset
+DOWNLOAD_DIR = Path(SYSTEM_DIR, 'calc_api', 'downloads')
+READY_MARKER = '.ready'
+LOCK_FILE = '.lock'
+TILE_DIR = 'tiles'
+HAZARD_CHUNK_DIR = 'hazard_chunks'
+HAZARD_MEMMAP_DIR = 'memmap'
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def get_dataset_info(data_type, properties, status='preliminary', version='newest'):
+    client = Client()
+    return client.get_dataset_info(data_type=data_type, properties=properties, status=status, version=version)
+
+
+def get_exposures(exposures_type, properties, status='preliminary', version='newest', bounds=None):
+    """
+    Load an exposure dataset. With bounds = (lonmin, latmin, lonmax, latmax), only the points within them are loaded,
+    read from the dataset's spatial tiles.
+    """
+    dataset = get_dataset_info(exposures_type, properties, status, version)
+    if bounds is None:
+        return load_exposures(dataset)
+    return load_exposures_in_extent(dataset, bounds)
+
+
+def get_exposures_ranges(exposures_type, properties, status='preliminary', version='newest'):
+    """The [min, max] of each numeric column of an exposure dataset, read from its tile index."""
+    dataset = get_dataset_info(exposures_type, properties, status, version)
+    return exposure_tiles.read_index(tile_exposures(dataset))['ranges']
+
+
+def load_hazard(dataset):
+    hazard_list = [Hazard.from_hdf5(path) for path in _hdf5_files(dataset)]
+    if not hazard_list:
+        raise ValueError(f'No hdf5 files found in dataset {dataset.uuid}')
+    if len(hazard_list) == 1:
+        return hazard_list[0]
+    hazard_concat = Hazard()
+    hazard_concat = hazard_concat.concat(hazard_list)
+    hazard_concat.sanitize_event_ids()
+    hazard_concat.check()
+    return hazard_concat
+
+
+def load_hazard_memmap(dataset):
+    """
+    Load a hazard dataset with its arrays memory-mapped from a flat on-disk layout, shared by every process.
+
+    The first request loads the dataset in full and writes the layout under the dataset's file lock.
+    """
+    layout_dir = Path(DOWNLOAD_DIR, str(dataset.uuid), HAZARD_MEMMAP_DIR)
+    if not hazard_memmap.layout_exists(layout_dir):
+        with _derived_data_lock(dataset):
+            if not hazard_memmap.layout_exists(layout_dir):
+                haz = load_hazard(dataset)
+                hazard_memmap.write_layout(haz, layout_dir)
+                del haz
+    return hazard_memmap.open_layout(layout_dir)
+
+
+def load_hazard_in_extent(dataset, bounds, on_full_load=None):
+    return hazard_chunks.read_chunks(chunk_hazard(dataset, on_full_load), bounds)
+
+
+def chunk_hazard(dataset, on_full_load=None):
+    """
+    Make sure a downloaded hazard dataset has been split into spatial chunks and return the chunk directory.
+
+    As with tile_exposures, the first request loads the dataset in full and writes the chunks under the dataset's
+    file lock. If it does, the full hazard is passed to on_full_load, so the caller can make use of it.
+    """
+    chunk_dir = Path(DOWNLOAD_DIR, str(dataset.uuid), HAZARD_CHUNK_DIR)
+    if hazard_chunks.chunks_exist(chunk_dir):
+        return chunk_dir
+    with _derived_data_lock(dataset):
+        if not hazard_chunks.chunks_exist(chunk_dir):
+            haz = load_hazard(dataset)
+            hazard_chunks.write_chunks(haz, chunk_dir)
+            if on_full_load:
+                on_full_load(haz)
+    return chunk_dir
+
+
+def load_exposures(dataset):
+    exposures_list = [Exposures.from_hdf5(path) for path in _hdf5_files(dataset)]
+    if not exposures_list:
+        raise ValueError(f'No hdf5 files found in dataset {dataset.uuid}')
+    if len(exposures_list) == 1:
+        return exposures_list[0]
+    exposures_concat = Exposures()
+    exposures_concat = exposures_concat.concat(exposures_list)
+    exposures_concat.check()
+    return exposures_concat
+
+
+def load_exposures_in_extent(dataset, bounds, table_key=None):
+    return exposure_tiles.read_tiles(tile_exposures(dataset, table_key), bounds)
+
+
+def tile_exposures(dataset, table_key=None):
+    """
+    Make sure a downloaded exposure dataset has been split into spatial tiles and return the tile directory.
+
+    The first request for a dataset loads it in full and writes the tiles, and with a table_key (see
+    exposure_totals.table_key) the exposure's summed-area table, holding the dataset's file lock so that only one
+    process does it. Later requests only read the tiles they need.
+    """
+    tile_dir = Path(DOWNLOAD_DIR, str(dataset.uuid), TILE_DIR)
+
+    def table_needed():
+        return table_key is not None and not exposure_totals.table_is_current(table_key, dataset)
+
+    if exposure_tiles.tiles_exist(tile_dir) and not table_needed():
+        return tile_dir
+    with _derived_data_lock(dataset):
+        write_tiles = not exposure_tiles.tiles_exist(tile_dir)
+        write_table = table_needed()
+        if write_tiles or write_table:
+            exp = load_exposures(dataset)
+            if write_tiles:
+                exposure_tiles.write_tiles(exp, tile_dir)
+            if write_table:
+                save_exposure_table(dataset, exp, table_key)
+    return tile_dir
+
+
+def save_exposure_table(dataset, exp, table_key):
+    try:
+        exposure_totals.save_table(table_key, dataset, exp)
+    except OSError as err:
+        LOGGER.warning(f'Could not save summed-area table for exposure dataset {dataset.uuid}. Error: {err}')
+
+
+def _hdf5_files(dataset):
+    paths = download_dataset(dataset)
+    return [path for path, fileinfo in zip(paths, dataset.files) if fileinfo.file_format == 'hdf5']
+
+
+def download_dataset(dataset):
+    """
+    Make sure all files in a Data API dataset are on local disk and return their paths, in dataset.files order.
+
+    Exactly one process downloads a dataset. Any other process asking for it blocks on the dataset's file lock and
+    wakes up as soon as the download is finished. Files are written to a temporary name and renamed into place, and
+    the dataset is only marked as ready once every file is complete, so readers never see a partial file.
+    """
+    target_dir = Path(DOWNLOAD_DIR, str(dataset.uuid))
+    paths = [Path(target_dir, fileinfo.file_name) for fileinfo in dataset.files]
+    marker = Path(target_dir, READY_MARKER)
+
+    if marker.exists():
+        return paths
+
+    target_dir.mkdir(parents=True, exist_ok=True)
+    with file_lock(Path(target_dir, LOCK_FILE)):
+        if marker.exists():
+            LOGGER.debug(f'Dataset {dataset.uuid} was downloaded by another process')
+            return paths
+        LOGGER.debug(f'Downloading dataset {dataset.uuid} to {target_dir}')
+        for path, fileinfo in zip(paths, dataset.files):
+            if not path.exists():
+                _download_file(fileinfo, path)
+        _atomic_write_text(marker, json.dumps([fileinfo.file_name for fileinfo in dataset.files]))
+
+    return paths
+
+
+@contextmanager
+def _derived_data_lock(dataset):
+    """
+    Hold a dataset's file lock while building files derived from it, such as tiles and chunks.
+
+    The dataset is downloaded first: the download takes the same lock, and flock isn't reentrant. Callers re-check
+    for their files once they hold the lock, so only the first process loads the full dataset.
+    """
+    download_dataset(dataset)
+    with file_lock(Path(DOWNLOAD_DIR, str(dataset.uuid), LOCK_FILE)):
+        yield
+
+
+@contextmanager
+def file_lock(path):
+    # flock is released by the kernel if the holder dies, so a crashed download never leaves a stale lock
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _download_file(fileinfo, path):
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.part')
+    try:
+        with requests.get(fileinfo.url, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+        _check_file(tmp_path, fileinfo)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def _check_file(path, fileinfo):
+    if fileinfo.file_size and path.stat().st_size != fileinfo.file_size:
+        raise IOError(f'Downloaded file {fileinfo.file_name} has the wrong size: '
+                      f'expected {fileinfo.file_size}, got {path.stat().st_size}')
+    if fileinfo.check_sum:
+        hash_func = fileinfo.check_sum.split(':')[0]
+        if hash_func not in HASH_FUNCS:
+            LOGGER.warning(f'Unrecognised checksum type for {fileinfo.file_name}: {fileinfo.check_sum}. Not checking.')
+        elif file_checksum(path, hash_func) != fileinfo.check_sum:
+            raise IOError(f'Downloaded file {fileinfo.file_name} failed its checksum')
+
+
+def _atomic_write_text(path, text):
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.part')
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
@@ -0,0 +1,126 @@
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from climada.entity.exposures import Exposures
+
+from calc_api.config import ClimadaCalcApiConfig
+
+conf = ClimadaCalcApiConfig()
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(getattr(logging, conf.LOG_LEVEL))
+
+# Exposures are split into square tiles of this many degrees, one file per tile
+TILE_SIZE = 1
+INDEX_FILE = 'index.json'
+ROW_LABEL_COLUMN = '_index'
+
+
+def tiles_exist(tile_dir):
+    return Path(tile_dir, INDEX_FILE).exists()
+
+
+def write_tiles(exp, tile_dir):
+    """
+    Partition an exposure into spatial tiles on disk, with one column-per-array .npz file per tile.
+
+    The index file, which lists the tiles, the exposure's attributes and each numeric column's range, is written
+    last, so a tile directory without one is incomplete and gets rebuilt.
+    """
+    tile_dir = Path(tile_dir)
+    if tile_dir.exists():
+        shutil.rmtree(tile_dir)
+    tile_dir.mkdir(parents=True)
+
+    gdf = exp.gdf.drop(columns='geometry', errors='ignore')
+    lat = gdf['latitude'].to_numpy(dtype=float)
+    lon = gdf['longitude'].to_numpy(dtype=float)
+    tile_lat = np.floor(lat / TILE_SIZE).astype(int)
+    tile_lon = np.floor(lon / TILE_SIZE).astype(int)
+
+    # Sort once by tile, then write each tile's contiguous block of rows
+    order = np.lexsort((tile_lon, tile_lat))
+    tile_keys = np.column_stack([tile_lat[order], tile_lon[order]])
+    starts = np.flatnonzero(np.r_[True, np.any(np.diff(tile_keys, axis=0) != 0, axis=1)])
+    stops = np.r_[starts[1:], len(order)]
+    columns = {name: gdf[name].to_numpy() for name in gdf.columns}
+    columns[ROW_LABEL_COLUMN] = gdf.index.to_numpy()
+
+    tiles = []
+    for start, stop in zip(starts, stops):
+        rows = order[start:stop]
+        key = [int(tile_keys[start, 0]), int(tile_keys[start, 1])]
+        with open(_tile_path(tile_dir, key), 'wb') as f:
+            np.savez(f, **{name: values[rows] for name, values in columns.items()})
+        tiles.append(key)
+
+    index = {
+        'tile_size': TILE_SIZE,
+        'tiles': tiles,
+        'columns': list(gdf.columns),
+        'ref_year': int(exp.ref_year) if exp.ref_year else None,
+        'value_unit': exp.value_unit,
+        'crs': str(exp.crs) if exp.crs else None,
+        'ranges': {
+            name: [float(np.nanmin(values)), float(np.nanmax(values))]
+            for name, values in columns.items()
+            if name != ROW_LABEL_COLUMN and np.issubdtype(values.dtype, np.number) and len(values) > 0
+        }
+    }
+    tmp_path = Path(tile_dir, f'.{INDEX_FILE}.{os.getpid()}.part')
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, Path(tile_dir, INDEX_FILE))
+    LOGGER.debug(f'Wrote {len(tiles)} exposure tiles to {tile_dir}')
+
+
+def read_index(tile_dir):
+    with open(Path(tile_dir, INDEX_FILE)) as f:
+        return json.load(f)
+
+
+def read_tiles(tile_dir, bounds):
+    """
+    Read the points within bounds = (lonmin, latmin, lonmax, latmax) from the tiles that intersect them.
+
+    Returns an Exposures with the same columns and row labels as the original exposure. Only the intersecting tiles
+    are read from disk.
+    """
+    index = read_index(tile_dir)
+    lonmin, latmin, lonmax, latmax = bounds
+    tile_size = index['tile_size']
+    lat_range = (np.floor(latmin / tile_size), np.floor(latmax / tile_size))
+    lon_range = (np.floor(lonmin / tile_size), np.floor(lonmax / tile_size))
+    keys = [
+        key for key in index['tiles']
+        if lat_range[0] <= key[0] <= lat_range[1] and lon_range[0] <= key[1] <= lon_range[1]
+    ]
+
+    parts = []
+    for key in keys:
+        with np.load(_tile_path(tile_dir, key), allow_pickle=True) as npz:
+            part = {name: npz[name] for name in npz.files}
+        in_bounds = (part['latitude'] >= latmin) & (part['latitude'] <= latmax) & \
+                    (part['longitude'] >= lonmin) & (part['longitude'] <= lonmax)
+        parts.append({name: values[in_bounds] for name, values in part.items()})
+    LOGGER.debug(f'Read {len(keys)} of {len(index["tiles"])} exposure tiles from {tile_dir}')
+
+    if parts:
+        columns = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+    else:
+        columns = {name: np.array([]) for name in index['columns'] + [ROW_LABEL_COLUMN]}
+    row_labels = columns.pop(ROW_LABEL_COLUMN)
+    # Tiles are read in tile order: put the rows back in the original exposure's order
+    df = pd.DataFrame({name: columns[name] for name in index['columns']}, index=row_labels).sort_index()
+    attributes = {name: index[name] for name in ['ref_year', 'value_unit', 'crs'] if index[name] is not None}
+    return Exposures(df, **attributes)
+
+
+def _tile_path(tile_dir, key):
+    return Path(tile_dir, f'{key[0]}_{key[1]}.npz')
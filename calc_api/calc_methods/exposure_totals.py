@@ -0,0 +1,192 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+
+from climada.util.constants import SYSTEM_DIR
+
+from calc_api.config import ClimadaCalcApiConfig
+from calc_api.calc_methods import util
+from calc_api.calc_methods.worker_cache import WorkerCache
+
+conf = ClimadaCalcApiConfig()
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(getattr(logging, conf.LOG_LEVEL))
+
+# One summed-area table per exposure request, written when a worker first loads the exposure. The table records the
+# Data API dataset it was built from.
+TOTALS_DIR = Path(SYSTEM_DIR, 'calc_api', 'exposure_prefix_sums')
+TABLE_NAMES = ['value', 'count', 'lat', 'lon']
+
+
+class PrefixSumTable:
+    """
+    Summed-area tables over an exposure's grid, for totals within any bounding box.
+
+    The grid's axes are the exposure's sorted unique latitudes and longitudes, so a bounding box maps to an index
+    range on each axis with two binary searches, and its total is a four-corner lookup. Alongside the values, tables
+    of the count and the summed coordinates of the nonzero points give the location of the points in the box.
+    """
+
+    def __init__(self, lats, lons, tables):
+        self.lats = lats
+        self.lons = lons
+        self.tables = tables
+
+    @classmethod
+    def from_points(cls, lat, lon, value):
+        lats, lat_index = np.unique(lat, return_inverse=True)
+        lons, lon_index = np.unique(lon, return_inverse=True)
+        if len(lats) * len(lons) > conf.EXPOSURE_PREFIX_SUM_MAX_CELLS:
+            LOGGER.debug(f'Exposure grid of {len(lats)} x {len(lons)} is too large for a summed-area table')
+            return None
+
+        # Tables are padded with a leading row and column of zeros so that lookups need no edge cases
+        shape = (len(lats) + 1, len(lons) + 1)
+        flat_index = (lat_index + 1) * shape[1] + lon_index + 1
+        nonzero = value != 0
+        weights = {
+            'value': value,
+            'count': nonzero.astype(float),
+            'lat': np.where(nonzero, lat, 0),
+            'lon': np.where(nonzero, lon, 0)
+        }
+        tables = {
+            name: np.bincount(flat_index, weights=w, minlength=shape[0] * shape[1]).reshape(shape).cumsum(0).cumsum(1)
+            for name, w in weights.items()
+        }
+        # Counts are exact as integers. The sums stay float64: totals are differences of large cumulative sums, which
+        # float32 can't resolve.
+        tables['count'] = tables['count'].astype(np.int32)
+        return cls(lats, lons, tables)
+
+    def nbytes(self):
+        return self.lats.nbytes + self.lons.nbytes + sum(table.nbytes for table in self.tables.values())
+
+    def totals(self, lonmin=-np.inf, latmin=-np.inf, lonmax=np.inf, latmax=np.inf):
+        """Return the sum of each table over the points within the bounding box, edges included."""
+        i0 = np.searchsorted(self.lats, latmin, side='left')
+        i1 = np.searchsorted(self.lats, latmax, side='right')
+        j0 = np.searchsorted(self.lons, lonmin, side='left')
+        j1 = np.searchsorted(self.lons, lonmax, side='right')
+        return {
+            name: float(table[i1, j1] - table[i0, j1] - table[i1, j0] + table[i0, j0])
+            for name, table in self.tables.items()
+        }
+
+
+def table_key(properties):
+    """
+    Name a table from the exposure request's Data API properties alone, so that requests can find it without asking
+    the Data API which dataset they would get.
+    """
+    request = json.dumps(sorted(properties.items()))
+    return f"{properties.get('country_iso3alpha', 'all')}_{hashlib.md5(request.encode()).hexdigest()}"
+
+
+def table_path(key):
+    return Path(TOTALS_DIR, f'{key}.npz')
+
+
+def too_large_marker(key):
+    return Path(TOTALS_DIR, f'{key}.too_large')
+
+
+def table_is_current(key, dataset):
+    """Whether a table has been saved for this version of the dataset, or found to be too large to build."""
+    path = table_path(key)
+    if path.exists():
+        try:
+            with np.load(path) as npz:
+                return str(npz['dataset_uuid']) == str(dataset.uuid)
+        except (OSError, ValueError, KeyError):
+            return False
+    try:
+        return too_large_marker(key).read_text() == str(dataset.uuid)
+    except FileNotFoundError:
+        return False
+
+
+def save_table(key, dataset, exp):
+    path = table_path(key)
+    if table_is_current(key, dataset):
+        return
+    table = PrefixSumTable.from_points(
+        exp.gdf['latitude'].to_numpy(dtype=float),
+        exp.gdf['longitude'].to_numpy(dtype=float),
+        exp.gdf['value'].to_numpy(dtype=float)
+    )
+    if table is None:
+        too_large_marker(key).parent.mkdir(parents=True, exist_ok=True)
+        too_large_marker(key).write_text(str(dataset.uuid))
+        path.unlink(missing_ok=True)  # built from an earlier version of the dataset
+        return
+    # Write to a temporary file and rename so that other processes never read a partial file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.part')
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, lats=table.lats, lons=table.lons, dataset_uuid=str(dataset.uuid), **table.tables)
+    os.replace(tmp_path, path)
+    too_large_marker(key).unlink(missing_ok=True)
+    LOGGER.debug(f'Saved exposure summed-area table {path.name}')
+
+
+def _load_table(key):
+    path = table_path(key)
+    if not path.exists():
+        return None
+    try:
+        with np.load(path) as npz:
+            return PrefixSumTable(npz['lats'], npz['lons'], {name: npz[name] for name in TABLE_NAMES})
+    except (OSError, ValueError, KeyError) as err:
+        LOGGER.warning(f'Could not read exposure summed-area table {path.name}. Error: {err}')
+        return None
+
+
+def _table_nbytes(entry):
+    return entry[1].nbytes()
+
+
+# Tables read by this process (usually the web server), with the modification time of the file they were read from.
+# Misses aren't cached, so new tables are picked up, and a table rebuilt for a new dataset version is reread.
+TABLE_CACHE = WorkerCache('exposure_prefix_sums', conf.EXPOSURE_CACHE_MEMORY, _table_nbytes)
+
+
+def get_table(key):
+    try:
+        mtime = table_path(key).stat().st_mtime
+    except FileNotFoundError:
+        return None
+    entry = TABLE_CACHE.get(key)
+    if entry is not None and entry[0] == mtime:
+        return entry[1]
+    table = _load_table(key)
+    if table is not None:
+        TABLE_CACHE.put(key, (mtime, table))
+    return table
+
+
+def exposure_total(key, scaling=1, location_poly=None, buffer=150):
+    """
+    The total exposure value within a location's buffered bounding box, in the shape of get_exposure's 'all' sum.
+
+    Points are located at the mean of the nonzero points in the box rather than the median that get_exposure uses,
+    because a median can't be read from a summed-area table. Returns None if there's no table for this exposure yet,
+    or no nonzero points in the box, so the caller can fall back to get_exposure.
+    """
+    table = get_table(key)
+    if table is None:
+        return None
+    if location_poly:
+        totals = table.totals(*util.buffered_bounds(location_poly, buffer))
+    else:
+        totals = table.totals()
+    if totals['count'] == 0:
+        return None
+    return [{'lat': totals['lat'] / totals['count'],
+             'lon': totals['lon'] / totals['count'],
+             'value': totals['value'] * scaling}]
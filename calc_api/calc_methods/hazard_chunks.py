@@ -0,0 +1,219 @@
+import importlib
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+from scipy import sparse
+
+from climada.hazard import Hazard, Centroids, Tag
+
+from calc_api.config import ClimadaCalcApiConfig
+
+conf = ClimadaCalcApiConfig()
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(getattr(logging, conf.LOG_LEVEL))
+
+# Hazard centroids are split into square chunks of this many degrees, one file per chunk
+CHUNK_SIZE = 1
+INDEX_FILE = 'index.json'
+EVENTS_FILE = 'events.npz'
+EVENT_ARRAYS = ['event_id', 'frequency', 'date', 'orig']
+# The centroid attributes that Centroids.select keeps
+CENTROID_ARRAYS = ['area_pixel', 'region_id', 'on_land', 'dist_coast']
+
+
+def chunks_exist(chunk_dir):
+    return Path(chunk_dir, INDEX_FILE).exists()
+
+
+def write_chunks(haz, chunk_dir):
+    """
+    Split a hazard's centroids into spatial chunks on disk.
+
+    Each chunk file holds its centroids' coordinates and other attributes, their positions in the original hazard
+    and their columns of the intensity and fraction matrices, in compressed sparse column form. The event table (ids,
+    frequencies, names, dates, and any per-event attributes of hazard subclasses, such as a TropCyclone's category)
+    is stored once for all chunks. The index file is written last, so a chunk directory without one is incomplete
+    and gets rebuilt.
+    """
+    chunk_dir = Path(chunk_dir)
+    if chunk_dir.exists():
+        shutil.rmtree(chunk_dir)
+    chunk_dir.mkdir(parents=True)
+
+    lat = np.asarray(haz.centroids.lat, dtype=float)
+    lon = np.asarray(haz.centroids.lon, dtype=float)
+    chunk_lat = np.floor(lat / CHUNK_SIZE).astype(int)
+    chunk_lon = np.floor(lon / CHUNK_SIZE).astype(int)
+
+    # Sort the centroids once by chunk, then write each chunk's contiguous block of columns
+    order = np.lexsort((chunk_lon, chunk_lat))
+    chunk_keys = np.column_stack([chunk_lat[order], chunk_lon[order]])
+    starts = np.flatnonzero(np.r_[True, np.any(np.diff(chunk_keys, axis=0) != 0, axis=1)])
+    stops = np.r_[starts[1:], len(order)]
+
+    intensity = haz.intensity.tocsc()
+    has_fraction = haz.fraction.shape == haz.intensity.shape
+    fraction = haz.fraction.tocsc() if has_fraction else None
+    centroid_arrays = [name for name in CENTROID_ARRAYS if getattr(haz.centroids, name).size]
+    event_attrs = extra_event_attrs(haz)
+
+    chunks = []
+    for start, stop in zip(starts, stops):
+        columns = order[start:stop]
+        key = [int(chunk_keys[start, 0]), int(chunk_keys[start, 1])]
+        arrays = {'lat': lat[columns], 'lon': lon[columns], 'centroid_index': columns}
+        arrays.update({name: getattr(haz.centroids, name)[columns] for name in centroid_arrays})
+        arrays.update(_csc_arrays('intensity', intensity[:, columns]))
+        if has_fraction:
+            arrays.update(_csc_arrays('fraction', fraction[:, columns]))
+        with open(_chunk_path(chunk_dir, key), 'wb') as f:
+            np.savez(f, **arrays)
+        chunks.append(key)
+
+    with open(Path(chunk_dir, EVENTS_FILE), 'wb') as f:
+        np.savez(
+            f,
+            event_name=np.array(haz.event_name, dtype=str),
+            **{name: np.asarray(getattr(haz, name)) for name in EVENT_ARRAYS + list(event_attrs)}
+        )
+
+    index = {
+        'chunk_size': CHUNK_SIZE,
+        'chunks': chunks,
+        'n_events': int(haz.intensity.shape[0]),
+        'n_centroids': int(haz.intensity.shape[1]),
+        'has_fraction': has_fraction,
+        'haz_class': [type(haz).__module__, type(haz).__qualname__],
+        'haz_type': haz.tag.haz_type,
+        'units': haz.units,
+        'frequency_unit': getattr(haz, 'frequency_unit', None),
+        'centroid_arrays': centroid_arrays,
+        'centroid_crs': haz.centroids.geometry.crs.to_string() if haz.centroids.geometry.crs else None,
+        'extra_event_attrs': event_attrs
+    }
+    tmp_path = Path(chunk_dir, f'.{INDEX_FILE}.{os.getpid()}.part')
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, Path(chunk_dir, INDEX_FILE))
+    LOGGER.debug(f'Wrote {len(chunks)} hazard chunks to {chunk_dir}')
+
+
+def read_chunks(chunk_dir, bounds):
+    """
+    Build a hazard with only the centroids within bounds = (lonmin, latmin, lonmax, latmax).
+
+    Only the chunks intersecting the bounds are read, so memory and time depend on the size of the area, not of the
+    country. The result is the same as subset_hazard_extent on the full hazard: the same hazard class, event
+    attributes and centroid attributes, with centroids in the same order as in the original hazard.
+    """
+    with open(Path(chunk_dir, INDEX_FILE)) as f:
+        index = json.load(f)
+    lonmin, latmin, lonmax, latmax = bounds
+    chunk_size = index['chunk_size']
+    lat_range = (np.floor(latmin / chunk_size), np.floor(latmax / chunk_size))
+    lon_range = (np.floor(lonmin / chunk_size), np.floor(lonmax / chunk_size))
+    keys = [
+        key for key in index['chunks']
+        if lat_range[0] <= key[0] <= lat_range[1] and lon_range[0] <= key[1] <= lon_range[1]
+    ]
+
+    centroid_arrays = index.get('centroid_arrays', [])
+    lat, lon, centroid_index, intensity, fraction = [], [], [], [], []
+    centroid_values = {name: [] for name in centroid_arrays}
+    for key in keys:
+        with np.load(_chunk_path(chunk_dir, key)) as npz:
+            in_bounds = np.flatnonzero(
+                (npz['lat'] >= latmin) & (npz['lat'] <= latmax) & (npz['lon'] >= lonmin) & (npz['lon'] <= lonmax)
+            )
+            if len(in_bounds) == 0:
+                continue
+            lat.append(npz['lat'][in_bounds])
+            lon.append(npz['lon'][in_bounds])
+            centroid_index.append(npz['centroid_index'][in_bounds])
+            for name in centroid_arrays:
+                centroid_values[name].append(npz[name][in_bounds])
+            intensity.append(_read_csc(npz, 'intensity')[:, in_bounds])
+            if index['has_fraction']:
+                fraction.append(_read_csc(npz, 'fraction')[:, in_bounds])
+    LOGGER.debug(f'Read {len(keys)} of {len(index["chunks"])} hazard chunks from {chunk_dir}')
+
+    if not lat:
+        raise ValueError('The hazard did not intersect with the requested polygon: no centroids matched')
+
+    order = np.argsort(np.concatenate(centroid_index))
+    with np.load(Path(chunk_dir, EVENTS_FILE)) as npz:
+        events = {name: npz[name] for name in npz.files}
+
+    haz = hazard_class(index)()
+    haz.tag = Tag(haz_type=index['haz_type'])
+    haz.units = index['units']
+    if index['frequency_unit'] is not None:
+        haz.frequency_unit = index['frequency_unit']
+    crs_kwargs = {'crs': index['centroid_crs']} if index.get('centroid_crs') else {}
+    haz.centroids = Centroids.from_lat_lon(np.concatenate(lat)[order], np.concatenate(lon)[order], **crs_kwargs)
+    for name in centroid_arrays:
+        setattr(haz.centroids, name, np.concatenate(centroid_values[name])[order])
+    for name in EVENT_ARRAYS:
+        setattr(haz, name, events[name])
+    for name, as_list in index.get('extra_event_attrs', {}).items():
+        setattr(haz, name, events[name].tolist() if as_list else events[name])
+    haz.event_name = events['event_name'].tolist()
+    haz.intensity = sparse.hstack(intensity, format='csc')[:, order].tocsr()
+    if index['has_fraction']:
+        haz.fraction = sparse.hstack(fraction, format='csc')[:, order].tocsr()
+    else:
+        haz.fraction = sparse.csr_matrix(np.empty((0, 0)))
+    return haz
+
+
+def hazard_class(index):
+    """The hazard class recorded in a chunk or memory-map index, or Hazard for indexes written before it was."""
+    if 'haz_class' not in index:
+        return Hazard
+    module, name = index['haz_class']
+    return getattr(importlib.import_module(module), name)
+
+
+def extra_event_attrs(haz):
+    """
+    Per-event attributes beyond Hazard's own, such as a TropCyclone's category and basin. Returns a dict of
+    attribute name to whether it's a list (restored as a list) rather than an array.
+    """
+    n_events = haz.intensity.shape[0]
+    known = set(vars(Hazard())) | {'pool'}
+    extra = {}
+    for name, value in vars(haz).items():
+        if name in known:
+            continue
+        if isinstance(value, np.ndarray) and value.ndim == 1 and value.shape[0] == n_events \
+                and value.dtype != object:
+            extra[name] = False
+        elif isinstance(value, list) and len(value) == n_events and n_events > 0 \
+                and all(isinstance(item, (str, int, float, bool, np.generic)) for item in value):
+            extra[name] = True
+    return extra
+
+
+def _csc_arrays(name, matrix):
+    return {
+        f'{name}_data': matrix.data,
+        f'{name}_indices': matrix.indices,
+        f'{name}_indptr': matrix.indptr,
+        f'{name}_shape': np.array(matrix.shape)
+    }
+
+
+def _read_csc(npz, name):
+    return sparse.csc_matrix(
+        (npz[f'{name}_data'], npz[f'{name}_indices'], npz[f'{name}_indptr']),
+        shape=tuple(npz[f'{name}_shape'])
+    )
+
+
+def _chunk_path(chunk_dir, key):
+    return Path(chunk_dir, f'{key[0]}_{key[1]}.npz')
@@ -0,0 +1,154 @@
+import json
+import logging
+import mmap
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+from scipy import sparse
+
+from climada.hazard import Centroids, Tag
+
+from calc_api.config import ClimadaCalcApiConfig
+from calc_api.calc_methods.hazard_chunks import hazard_class, extra_event_attrs, \
+    CENTROID_ARRAYS as CENTROID_ATTRS
+
+conf = ClimadaCalcApiConfig()
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(getattr(logging, conf.LOG_LEVEL))
+
+INDEX_FILE = 'index.json'
+# Increase this whenever the layout changes, so layouts written by older code are rebuilt
+# 2: the hazard class, centroid attributes and extra event attributes are stored
+LAYOUT_VERSION = 2
+CSR_ARRAYS = ['data', 'indices', 'indptr']
+EVENT_ARRAYS = ['event_id', 'frequency', 'date', 'orig']
+CENTROID_ARRAYS = ['lat', 'lon']
+
+
+def layout_exists(layout_dir):
+    path = Path(layout_dir, INDEX_FILE)
+    if not path.exists():
+        return False
+    with open(path) as f:
+        return json.load(f).get('version') == LAYOUT_VERSION
+
+
+def write_layout(haz, layout_dir):
+    """
+    Write a hazard's arrays as flat .npy files that can be memory-mapped.
+
+    The intensity and fraction matrices are stored as their CSR data, indices and indptr arrays, in canonical form
+    (sorted indices, no duplicates) so that nothing has to rewrite them once they're mapped read-only. As with
+    hazard chunks, the hazard class, centroid attributes and per-event attributes of hazard subclasses are kept. The
+    index file is written last, so a layout directory without one is incomplete and gets rebuilt.
+    """
+    layout_dir = Path(layout_dir)
+    if layout_dir.exists():
+        shutil.rmtree(layout_dir)
+    layout_dir.mkdir(parents=True)
+
+    has_fraction = haz.fraction.shape == haz.intensity.shape
+    matrices = {'intensity': haz.intensity}
+    if has_fraction:
+        matrices['fraction'] = haz.fraction
+    for name, matrix in matrices.items():
+        csr = matrix.tocsr(copy=True)
+        csr.sum_duplicates()
+        for part in CSR_ARRAYS:
+            np.save(_array_path(layout_dir, f'{name}_{part}'), getattr(csr, part))
+    event_attrs = extra_event_attrs(haz)
+    for name in EVENT_ARRAYS + list(event_attrs):
+        np.save(_array_path(layout_dir, name), np.asarray(getattr(haz, name)))
+    for name in CENTROID_ARRAYS:
+        np.save(_array_path(layout_dir, f'centroids_{name}'), np.asarray(getattr(haz.centroids, name), dtype=float))
+    centroid_attrs = [name for name in CENTROID_ATTRS if getattr(haz.centroids, name).size]
+    for name in centroid_attrs:
+        np.save(_array_path(layout_dir, f'centroids_{name}'), np.asarray(getattr(haz.centroids, name)))
+    np.save(_array_path(layout_dir, 'event_name'), np.array(haz.event_name, dtype=str))
+
+    index = {
+        'version': LAYOUT_VERSION,
+        'shape': list(haz.intensity.shape),
+        'matrices': list(matrices),
+        'haz_class': [type(haz).__module__, type(haz).__qualname__],
+        'haz_type': haz.tag.haz_type,
+        'units': haz.units,
+        'frequency_unit': getattr(haz, 'frequency_unit', None),
+        'intensity_thres': float(haz.intensity_thres),
+        'centroid_arrays': centroid_attrs,
+        'centroid_crs': haz.centroids.geometry.crs.to_string() if haz.centroids.geometry.crs else None,
+        'extra_event_attrs': event_attrs
+    }
+    tmp_path = Path(layout_dir, f'.{INDEX_FILE}.{os.getpid()}.part')
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, Path(layout_dir, INDEX_FILE))
+    LOGGER.debug(f'Wrote memory-mapped hazard layout to {layout_dir}')
+
+
+def open_layout(layout_dir):
+    """
+    Build a hazard whose intensity, fraction and event arrays are read-only memory maps of the files on disk.
+
+    Every process that opens the same layout shares the operating system's page cache for it instead of holding a
+    private copy. The arrays can't be written to: anything that needs to modify them must copy them first.
+    """
+    with open(Path(layout_dir, INDEX_FILE)) as f:
+        index = json.load(f)
+    shape = tuple(index['shape'])
+
+    haz = hazard_class(index)()
+    haz.tag = Tag(haz_type=index['haz_type'])
+    haz.units = index['units']
+    haz.intensity_thres = index['intensity_thres']
+    if index['frequency_unit'] is not None:
+        haz.frequency_unit = index['frequency_unit']
+    crs_kwargs = {'crs': index['centroid_crs']} if index.get('centroid_crs') else {}
+    haz.centroids = Centroids.from_lat_lon(
+        *[_load(layout_dir, f'centroids_{name}') for name in CENTROID_ARRAYS], **crs_kwargs
+    )
+    for name in index.get('centroid_arrays', []):
+        setattr(haz.centroids, name, _load(layout_dir, f'centroids_{name}'))
+    for name in EVENT_ARRAYS:
+        setattr(haz, name, _load(layout_dir, name))
+    for name, as_list in index.get('extra_event_attrs', {}).items():
+        setattr(haz, name, np.load(_array_path(layout_dir, name)).tolist() if as_list else _load(layout_dir, name))
+    haz.event_name = np.load(_array_path(layout_dir, 'event_name')).tolist()
+    haz.intensity = _load_csr(layout_dir, 'intensity', shape)
+    if 'fraction' in index['matrices']:
+        haz.fraction = _load_csr(layout_dir, 'fraction', shape)
+    else:
+        haz.fraction = sparse.csr_matrix(np.empty((0, 0)))
+    return haz
+
+
+def is_mapped(arr):
+    """True if an array's memory belongs to a memory-mapped file rather than to this process."""
+    while arr is not None:
+        if isinstance(arr, (np.memmap, mmap.mmap)):
+            return True
+        arr = getattr(arr, 'base', None)
+    return False
+
+
+def _load(layout_dir, name):
+    return np.load(_array_path(layout_dir, name), mmap_mode='r')
+
+
+def _load_csr(layout_dir, name, shape):
+    csr = sparse.csr_matrix(
+        tuple(_load(layout_dir, f'{name}_{part}') for part in CSR_ARRAYS),
+        shape=shape,
+        copy=False
+    )
+    # Written in canonical form: stop scipy from trying to sort the read-only arrays in place
+    csr.has_sorted_indices = True
+    csr.has_canonical_format = True
+    return csr
+
+
+def _array_path(layout_dir, name):
+    return Path(layout_dir, f'{name}.npy')
@@ -0,0 +1,212 @@
+import datetime
+import hashlib
+import logging
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+from scipy import sparse
+
+from climada.engine import Impact
+from climada.util.constants import SYSTEM_DIR
+
+from calc_api.config import ClimadaCalcApiConfig
+from calc_api.calc_methods import util, spatial_index, data_api
+from calc_api.calc_methods.worker_cache import WorkerCache
+
+conf = ClimadaCalcApiConfig()
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(getattr(logging, conf.LOG_LEVEL))
+
+# One event x exposure point impact matrix per country-wide impact calculation, reused by every location in it
+MATRIX_DIR = Path(SYSTEM_DIR, 'calc_api', 'impact_matrices')
+
+
+class StoredImpact:
+    """
+    A country-wide impact matrix with the coordinates of its exposure points and the hazard's event frequencies.
+
+    The matrix is kept in compressed sparse column form, one column per exposure point, so the impacts for any
+    subset of points are a cheap column selection.
+    """
+
+    def __init__(self, imp_mat, lat, lon, frequency, event_id, unit):
+        self.imp_mat = imp_mat
+        self.lat = lat
+        self.lon = lon
+        self.frequency = frequency
+        self.event_id = event_id
+        self.unit = unit
+
+    @classmethod
+    def from_impact(cls, imp):
+        return cls(
+            sparse.csc_matrix(imp.imp_mat),
+            np.asarray(imp.coord_exp[:, 0], dtype=float),
+            np.asarray(imp.coord_exp[:, 1], dtype=float),
+            np.asarray(imp.frequency, dtype=float),
+            np.asarray(imp.event_id),
+            imp.unit
+        )
+
+    def nbytes(self):
+        arrays = [self.imp_mat.data, self.imp_mat.indices, self.imp_mat.indptr,
+                  self.lat, self.lon, self.frequency, self.event_id]
+        return sum(arr.nbytes for arr in arrays)
+
+    def subset(self, lonmin, latmin, lonmax, latmax):
+        """
+        An Impact for the exposure points within the bounding box, edges included.
+
+        at_event, eai_exp and aai_agg are sums over the selected columns, as Impact.calc would have accumulated them
+        for an exposure with only these points. The Impact keeps its matrix, so it can be summarised by region or by
+        point as well as for the whole area.
+        """
+        index = spatial_index.get_index(self, self.lat, self.lon)
+        columns = index.query(lonmin, latmin, lonmax, latmax)
+        if len(columns) == 0:
+            raise ValueError('The exposure did not intersect with the requested polygon: no points matched')
+        imp_mat = self.imp_mat[:, columns]
+
+        imp = Impact()
+        imp.unit = self.unit
+        imp.event_id = self.event_id
+        imp.frequency = self.frequency
+        imp.coord_exp = np.column_stack([self.lat[columns], self.lon[columns]])
+        imp.imp_mat = imp_mat
+        imp.at_event = np.asarray(imp_mat.sum(axis=1)).ravel()
+        imp.eai_exp = imp_mat.T @ self.frequency
+        imp.aai_agg = np.sum(imp.at_event * self.frequency)
+        return imp
+
+
+def matrix_key(**properties):
+    """Key a matrix on everything that determines a country-wide impact calculation."""
+    return hashlib.md5(repr(sorted(properties.items())).encode()).hexdigest()
+
+
+def matrix_path(key):
+    return Path(MATRIX_DIR, f'{key}.npz')
+
+
+def matrix_lock(key):
+    """A file lock held while a matrix is calculated, so that only one process calculates it."""
+    MATRIX_DIR.mkdir(parents=True, exist_ok=True)
+    return data_api.file_lock(Path(MATRIX_DIR, f'.{key}.lock'))
+
+
+def save_matrix(key, imp):
+    """Store a country-wide Impact calculated with save_mat=True. Returns it as a StoredImpact."""
+    stored = StoredImpact.from_impact(imp)
+    path = matrix_path(key)
+    # Write to a temporary file and rename so that other processes never read a partial file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.part')
+    with open(tmp_path, 'wb') as f:
+        np.savez(
+            f,
+            data=stored.imp_mat.data,
+            indices=stored.imp_mat.indices,
+            indptr=stored.imp_mat.indptr,
+            shape=np.array(stored.imp_mat.shape),
+            lat=stored.lat,
+            lon=stored.lon,
+            frequency=stored.frequency,
+            event_id=stored.event_id,
+            unit=np.array(stored.unit, dtype=str)
+        )
+    os.replace(tmp_path, path)
+    LOGGER.debug(f'Saved country impact matrix {path.name} with shape {stored.imp_mat.shape}')
+    MATRIX_CACHE.put(key, stored)
+    return stored
+
+
+def _load_matrix(key):
+    path = matrix_path(key)
+    if not path.exists():
+        return None
+    try:
+        with np.load(path) as npz:
+            imp_mat = sparse.csc_matrix(
+                (npz['data'], npz['indices'], npz['indptr']),
+                shape=tuple(npz['shape'])
+            )
+            return StoredImpact(imp_mat, npz['lat'], npz['lon'], npz['frequency'], npz['event_id'], str(npz['unit']))
+    except (OSError, ValueError, KeyError) as err:
+        LOGGER.warning(f'Could not read country impact matrix {path.name}. Error: {err}')
+        return None
+
+
+def _matrix_nbytes(stored):
+    return 0 if stored is None else stored.nbytes()
+
+
+# Matrices read by this worker process. Misses aren't cached, so matrices written by other processes are picked up.
+MATRIX_CACHE = WorkerCache('impact_matrix', conf.IMPACT_MATRIX_CACHE_MEMORY, _matrix_nbytes)
+
+
+def get_matrix(key):
+    stored = MATRIX_CACHE.get(key)
+    if stored is None:
+        stored = _load_matrix(key)
+        if stored is not None:
+            MATRIX_CACHE.put(key, stored)
+    if stored is not None:
+        _touch(matrix_path(key))
+    return stored
+
+
+def _touch(path):
+    # A matrix file's modification time is when it was last used: see sweep_matrices
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def sweep_matrices(ttl_days=None, max_bytes=None, dry_run=False):
+    """
+    Delete stored matrices unused for longer than the TTL, then the least recently used until under the size budget.
+
+    Matrices have no database rows, so their usage is the file's modification time, which get_matrix updates. The
+    TTL and budget default to cache_eviction: ttl-days and impact-matrix-max-size. Returns the evicted keys.
+    """
+    ttl_days = conf.CACHE_TTL_DAYS if ttl_days is None else ttl_days
+    max_bytes = conf.CACHE_IMPACT_MATRIX_MAX_BYTES if max_bytes is None else max_bytes
+    expiry = time.time() - datetime.timedelta(days=ttl_days).total_seconds()
+
+    entries = []
+    for path in MATRIX_DIR.glob('*.npz'):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue  # deleted while we were looking
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    expired = [path for mtime, _, path in entries if mtime < expiry]
+    kept = sorted([entry for entry in entries if entry[0] >= expiry], key=lambda entry: entry[0])
+    total_bytes = sum(size for _, size, _ in kept)
+    over_budget = []
+    for _, size, path in kept:
+        if total_bytes <= max_bytes:
+            break
+        over_budget.append(path)
+        total_bytes -= size
+
+    evicted = expired + over_budget
+    LOGGER.info(f'Impact matrices: {len(expired)} unused for over {ttl_days} days, '
+                f'{len(over_budget)} more evicted to get under {max_bytes} bytes')
+    if not dry_run:
+        for path in evicted:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+    return [path.stem for path in evicted]
+
+
+def location_impact(stored, location_poly, buffer=150):
+    """The Impact for the exposure points in a location's buffered bounding box, the same points get_exposure uses."""
+    return stored.subset(*util.buffered_bounds(location_poly, buffer))
@@ -0,0 +1,111 @@
+import copy
+import hashlib
+import logging
+
+import numpy as np
+
+from climada.entity import ImpactFunc
+
+from calc_api.config import ClimadaCalcApiConfig
+from calc_api.calc_methods.worker_cache import WorkerCache
+
+conf = ClimadaCalcApiConfig()
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(getattr(logging, conf.LOG_LEVEL))
+
+# Spacing of the lookup grid in hazard intensity units. A power of two, so that integer and other round breakpoints
+# (step thresholds, the Emanuel function's 5 m/s points) fall exactly on the grid.
+GRID_RESOLUTION = 2 ** -6
+MAX_CELLS = 2 ** 20  # functions spanning more intensity than this are interpolated as usual
+TABLE_CACHE_BYTES = 64 * 1024 * 1024
+
+
+class LookupTable:
+    """
+    An impact function's MDD and PAA tabulated on a fixed intensity grid.
+
+    Each grid cell stores the functions' value at its left edge and their slope across it, so evaluating an intensity
+    is a gather of the cell's values followed by one multiply-add: no search through the function's breakpoints.
+    Piecewise linear functions whose breakpoints lie on the grid, such as step and Emanuel functions, are reproduced
+    exactly, including their values at the breakpoints. Intensities in the few cells that contain a breakpoint off
+    the grid, such as an arbitrary measure cutoff, are interpolated as before. Intensities outside the function's
+    range take its end values, as with np.interp.
+    """
+
+    def __init__(self, intensity, mdd, paa, resolution=GRID_RESOLUTION):
+        self.intensity, self.mdd, self.paa = intensity, mdd, paa
+        self.resolution = resolution
+        self.start = np.floor(np.min(intensity) / resolution) * resolution
+        self.stop = np.ceil(np.max(intensity) / resolution) * resolution
+        n_cells = int(round((self.stop - self.start) / resolution))
+        # One extra cell at the top with zero slope holds the value at the end of the range
+        edges = self.start + np.arange(n_cells + 1) * resolution
+        mids = edges + resolution / 2
+        self.tables = {}
+        for name, values in [('mdd', mdd), ('paa', paa)]:
+            at_edges = np.interp(edges, intensity, values)
+            slopes = (np.interp(mids, intensity, values) - at_edges) / (resolution / 2)
+            slopes[-1] = 0
+            self.tables[name] = (at_edges, slopes)
+        off_grid = intensity[(intensity - self.start) % resolution != 0]
+        self.interpolate_cells = np.zeros(n_cells + 1, dtype=bool)
+        self.interpolate_cells[((off_grid - self.start) // resolution).astype(np.int64)] = True
+
+    def nbytes(self):
+        return sum(arr.nbytes for table in self.tables.values() for arr in table) + self.interpolate_cells.nbytes
+
+    def evaluate(self, inten):
+        """MDD x PAA at each intensity, the equivalent of ImpactFunc.calc_mdr."""
+        inten = np.clip(np.asarray(inten, dtype=float), self.start, self.stop)
+        offset = inten - self.start
+        cell = np.minimum((offset / self.resolution).astype(np.int64), len(self.tables['mdd'][0]) - 1)
+        offset -= cell * self.resolution
+        mdd_edges, mdd_slopes = self.tables['mdd']
+        paa_edges, paa_slopes = self.tables['paa']
+        mdr = (mdd_edges[cell] + mdd_slopes[cell] * offset) * (paa_edges[cell] + paa_slopes[cell] * offset)
+        interpolate = self.interpolate_cells[cell]
+        if interpolate.any():
+            mdr[interpolate] = np.interp(inten[interpolate], self.intensity, self.paa) * \
+                np.interp(inten[interpolate], self.intensity, self.mdd)
+        return mdr
+
+
+def _table_nbytes(table):
+    return table.nbytes()
+
+
+# Tables built by this process, keyed on the impact function's curve, so every request and measure cutoff that
+# produces the same function shares a table
+TABLE_CACHE = WorkerCache('impf_lookup', TABLE_CACHE_BYTES, _table_nbytes)
+
+
+def get_table(intensity, mdd, paa):
+    """The lookup table for an impact function's curve, or None if its intensity range is too wide to tabulate."""
+    intensity, mdd, paa = [np.asarray(arr, dtype=float) for arr in (intensity, mdd, paa)]
+    if (np.max(intensity) - np.min(intensity)) / GRID_RESOLUTION > MAX_CELLS:
+        return None
+    key = hashlib.md5(b''.join(arr.tobytes() for arr in (intensity, mdd, paa))).hexdigest()
+    return TABLE_CACHE.get_or_load(key, lambda: LookupTable(intensity, mdd, paa))
+
+
+class LookupImpactFunc(ImpactFunc):
+    """
+    An ImpactFunc that evaluates MDD x PAA from a cached lookup table instead of interpolating.
+
+    CLIMADA's Impact.calc calls calc_mdr once per block of exposures on all the nonzero hazard intensities, so this
+    replaces the two interpolations in the impact calculation's inner loop. The table is looked up from the current
+    intensity, mdd and paa arrays on every call, so copies modified by measures get their own tables.
+    """
+
+    @classmethod
+    def from_impf(cls, impf):
+        new_impf = cls()
+        new_impf.__dict__.update(copy.deepcopy(impf.__dict__))
+        return new_impf
+
+    def calc_mdr(self, inten):
+        table = get_table(self.intensity, self.mdd, self.paa)
+        if table is None:
+            return super().calc_mdr(inten)
+        return table.evaluate(inten)
@@ -1,5 +1,4 @@
 import logging
-import numpy as np
 import json
 
 from django.db import transaction
@@ -17,6 +16,7 @@ from calc_api.config import ClimadaCalcApiConfig
 from calc_api.job_management.standardise_schema import standardise_schema
 from calc_api.calc_methods.profile import profile
 from calc_api.calc_methods.colourmaps import Legend
+from calc_api.calc_methods import points
 from calc_api.calc_methods.calc_hazard import get_hazard_event, get_hazard_by_return_period
 from calc_api.calc_methods.calc_exposure import get_exposure
 from calc_api.calc_methods.calc_impact import get_impact_event, get_impact_by_return_period
@@ -49,9 +49,14 @@ def map_hazard_climate(request: schemas.MapHazardClimateRequest):
             scenario_climate=request.scenario_climate,
             scenario_year=request.scenario_year,
             location_poly=request.location_poly,
-            aggregation_scale=request.aggregation_scale
+            aggregation_scale=request.aggregation_scale,
+            aggregation_method=request.aggregation_method
         ),
-        points_to_map_response.s('intensity', PALETTE_HAZARD_COLORCET)
+        points_to_map_response.s(
+            'intensity',
+            PALETTE_HAZARD_COLORCET,
+            return_periods=request.hazard_rp if isinstance(request.hazard_rp, list) else None
+        )
     ).apply_async()
     out = res.id
     return out
@@ -73,7 +78,8 @@ def map_hazard_event(request: schemas.MapHazardEventRequest):
             scenario_year=request.scenario_year,
             event_name=request.hazard_event_name,
             location_poly=request.location_poly,
-            aggregation_scale=request.aggregation_scale
+            aggregation_scale=request.aggregation_scale,
+            aggregation_method=request.aggregation_method
         ),
         points_to_map_response.s('intensity', PALETTE_HAZARD_COLORCET)
     ).apply_async()
@@ -95,7 +101,8 @@ def map_exposure(request: schemas.MapExposureRequest):
             scenario_growth=request.scenario_growth,
             scenario_year=request.scenario_year,
             location_poly=request.location_poly,
-            aggregation_scale=request.aggregation_scale
+            aggregation_scale=request.aggregation_scale,
+            aggregation_method=request.aggregation_method
         ),
         points_to_map_response.s('value', PALETTE_EXPOSURE_COLORCET)
     ).apply_async()
@@ -111,7 +118,7 @@ def map_impact_climate(request: schemas.MapImpactClimateRequest):
     #with transaction.atomic():
     res = chain(
         get_impact_by_return_period.s(
-            country_list=country_iso,
+            country=country_iso,
             hazard_type=request.hazard_type,
             return_periods=request.hazard_rp,
             exposure_type=request.exposure_type,
@@ -122,7 +129,8 @@ def map_impact_climate(request: schemas.MapImpactClimateRequest):
             hazard_year=request.scenario_year,
             exposure_year=request.scenario_year,
             location_poly=request.location_poly,
-            aggregation_scale=request.aggregation_scale
+            aggregation_scale=request.aggregation_scale,
+            aggregation_method=request.aggregation_method
         ),
         points_to_map_response.s('value', PALETTE_IMPACT_COLORCET)
     ).apply_async()
@@ -148,7 +156,8 @@ def map_impact_event(request: schemas.MapImpactEventRequest):
             scenario_year=request.scenario_year,
             return_period=request.hazard_event_name,
             location_poly=request.location_poly,
-            aggregation_scale=request.aggregation_scale
+            aggregation_scale=request.aggregation_scale,
+            aggregation_method=request.aggregation_method
         ),
         points_to_map_response.s('value', PALETTE_IMPACT_COLORCET)
     ).apply_async()
@@ -157,24 +166,44 @@ def map_impact_event(request: schemas.MapImpactEventRequest):
 
 
 @shared_task(base=Singleton)
-def points_to_map_response(data_list, value_name, color_palette):
-    data_list = [entry for entry in data_list if entry[value_name] != 0]
+def points_to_map_response(data, value_name, color_palette, return_periods=None):
+    # data is a columnar payload (see calc_methods.points), or a list of point dicts from older and aggregated tasks.
+    # With return_periods set, there is also a column of values at every return period in <value_name>_by_rp.
+    # The legend and colours use the first return period.
+    columns = points.columnar_arrays(data) if points.is_columnar(data) else points.records_to_arrays(data)
+    values = columns[value_name]
+    values_by_rp = columns[value_name + '_by_rp'] if return_periods else None
 
-    bounds = u_coord.latlon_bounds(np.array([entry['lat'] for entry in data_list]),
-                                   np.array([entry['lon'] for entry in data_list]))
+    keep = values_by_rp.any(axis=0) if return_periods else values != 0
+    lat, lon, values = columns['lat'][keep], columns['lon'][keep], values[keep]
 
+    bounds = u_coord.latlon_bounds(lat, lon)
 
-    legend = Legend([entry['intensity'] for entry in data_list],
+    legend = Legend(values,
                     color_palette,
                     n_cols=12,
                     reverse=True)
 
+    # Columns are converted to Python floats once, rather than point by point
+    if return_periods:
+        entry_values = values_by_rp[:, keep].T.tolist()
+    else:
+        entry_values = [None] * len(values)
+
     outdata = schemas.Map(
         items=[
-            schemas.MapEntry(lat=entry['lat'], lon=entry['lon'], value=entry[value_name], geom='null', color=c)
-            for entry, c
-            in zip(data_list, legend.colors)
+            schemas.MapEntry(
+                lat=entry_lat,
+                lon=entry_lon,
+                value=entry_value,
+                values=entry_rp_values,
+                geom='null',
+                color=c
+            )
+            for entry_lat, entry_lon, entry_value, entry_rp_values, c
+            in zip(lat.tolist(), lon.tolist(), values.tolist(), entry_values, legend.colors)
         ],
+        return_periods=return_periods,
         legend=schemas.ColorbarLegend(
             title="Dummy hazard dataset",  #TODO set dynamically
             units="m/s",
@@ -194,27 +223,7 @@ def points_to_map_response(data_list, value_name, color_palette):
         bounding_box=list(bounds)
     )
 
-    LOGGER.debug('ITEMS')
-    for entry in outdata.items:
-        LOGGER.debug(entry)
-        LOGGER.debug('lat')
-        LOGGER.debug(entry.lat)
-        LOGGER.debug(json.dumps(entry.lat))
-        LOGGER.debug('lon')
-        LOGGER.debug(entry.lon)
-        LOGGER.debug(json.dumps(entry.lon))
-        LOGGER.debug('geom')
-        LOGGER.debug(entry.geom)
-        LOGGER.debug(json.dumps(entry.geom))
-        LOGGER.debug('value')
-        LOGGER.debug(entry.value)
-        LOGGER.debug(json.dumps(entry.value))
-        LOGGER.debug('color')
-        LOGGER.debug(entry.color)
-        LOGGER.debug(json.dumps(entry.color))
-        LOGGER.debug('dict')
-        LOGGER.debug(entry.__dict__)
-        LOGGER.debug(json.dumps(entry.__dict__))
+    LOGGER.debug(f'Map response with {len(outdata.items)} items')
 
     return json.dumps(schemas.MapResponse(data=outdata, metadata=metadata))
 
@@ -0,0 +1,62 @@
+import logging
+
+import numpy as np
+
+from calc_api.config import ClimadaCalcApiConfig
+from calc_api.api import serial
+
+conf = ClimadaCalcApiConfig()
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(getattr(logging, conf.LOG_LEVEL))
+
+COLUMNAR_FORMAT = 'columnar'
+# Columns are .npy bytes in base64. Payloads stored before columns were encoded have plain lists and no encoding.
+COLUMN_ENCODING = 'npy-base64'
+
+
+def make_columnar(lat, lon, dtype='float64', labels=None, **columns):
+    """
+    Build the task payload for gridded point results: one encoded array per column instead of one dict per point.
+
+    Every column has one entry per point. Two-dimensional columns, such as values by return period, have shape
+    (n_return_periods, n_points). Each column is stored as its .npy bytes in a base64 string, which keeps its shape
+    and dtype, can be stored as JSON in the JobLog as well as pickled by Celery, and creates no Python object per
+    point. Columns are only decoded, by columnar_arrays, where they're used. Non-numeric columns, such as region
+    names, go in labels.
+    """
+    payload = {
+        'format': COLUMNAR_FORMAT,
+        'encoding': COLUMN_ENCODING,
+        'dtype': dtype,
+        'lat': serial.ndarray_to_base64(np.asarray(lat, dtype=dtype)),
+        'lon': serial.ndarray_to_base64(np.asarray(lon, dtype=dtype))
+    }
+    for name, values in columns.items():
+        payload[name] = serial.ndarray_to_base64(np.asarray(values, dtype=dtype))
+    if labels:
+        payload['labels'] = {name: list(values) for name, values in labels.items()}
+    return payload
+
+
+def is_columnar(data):
+    return isinstance(data, dict) and data.get('format') == COLUMNAR_FORMAT
+
+
+def columnar_arrays(data):
+    """Return a columnar payload's numeric columns as numpy arrays, keyed by column name."""
+    encoded = data.get('encoding') == COLUMN_ENCODING
+    return {
+        name: serial.ndarray_from_base64(values) if encoded else np.asarray(values, dtype=data['dtype'])
+        for name, values in data.items()
+        if name not in ['format', 'encoding', 'dtype', 'labels']
+    }
+
+
+def records_to_arrays(records):
+    """Convert a list of point dicts (the older payload, still used for aggregated results) to numpy columns."""
+    if not records:
+        return {}
+    columns = {name: np.array([entry[name] for entry in records]) for name in records[0].keys()}
+    # Values by return period are transposed to match the columnar layout: (n_return_periods, n_points)
+    return {name: values.T if values.ndim == 2 else values for name, values in columns.items()}
@@ -1,5 +1,7 @@
 import cProfile
 import pstats
+import time
+from contextlib import contextmanager
 from functools import wraps
 import logging
 
@@ -56,4 +58,16 @@ def profile(sort_by='cumulative', lines_to_print=30, strip_dirs=True, log_level=
 
         return wrapper
 
-    return inner
\ No newline at end of file
+    return inner
+
+@contextmanager
+def timed(stage, timings=None):
+    """Time a block of code, log it, and record the wall time in seconds in the timings dict if one is provided."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if timings is not None:
+            timings[stage] = elapsed
+        LOGGER.debug(f'{stage} took {elapsed:.3f} s')
@@ -0,0 +1,120 @@
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+
+from climada.util.constants import SYSTEM_DIR
+
+from calc_api.config import ClimadaCalcApiConfig
+from calc_api.calc_methods import util
+from calc_api.vizz.enums import get_rp_options
+
+conf = ClimadaCalcApiConfig()
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(getattr(logging, conf.LOG_LEVEL))
+
+# One file per hazard request (type, country, scenario, year), holding intensity at each of the return periods
+# offered in options.json. The file records the Data API dataset it was calculated from.
+GRID_DIR = Path(SYSTEM_DIR, 'calc_api', 'return_period_grids')
+# Part of every grid's name. Increase it whenever the way grids are calculated changes, so old grids aren't served.
+# 2: negative extrapolated intensities are set to zero, as in CLIMADA
+# 3: centroids with a single event frequency get np.polyfit's minimum-norm fit, as in CLIMADA
+GRID_VERSION = 3
+
+
+def grid_return_periods(hazard_type):
+    """The return periods precomputed for a hazard type: every numeric return period option in options.json."""
+    return [float(rp) for rp in get_rp_options(hazard_type, get_value='value') if rp != 'aai']
+
+
+def grid_key(hazard_type, country, scenario_climate, scenario_year):
+    """
+    Name a grid from the hazard request alone, so that requests can find it without asking the Data API which
+    dataset they would get.
+    """
+    year = 'all' if scenario_climate == 'historical' else str(scenario_year)
+    return f'{hazard_type}_{country}_{scenario_climate}_{year}_{conf.DEFAULT_N_TRACKS}_v{GRID_VERSION}'
+
+
+def grid_path(key):
+    return Path(GRID_DIR, f'{key}.npz')
+
+
+def grid_is_current(key, dataset):
+    """Whether a grid exists and was calculated from this version of the dataset."""
+    path = grid_path(key)
+    if not path.exists():
+        return False
+    try:
+        with np.load(path) as npz:
+            return str(npz['dataset_uuid']) == str(dataset.uuid)
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def save_grid(key, dataset, lat, lon, return_periods, intensity):
+    """
+    Store intensity at each return period for every centroid of a hazard dataset.
+
+    intensity has shape (n_return_periods, n_centroids). The file is written to a temporary name and renamed into
+    place so that other processes never read a partial grid.
+    """
+    path = grid_path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.part')
+    with open(tmp_path, 'wb') as f:
+        np.savez(
+            f,
+            lat=np.asarray(lat, dtype=float),
+            lon=np.asarray(lon, dtype=float),
+            return_periods=np.asarray(return_periods, dtype=float),
+            intensity=np.asarray(intensity, dtype=np.float32),
+            dataset_uuid=np.array(str(dataset.uuid)),
+            dataset_version=np.array(str(dataset.version))
+        )
+    os.replace(tmp_path, path)
+    LOGGER.debug(f'Saved return period grid {key} from dataset {dataset.uuid}: return periods {list(return_periods)}')
+
+
+def load_grid(key):
+    """
+    Return a stored grid as a dict of arrays, or None if there isn't a readable one.
+
+    A grid is replaced when a newer dataset for its request is first loaded, or by precompute_return_period_grids.
+    """
+    path = grid_path(key)
+    if not path.exists():
+        return None
+    try:
+        with np.load(path) as npz:
+            return {key: npz[key] for key in ['lat', 'lon', 'return_periods', 'intensity']}
+    except (OSError, ValueError, KeyError) as err:
+        LOGGER.warning(f'Could not read return period grid {path.name}. Error: {err}')
+        return None
+
+
+def lookup_grid(grid, return_periods, location_poly=None, buffer=300):
+    """
+    Select the requested return periods and, optionally, the centroids within a buffered location polygon.
+
+    Returns (lat, lon, intensity) with intensity of shape (n_return_periods, n_centroids), or None if any requested
+    return period isn't in the grid.
+    """
+    rp_index = []
+    for rp in return_periods:
+        matches = np.flatnonzero(np.isclose(grid['return_periods'], float(rp)))
+        if len(matches) == 0:
+            return None
+        rp_index.append(matches[0])
+
+    lat, lon = grid['lat'], grid['lon']
+    if location_poly:
+        lonmin, latmin, lonmax, latmax = util.buffered_bounds(location_poly, buffer)
+        in_extent = np.flatnonzero((lat >= latmin) & (lat <= latmax) & (lon >= lonmin) & (lon <= lonmax))
+        if len(in_extent) == 0:
+            raise ValueError('The hazard did not intersect with the requested polygon: no centroids matched')
+        return lat[in_extent], lon[in_extent], grid['intensity'][np.ix_(rp_index, in_extent)]
+
+    return lat, lon, grid['intensity'][rp_index, :]
@@ -0,0 +1,71 @@
+import logging
+import threading
+import weakref
+
+import numpy as np
+
+from calc_api.config import ClimadaCalcApiConfig
+
+conf = ClimadaCalcApiConfig()
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(getattr(logging, conf.LOG_LEVEL))
+
+
+class SortedLatIndex:
+    """
+    Bounding box lookups on a set of points, using the points sorted by latitude.
+
+    A query is two binary searches for the latitude band and a longitude mask over the points in that band, so its
+    cost depends on the size of the band rather than the number of points.
+    """
+
+    def __init__(self, lat, lon):
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        self.size = lat.size
+        self.order = np.argsort(lat, kind='stable')
+        self.lat_sorted = lat[self.order]
+        self.lon_sorted = lon[self.order]
+
+    def query(self, lonmin, latmin, lonmax, latmax):
+        """Return the (sorted) indices of the points within the bounding box, edges included."""
+        start = np.searchsorted(self.lat_sorted, latmin, side='left')
+        stop = np.searchsorted(self.lat_sorted, latmax, side='right')
+        band_lon = self.lon_sorted[start:stop]
+        in_lon = (band_lon >= lonmin) & (band_lon <= lonmax)
+        return np.sort(self.order[start:stop][in_lon])
+
+
+# Indexes are held for as long as the object they index, e.g. a hazard in the worker cache: id(obj) -> (weakref, index)
+_INDEXES = {}
+_INDEXES_LOCK = threading.RLock()
+
+
+def get_index(obj, lat, lon):
+    """
+    Return the SortedLatIndex for obj's points, building it the first time it's asked for.
+
+    obj is only used as the cache key, so it must not have its coordinates changed after indexing. An index whose
+    size no longer matches the coordinates is rebuilt. Objects that can't be weakly referenced aren't cached.
+    """
+    key = id(obj)
+    with _INDEXES_LOCK:
+        entry = _INDEXES.get(key)
+    if entry is not None and entry[0]() is obj and entry[1].size == len(lat):
+        return entry[1]
+
+    LOGGER.debug(f'Building spatial index for {type(obj).__name__} with {len(lat)} points')
+    index = SortedLatIndex(lat, lon)
+    try:
+        ref = weakref.ref(obj, lambda _, key=key: _discard(key))
+    except TypeError:
+        return index
+    with _INDEXES_LOCK:
+        _INDEXES[key] = (ref, index)
+    return index
+
+
+def _discard(key):
+    with _INDEXES_LOCK:
+        _INDEXES.pop(key, None)
@@ -0,0 +1,59 @@
+import unittest
+
+import numpy as np
+from scipy import sparse
+
+from climada.hazard import Hazard, Centroids
+
+from calc_api.calc_methods.calc_hazard import local_exceedance_intensity
+
+
+def random_hazard(n_events=40, n_centroids=60, seed=0):
+    rng = np.random.default_rng(seed)
+    intensity = rng.uniform(0, 60, (n_events, n_centroids))
+    intensity[intensity < 25] = 0  # sparse, and some centroids with at most one event above the threshold
+    intensity[:, 0] = 0
+    intensity[1:, 1] = 0
+
+    haz = Hazard('TC')
+    haz.centroids = Centroids.from_lat_lon(rng.uniform(10, 20, n_centroids), rng.uniform(-80, -70, n_centroids))
+    haz.event_id = np.arange(1, n_events + 1)
+    haz.event_name = [str(i) for i in haz.event_id]
+    haz.date = np.ones(n_events, int)
+    haz.orig = np.ones(n_events, bool)
+    haz.frequency = rng.uniform(1e-4, 1e-2, n_events)
+    haz.intensity = sparse.csr_matrix(intensity)
+    haz.fraction = sparse.csr_matrix(intensity > 0, dtype=float)
+    return haz
+
+
+class TestLocalExceedanceIntensity(unittest.TestCase):
+
+    def test_matches_climada(self):
+        return_periods = np.array([1, 2, 5, 10, 25, 100, 250])
+        for seed in range(6):
+            haz = random_hazard(seed=seed)
+            expected = haz.local_exceedance_inten(return_periods)
+            result = local_exceedance_intensity(haz, return_periods)
+            self.assertEqual(result.shape, expected.shape)
+            np.testing.assert_allclose(result, expected, rtol=1e-8, atol=1e-8)
+
+    def test_single_event_centroid(self):
+        # Centroid 1 has at most one event above the threshold: CLIMADA's polyfit gives the minimum-norm line
+        return_periods = np.array([1, 10, 100])
+        for seed in range(6):
+            haz = random_hazard(seed=seed)
+            if haz.intensity[:, 1].max() <= haz.intensity_thres:
+                continue
+            expected = haz.local_exceedance_inten(return_periods)[:, 1]
+            np.testing.assert_allclose(local_exceedance_intensity(haz, return_periods)[:, 1], expected, rtol=1e-8)
+
+    def test_no_negative_extrapolation(self):
+        haz = random_hazard()
+        result = local_exceedance_intensity(haz, [1, 2])
+        self.assertGreaterEqual(result.min(), 0)
+        np.testing.assert_array_equal(result[:, 0], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from climada.entity import Exposures, ImpactFuncSet, ImpfTropCyclone
+from climada.engine import Impact
+
+from calc_api.calc_methods import aggregation, points
+from calc_api.calc_methods.calc_impact import calc_impact_chunked, conf, pointwise_rp_impacts, \
+    summarise_impact_by_region
+from calc_api.calc_methods.test.test_calc_hazard import random_hazard
+
+RETURN_PERIODS = [10, 25, 100, 'aai']
+REGION_NAMES = ['south-west', 'south-east', 'north-west', 'north-east']
+
+
+def random_exposure(haz, n_points=50, seed=0):
+    rng = np.random.default_rng(seed)
+    exp = Exposures(pd.DataFrame({
+        'latitude': rng.uniform(10, 20, n_points),
+        'longitude': rng.uniform(-80, -70, n_points),
+        'value': rng.uniform(1e5, 1e7, n_points),
+        'impf_TC': np.ones(n_points, int)
+    }))
+    exp.value_unit = 'USD'
+    exp.check()
+    exp.assign_centroids(haz)
+    return exp
+
+
+def impact_funcs():
+    impf_set = ImpactFuncSet()
+    impf_set.append(ImpfTropCyclone.from_emanuel_usa())
+    return impf_set
+
+
+def fake_region_ids(country, aggregation_scale, lat, lon):
+    # Quadrants of the test area, with the southernmost points outside every region
+    region_ids = (np.asarray(lat) > 15) * 2 + (np.asarray(lon) > -75)
+    region_ids[np.asarray(lat) < 11] = -1
+    return region_ids.astype(np.int32), REGION_NAMES
+
+
+def impact_calc(exp, impf_set, haz):
+    imp = Impact()
+    imp.calc(exp, impf_set, haz, save_mat=True)
+    return imp
+
+
+class TestCalcImpactChunked(unittest.TestCase):
+
+    def setUp(self):
+        self.haz = random_hazard()
+        self.exp = random_exposure(self.haz)
+        self.impf_set = impact_funcs()
+        self.expected = impact_calc(self.exp, self.impf_set, self.haz)
+        self.assertGreater(self.expected.aai_agg, 0)
+
+    def calc_chunked(self, **summary_args):
+        # A block size that doesn't divide the number of points, so the last block is short
+        with mock.patch.object(conf, 'CHUNK_SIZE', 7):
+            return calc_impact_chunked(self.exp, self.impf_set, self.haz, **summary_args)
+
+    def test_matches_impact_calc(self):
+        imp = self.calc_chunked(return_periods=RETURN_PERIODS, aggregation_scale='all')
+        np.testing.assert_allclose(imp.at_event, self.expected.at_event)
+        np.testing.assert_allclose(imp.eai_exp, self.expected.eai_exp)
+        np.testing.assert_allclose(imp.aai_agg, self.expected.aai_agg)
+        np.testing.assert_allclose(imp.tot_value, self.expected.tot_value)
+        np.testing.assert_allclose(imp.coord_exp, self.expected.coord_exp)
+        np.testing.assert_array_equal(imp.event_id, self.expected.event_id)
+        np.testing.assert_allclose(imp.frequency, self.expected.frequency)
+        np.testing.assert_allclose(imp.calc_freq_curve().impact, self.expected.calc_freq_curve().impact)
+
+    def test_region_sum_matches_impact_calc(self):
+        with mock.patch.object(aggregation, 'get_region_ids', fake_region_ids):
+            imp = self.calc_chunked(return_periods=RETURN_PERIODS, country='XXX', aggregation_scale='admin1',
+                                    aggregation_method='sum')
+            self.assertIn('region_event_imp', imp.chunk_summary)
+            result = summarise_impact_by_region(imp, RETURN_PERIODS, 'XXX', 'admin1', 'sum')
+            expected = summarise_impact_by_region(self.expected, RETURN_PERIODS, 'XXX', 'admin1', 'sum')
+        self.assertEqual(result['labels'], expected['labels'])
+        result, expected = points.columnar_arrays(result), points.columnar_arrays(expected)
+        np.testing.assert_allclose(result['value_by_rp'], expected['value_by_rp'])
+        np.testing.assert_allclose(result['lat'], expected['lat'])
+        np.testing.assert_allclose(result['lon'], expected['lon'])
+
+    def test_region_mean_matches_impact_calc(self):
+        with mock.patch.object(aggregation, 'get_region_ids', fake_region_ids):
+            imp = self.calc_chunked(return_periods=RETURN_PERIODS, country='XXX', aggregation_scale='admin1',
+                                    aggregation_method='mean')
+            self.assertIn('rp_imp', imp.chunk_summary)
+            result = summarise_impact_by_region(imp, RETURN_PERIODS, 'XXX', 'admin1', 'mean')
+            expected = summarise_impact_by_region(self.expected, RETURN_PERIODS, 'XXX', 'admin1', 'mean')
+        self.assertEqual(result['labels'], expected['labels'])
+        np.testing.assert_allclose(points.columnar_arrays(result)['value_by_rp'],
+                                   points.columnar_arrays(expected)['value_by_rp'])
+
+    def test_pointwise_matches_impact_calc(self):
+        imp = self.calc_chunked(return_periods=RETURN_PERIODS)
+        self.assertIn('rp_imp', imp.chunk_summary)
+        np.testing.assert_allclose(
+            pointwise_rp_impacts(imp, RETURN_PERIODS),
+            pointwise_rp_impacts(self.expected, RETURN_PERIODS)
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from climada.hazard import TropCyclone
+
+from calc_api.calc_methods import hazard_chunks, hazard_memmap
+from calc_api.calc_methods.test.test_calc_hazard import random_hazard
+
+
+def random_tropcyclone(seed=0):
+    haz = random_hazard(seed=seed)
+    tc = TropCyclone()
+    tc.__dict__.update({name: value for name, value in vars(haz).items() if name in vars(tc)})
+    n_events = haz.intensity.shape[0]
+    tc.category = np.arange(n_events) % 6
+    tc.basin = ['NA'] * n_events
+    tc.centroids.on_land = np.arange(haz.intensity.shape[1]) % 2 == 0
+    return tc
+
+
+class TestStoredHazardAttributes(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.haz = random_tropcyclone()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def assert_same_hazard(self, result):
+        self.assertIs(type(result), TropCyclone)
+        self.assertEqual(result.tag.haz_type, self.haz.tag.haz_type)
+        self.assertEqual(result.centroids.geometry.crs, self.haz.centroids.geometry.crs)
+        np.testing.assert_array_equal(result.centroids.lat, self.haz.centroids.lat)
+        np.testing.assert_array_equal(result.centroids.on_land, self.haz.centroids.on_land)
+        np.testing.assert_array_equal(result.category, self.haz.category)
+        self.assertEqual(result.basin, self.haz.basin)
+        self.assertEqual(result.event_name, self.haz.event_name)
+        np.testing.assert_array_equal(result.frequency, self.haz.frequency)
+        np.testing.assert_array_equal(result.intensity.toarray(), self.haz.intensity.toarray())
+
+    def test_memmap_layout(self):
+        layout_dir = Path(self.tmp_dir.name, 'layout')
+        hazard_memmap.write_layout(self.haz, layout_dir)
+        self.assertTrue(hazard_memmap.layout_exists(layout_dir))
+        result = hazard_memmap.open_layout(layout_dir)
+        self.assert_same_hazard(result)
+        self.assertTrue(hazard_memmap.is_mapped(result.intensity.data))
+
+    def test_chunks(self):
+        chunk_dir = Path(self.tmp_dir.name, 'chunks')
+        hazard_chunks.write_chunks(self.haz, chunk_dir)
+        self.assert_same_hazard(hazard_chunks.read_chunks(chunk_dir, (-180, -90, 180, 90)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import copy
+import unittest
+
+import numpy as np
+
+from calc_api.calc_methods.calc_impact import pointwise_rp_impacts
+from calc_api.calc_methods.impact_matrices import StoredImpact
+from calc_api.calc_methods.test.test_calc_hazard import random_hazard
+from calc_api.calc_methods.test.test_calc_impact import RETURN_PERIODS, random_exposure, impact_funcs, impact_calc
+
+
+class TestStoredImpactSubset(unittest.TestCase):
+
+    def setUp(self):
+        self.haz = random_hazard()
+        self.exp = random_exposure(self.haz, n_points=80)
+        self.impf_set = impact_funcs()
+        self.stored = StoredImpact.from_impact(impact_calc(self.exp, self.impf_set, self.haz))
+
+    def expected_subset(self, lonmin, latmin, lonmax, latmax):
+        lat, lon = self.exp.gdf['latitude'], self.exp.gdf['longitude']
+        in_box = (lat >= latmin) & (lat <= latmax) & (lon >= lonmin) & (lon <= lonmax)
+        exp = copy.copy(self.exp)
+        exp.gdf = self.exp.gdf[in_box.to_numpy()]
+        return impact_calc(exp, self.impf_set, self.haz)
+
+    def test_bbox_matches_impact_calc(self):
+        bounds = (-78, 12, -72.5, 17)
+        imp = self.stored.subset(*bounds)
+        expected = self.expected_subset(*bounds)
+        self.assertGreater(expected.aai_agg, 0)
+
+        # The spatial index returns points sorted by latitude: compare them in the same order
+        order = np.lexsort((imp.coord_exp[:, 1], imp.coord_exp[:, 0]))
+        expected_order = np.lexsort((expected.coord_exp[:, 1], expected.coord_exp[:, 0]))
+        np.testing.assert_allclose(imp.coord_exp[order], expected.coord_exp[expected_order])
+        np.testing.assert_allclose(imp.eai_exp[order], expected.eai_exp[expected_order])
+        np.testing.assert_allclose(imp.imp_mat.toarray()[:, order], expected.imp_mat.toarray()[:, expected_order])
+        np.testing.assert_allclose(imp.at_event, expected.at_event)
+        np.testing.assert_allclose(imp.aai_agg, expected.aai_agg)
+        np.testing.assert_array_equal(imp.event_id, expected.event_id)
+        np.testing.assert_allclose(imp.calc_freq_curve().impact, expected.calc_freq_curve().impact)
+        np.testing.assert_allclose(
+            pointwise_rp_impacts(imp, RETURN_PERIODS)[:, order],
+            pointwise_rp_impacts(expected, RETURN_PERIODS)[:, expected_order]
+        )
+
+    def test_edges_included(self):
+        lat, lon = self.stored.lat[5], self.stored.lon[5]
+        imp = self.stored.subset(lon, lat, lon, lat)
+        np.testing.assert_allclose(imp.coord_exp, [[lat, lon]])
+
+    def test_empty_bbox(self):
+        with self.assertRaises(ValueError):
+            self.stored.subset(0, 0, 1, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
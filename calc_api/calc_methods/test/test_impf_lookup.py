@@ -0,0 +1,65 @@
+import copy
+import unittest
+
+import numpy as np
+
+from climada.entity import ImpactFunc, ImpfTropCyclone
+
+from calc_api.calc_methods.calc_impact import make_cutoff_impf
+from calc_api.calc_methods.impf_lookup import LookupImpactFunc, GRID_RESOLUTION
+
+
+def sample_intensities(impf):
+    # Every breakpoint, points just either side of them, a dense sweep, and values far beyond the function's range
+    breakpoints = np.asarray(impf.intensity, dtype=float)
+    sweep = np.linspace(breakpoints.min() - 20, breakpoints.max() + 20, 20001)
+    return np.concatenate([
+        breakpoints, breakpoints - 1e-9, breakpoints + 1e-9, breakpoints + GRID_RESOLUTION / 3,
+        sweep, [-1e6, -1, 0, 1e6]
+    ])
+
+
+class TestLookupImpactFunc(unittest.TestCase):
+
+    def assert_matches(self, impf, exact=False):
+        lookup = LookupImpactFunc.from_impf(impf)
+        inten = sample_intensities(impf)
+        expected = impf.calc_mdr(inten)
+        result = lookup.calc_mdr(inten)
+        if exact:
+            np.testing.assert_array_equal(result, expected)
+        else:
+            np.testing.assert_allclose(result, expected, rtol=0, atol=1e-12)
+        # A second call is served from the cached table
+        np.testing.assert_array_equal(lookup.calc_mdr(inten), result)
+
+    def test_step(self):
+        impf = ImpactFunc.from_step_impf(intensity=(0, 50, 200))
+        impf.haz_type = 'TC'
+        self.assert_matches(impf, exact=True)
+        lookup = LookupImpactFunc.from_impf(impf)
+        np.testing.assert_array_equal(lookup.calc_mdr(np.array([49.99, 50, 50.01])), impf.calc_mdr([49.99, 50, 50.01]))
+
+    def test_emanuel(self):
+        self.assert_matches(ImpfTropCyclone.from_emanuel_usa())
+
+    def test_measure_modified(self):
+        # A measure scaling and shifting intensity, then a cutoff: neither set of breakpoints is on the lookup grid
+        impf = copy.deepcopy(ImpfTropCyclone.from_emanuel_usa())
+        impf.intensity = impf.intensity * 0.87 + 3.3
+        impf.paa = impf.paa * 0.9
+        self.assertTrue(np.any((impf.intensity / GRID_RESOLUTION) % 1 != 0))
+        self.assert_matches(impf)
+        self.assert_matches(make_cutoff_impf(impf, 17.3))
+
+    def test_modified_copy_gets_own_table(self):
+        impf = ImpfTropCyclone.from_emanuel_usa()
+        lookup = LookupImpactFunc.from_impf(impf)
+        inten = sample_intensities(impf)
+        before = lookup.calc_mdr(inten)
+        lookup.mdd = lookup.mdd * 0.5
+        np.testing.assert_allclose(lookup.calc_mdr(inten), before * 0.5, rtol=0, atol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import json
+import unittest
+
+import numpy as np
+
+from calc_api.calc_methods import points
+
+
+class TestColumnar(unittest.TestCase):
+
+    def test_round_trip(self):
+        lat, lon = np.linspace(10, 20, 7), np.linspace(-80, -70, 7)
+        value_by_rp = np.arange(21, dtype=float).reshape(3, 7)
+        payload = points.make_columnar(lat, lon, labels={'region': ['a'] * 7},
+                                       value=value_by_rp[0], value_by_rp=value_by_rp)
+        # The payload is stored as JSON in the JobLog
+        payload = json.loads(json.dumps(payload))
+        self.assertTrue(points.is_columnar(payload))
+        self.assertIsInstance(payload['value_by_rp'], str)
+        columns = points.columnar_arrays(payload)
+        np.testing.assert_array_equal(columns['lat'], lat)
+        np.testing.assert_array_equal(columns['lon'], lon)
+        np.testing.assert_array_equal(columns['value'], value_by_rp[0])
+        np.testing.assert_array_equal(columns['value_by_rp'], value_by_rp)
+        self.assertEqual(columns['value_by_rp'].shape, (3, 7))
+        self.assertEqual(payload['labels'], {'region': ['a'] * 7})
+
+    def test_dtype(self):
+        payload = points.make_columnar([1.5], [2.5], dtype='float32', value=[3.5])
+        self.assertEqual(points.columnar_arrays(payload)['value'].dtype, np.float32)
+
+    def test_list_payloads(self):
+        # Payloads stored in the JobLog before columns were encoded
+        payload = {'format': 'columnar', 'dtype': 'float64', 'lat': [1.0, 2.0], 'lon': [3.0, 4.0],
+                   'value_by_rp': [[1.0, 2.0], [3.0, 4.0]]}
+        columns = points.columnar_arrays(payload)
+        np.testing.assert_array_equal(columns['value_by_rp'], [[1, 2], [3, 4]])
+        self.assertEqual(set(columns), {'lat', 'lon', 'value_by_rp'})
+
+
+if __name__ == '__main__':
+    unittest.main()
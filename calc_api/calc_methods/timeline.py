@@ -7,10 +7,14 @@ from django.db import transaction
 from celery import chain, chord, shared_task
 from celery_singleton import Singleton
 
+from climada.entity.exposures.base import INDICATOR_CENTR
+
 import calc_api.vizz.schemas as schemas
 from calc_api.config import ClimadaCalcApiConfig
-from calc_api.vizz.enums import get_year_options, get_rp_options
-from calc_api.calc_methods.calc_impact import get_impact_event, get_impact_by_return_period
+from calc_api.vizz.enums import get_year_options, get_rp_options, exposure_type_from_impact_type
+from calc_api.calc_methods.calc_impact import get_impact_event, get_impact_by_return_period, load_hazard, \
+    load_exposure, calculate_impact, summarise_impact
+from calc_api.calc_methods.util import standardise_scenario
 from calc_api.vizz.units import NATIVE_UNITS_CLIMADA, UNIT_TYPES
 from calc_api.job_management.job_management import database_job
 from calc_api.job_management.standardise_schema import standardise_schema
@@ -26,11 +30,11 @@ def timeline_hazard(request: schemas.TimelineHazardRequest):
 
 
 def timeline_impact(request: schemas.TimelineImpactRequest):
-    job_config_list, chord_header = set_up_timeline_calculations(request)
+    job_config_list, chord_header, single_task = set_up_timeline_calculations(request)
 
     # with transaction.atomic():
     res = chord(chord_header)(
-        combine_impacts_to_timeline.s(job_config_list)
+        combine_impacts_to_timeline.s(job_config_list, single_task=single_task)
     )
     out = res.id
     return out
@@ -67,6 +71,23 @@ def set_up_timeline_calculations(request: schemas.TimelineImpactRequest):
     print("\n\nJOB CONFIG")
     print(str(job_config_list[0]))
 
+    if use_single_task_engine(request.geocoding.country_id):
+        chord_header = [
+            get_timeline_impacts.s(
+                job_config_list=[{'haz_year': c['haz_year'], 'exp_year': c['exp_year']} for c in job_config_list],
+                country=request.geocoding.country_id,
+                hazard_type=request.hazard_type,
+                return_periods=request.hazard_rp,
+                exposure_type=request.exposure_type,
+                impact_type=request.impact_type,
+                scenario_name=request.scenario_name,
+                scenario_growth=request.scenario_growth,
+                scenario_climate=request.scenario_climate,
+                location_poly=request.location_poly
+            )
+        ]
+        return job_config_list, chord_header, True
+
     chord_header = [
         get_impact_by_return_period.s(
             country=request.geocoding.country_id,
@@ -86,12 +107,109 @@ def set_up_timeline_calculations(request: schemas.TimelineImpactRequest):
         for job_config in job_config_list
     ]
 
-    return job_config_list, chord_header
+    return job_config_list, chord_header, False
+
+
+def use_single_task_engine(country):
+    if conf.TIMELINE_ENGINE == 'chord':
+        return False
+    if conf.TIMELINE_ENGINE != 'single_task':
+        raise ValueError(f'Could not process the configuration parameter timeline.engine. Value: {conf.TIMELINE_ENGINE}')
+    return country not in conf.TIMELINE_CHORD_COUNTRIES
+
+
+@shared_task(base=Singleton)
+@database_job
+def get_timeline_impacts(
+        job_config_list,
+        country,
+        hazard_type,
+        return_periods,
+        exposure_type=None,
+        impact_type=None,
+        scenario_name=None,
+        scenario_growth=None,
+        scenario_climate=None,
+        location_poly=None):
+    """
+    Calculate the impacts for every (exp_year, haz_year) pair of a timeline in a single task.
+
+    Each hazard year and exposure year is loaded once, and each exposure's centroid assignment is reused across the
+    hazard years it is combined with. Returns one get_impact_by_return_period-style result per entry in
+    job_config_list, in the same order, as expected by combine_impacts_to_timeline_no_celery.
+    """
+    LOGGER.debug('Starting single-task timeline impact calculation. Locals: ' + str(locals()))
+
+    if not exposure_type:
+        exposure_type = exposure_type_from_impact_type(impact_type)
+    scenario_name, scenario_growth, scenario_climate = standardise_scenario(scenario_name, scenario_growth, scenario_climate)
+
+    hazards = {
+        haz_year: load_hazard(
+            country,
+            hazard_type,
+            scenario_climate if int(haz_year) != 2020 else 'historical',
+            haz_year,
+            location_poly
+        )
+        for haz_year in sorted(set(job_config['haz_year'] for job_config in job_config_list))
+    }
+    exposures = {
+        exp_year: load_exposure(
+            country,
+            exposure_type,
+            impact_type,
+            scenario_name,
+            scenario_growth if int(exp_year) != 2020 else 'historical',
+            exp_year,
+            location_poly
+        )
+        for exp_year in sorted(set(job_config['exp_year'] for job_config in job_config_list))
+    }
+
+    centroids_assigned_to = {}  # exp_year -> haz_year whose centroids are assigned in the exposure
+    impacts_list = []
+    for job_config in job_config_list:
+        haz_year, exp_year = job_config['haz_year'], job_config['exp_year']
+        haz, exp = hazards[haz_year], exposures[exp_year]
+        if exp_year in centroids_assigned_to:
+            assigned_haz = hazards[centroids_assigned_to[exp_year]]
+            if not _same_centroids(haz, assigned_haz):
+                # calculate_impact only reassigns centroids when the exposure has no centroid column
+                exp.gdf.drop(columns=[INDICATOR_CENTR + haz.tag.haz_type], inplace=True, errors='ignore')
+                centroids_assigned_to[exp_year] = haz_year
+        else:
+            centroids_assigned_to[exp_year] = haz_year
+
+        imp = calculate_impact(
+            haz, exp, hazard_type, exposure_type, impact_type, save_mat=True,
+            summary_args={'return_periods': return_periods, 'aggregation_scale': 'all'}
+        )
+        impacts_list.append(
+            summarise_impact(imp, exp, return_periods, aggregation_scale='all', save_frequency_curve=True)
+        )
+
+    return impacts_list
+
+
+def _same_centroids(haz1, haz2):
+    return haz1 is haz2 or (
+        np.array_equal(haz1.centroids.lat, haz2.centroids.lat) and
+        np.array_equal(haz1.centroids.lon, haz2.centroids.lon)
+    )
+
+
+def unpack_timeline_impacts(impacts_list, single_task):
+    # The single-task engine returns all the per-year impacts as one chord result: unwrap them
+    if single_task:
+        return impacts_list[0]
+    return impacts_list
 
 
 @shared_task(base=Singleton)
 @database_job
-def combine_impacts_to_timeline(impacts_list, job_config_list):
+def combine_impacts_to_timeline(impacts_list, job_config_list, single_task=False):
+    impacts_list = unpack_timeline_impacts(impacts_list, single_task)
     return combine_impacts_to_timeline_no_celery(impacts_list, job_config_list)
 
 
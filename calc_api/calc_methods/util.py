@@ -1,4 +1,6 @@
+import hashlib
 import logging
+import numpy as np
 from shapely.geometry import Polygon
 from shapely import wkt
 
@@ -46,6 +48,14 @@ def convert_to_polygon(location_poly):
     return location_poly
 
 
+def buffered_bounds(location_poly, buffer=300):
+    """Return (lonmin, latmin, lonmax, latmax) of a location polygon, expanded by buffer arcseconds."""
+    location_poly = convert_to_polygon(location_poly)
+    buffer_deg = buffer / (60 * 60)
+    lonmin, latmin, lonmax, latmax = location_poly.bounds
+    return lonmin - buffer_deg, latmin - buffer_deg, lonmax + buffer_deg, latmax + buffer_deg
+
+
 def bbox_to_poly(bbox):
     if len(bbox) != 4:
         raise ValueError('Expected bbox to have four points')
@@ -65,3 +75,11 @@ def bbox_to_coords(bbox):
 
 def bbox_to_wkt(bbox):
     return bbox_to_poly(bbox).wkt
+
+
+def coords_hash(lat, lon):
+    """md5 hex digest of a set of coordinates, for keying results stored on disk."""
+    h = hashlib.md5()
+    h.update(np.ascontiguousarray(lat, dtype=float).tobytes())
+    h.update(np.ascontiguousarray(lon, dtype=float).tobytes())
+    return h.hexdigest()
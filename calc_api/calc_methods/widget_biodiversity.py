@@ -8,9 +8,10 @@ from shapely import wkt
 from climada.util.api_client import Client
 
 from calc_api.config import ClimadaCalcApiConfig
+from calc_api.calc_methods import data_api
 from calc_api.vizz import schemas, schemas_widgets
 from calc_api.vizz.text_biodiversity import generate_biodiversity_widget_text
-from calc_api.calc_methods.calc_exposure import get_exposure, subset_dataframe_extent, subset_exposure_extent
+from calc_api.calc_methods.calc_exposure import get_exposure, get_exposures_in_extent, subset_dataframe_extent
 from calc_api.job_management.job_management import database_job
 from calc_api.job_management.standardise_schema import standardise_schema
 
@@ -56,13 +57,10 @@ def create_habitat_breakdown(
 ):
 
     # TODO maybe parallelise this
-    exp_landuse = get_habitat_from_api(country_iso)
+    exp_landuse = get_habitat_from_api(country_iso, location_poly=location_poly)
     if not exp_landuse:
         raise ValueError(f'No landuse data found in the API for country {country_iso}')
 
-    if location_poly:
-        exp_landuse = subset_exposure_extent(exp_landuse, location_poly, buffer=150)
-
     df_landuse = exp_landuse.gdf
     n_grid_cells = df_landuse.shape[0]
     if n_grid_cells == 0:
@@ -84,7 +82,7 @@ def create_habitat_breakdown(
     }
 
 
-def get_habitat_from_api(country_iso, level=1):
+def get_habitat_from_api(country_iso, level=1, location_poly=None):
     request_properties = {
         'spatial_coverage': 'country',
         'country_iso3alpha': country_iso,
@@ -93,16 +91,25 @@ def get_habitat_from_api(country_iso, level=1):
 
     LOGGER.debug(
         f'Requesting habitat land use from Data API. Request properties: {request_properties}')
-    client = Client()
 
     try:
         # TODO maybe make some of these parameters into settings
-        habitat = client.get_exposures(
-            exposures_type='habitat_classification',
-            properties=request_properties,
-            status='preliminary',
-            version='newest'
-        )
+        if location_poly:
+            habitat = get_exposures_in_extent(
+                exposures_type='habitat_classification',
+                properties=request_properties,
+                status='preliminary',
+                version='newest',
+                location_poly=location_poly,
+                buffer=150
+            )
+        else:
+            habitat = data_api.get_exposures(
+                exposures_type='habitat_classification',
+                properties=request_properties,
+                status='preliminary',
+                version='newest'
+            )
     except Client.NoResult as err:
         LOGGER.warning(f'No habitat data found for {country_iso}: returning None')
         return None
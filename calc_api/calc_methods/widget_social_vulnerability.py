@@ -8,9 +8,10 @@ from shapely import wkt
 from climada.util.api_client import Client
 
 from calc_api.config import ClimadaCalcApiConfig
+from calc_api.calc_methods import data_api, points
 from calc_api.vizz import schemas, schemas_widgets
 from calc_api.vizz.text_social_vulnerability import generate_social_vulnerability_widget_text, generate_social_vulnerability_widget_text_no_data
-from calc_api.calc_methods.calc_exposure import get_exposure, subset_dataframe_extent, subset_exposure_extent
+from calc_api.calc_methods.calc_exposure import get_exposure, get_exposures_in_extent, subset_dataframe_extent
 from calc_api.vizz.schemas_widgets import SocialVulnerabilityWidgetData, SocialVulnerabilityWidgetRequest, SocialVulnerabilityWidgetResponse
 from calc_api.job_management.job_management import database_job
 from calc_api.job_management.standardise_schema import standardise_schema
@@ -62,7 +63,7 @@ def create_socvuln_deciles(
 ):
 
     # TODO maybe parallelise this
-    exp_socvuln = get_soc_vuln_from_api(country_iso)
+    exp_socvuln = get_soc_vuln_from_api(country_iso, location_poly)
     if not exp_socvuln:
         return {
             'location': location_name,
@@ -72,10 +73,12 @@ def create_socvuln_deciles(
             'vulnerability_distribution': None
         }
 
-    vuln_min = min(exp_socvuln.gdf['value'])
-    vuln_max = max(exp_socvuln.gdf['value'])
     if location_poly:
-        exp_socvuln = subset_exposure_extent(exp_socvuln, location_poly, buffer=150)
+        # Deciles use the national range: read it from the dataset's tile index rather than loading the country
+        vuln_min, vuln_max = get_soc_vuln_range(country_iso)
+    else:
+        vuln_min = min(exp_socvuln.gdf['value'])
+        vuln_max = max(exp_socvuln.gdf['value'])
     df_socvuln = exp_socvuln.gdf
     df_socvuln.rename(columns={'value': 'vuln', 'latitude': 'lat', 'longitude': 'lon'}, inplace=True)
 
@@ -90,6 +93,8 @@ def create_socvuln_deciles(
             aggregation_scale=None,
             aggregation_method=None
     )
+    if points.is_columnar(exp_litpop):
+        exp_litpop = points.columnar_arrays(exp_litpop)
     df_litpop = pd.DataFrame(exp_litpop)
     df_litpop = df_litpop[df_litpop['value'] != 0]
     n_grid_cells = df_litpop.shape[0]
@@ -125,7 +130,7 @@ def create_socvuln_deciles(
     }
 
 
-def get_soc_vuln_from_api(country_iso):
+def get_soc_vuln_from_api(country_iso, location_poly=None):
     request_properties = {
         'spatial_coverage': 'country',
         'country_iso3alpha': country_iso,
@@ -133,16 +138,25 @@ def get_soc_vuln_from_api(country_iso):
 
     LOGGER.debug(
         f'Requesting relative wealth index data from Data API. Request properties: {request_properties}')
-    client = Client()
 
     try:
         # TODO maybe make some of these parameters into settings
-        soc_vuln = client.get_exposures(
-            exposures_type='relative_wealth_litpop',
-            properties=request_properties,
-            status='preliminary',
-            version='newest'
-        )
+        if location_poly:
+            soc_vuln = get_exposures_in_extent(
+                exposures_type='relative_wealth_litpop',
+                properties=request_properties,
+                status='preliminary',
+                version='newest',
+                location_poly=location_poly,
+                buffer=150
+            )
+        else:
+            soc_vuln = data_api.get_exposures(
+                exposures_type='relative_wealth_litpop',
+                properties=request_properties,
+                status='preliminary',
+                version='newest'
+            )
     except Client.NoResult as err:
         LOGGER.warning(f'No social vulnerability data found for {country_iso}: returning None')
         return None
@@ -150,6 +164,16 @@ def get_soc_vuln_from_api(country_iso):
     return soc_vuln
 
 
+def get_soc_vuln_range(country_iso):
+    ranges = data_api.get_exposures_ranges(
+        exposures_type='relative_wealth_litpop',
+        properties={'spatial_coverage': 'country', 'country_iso3alpha': country_iso},
+        status='preliminary',
+        version='newest'
+    )
+    return ranges['value']
+
+
 @shared_task()
 def create_socvuln_widget_from_deciles(
         socvuln_list,
@@ -4,9 +4,10 @@ import numpy as np
 
 from calc_api.vizz import schemas, schemas_widgets
 from calc_api.vizz.text_timeline import generate_timeline_widget_text
-from calc_api.calc_methods.calc_exposure import get_exposure
+from calc_api.calc_methods.calc_exposure import get_exposure, get_exposure_total
 from calc_api.vizz import enums
-from calc_api.calc_methods.timeline import set_up_timeline_calculations, combine_impacts_to_timeline, combine_impacts_to_timeline_no_celery
+from calc_api.calc_methods.timeline import set_up_timeline_calculations, combine_impacts_to_timeline, \
+    combine_impacts_to_timeline_no_celery, unpack_timeline_impacts
 
 
 def widget_timeline(data: schemas_widgets.TimelineWidgetRequest):
@@ -18,22 +19,24 @@ def widget_timeline(data: schemas_widgets.TimelineWidgetRequest):
     data_dict['exposure_type'] = enums.exposure_type_from_impact_type(data_dict['impact_type'])
     request = schemas.TimelineImpactRequest(**data_dict)
 
-    exposure_total_signature = get_exposure.s(
+    exposure_kwargs = dict(
         country=data.geocoding.country_id,
         exposure_type=request.exposure_type,
         impact_type=request.impact_type,
         scenario_name=request.scenario_name,
         scenario_growth=request.scenario_growth,
         scenario_year=data.scenario_year,
-        location_poly=request.location_poly,
-        aggregation_scale='all',
-        aggregation_method='sum'
+        location_poly=request.location_poly
     )
 
-    job_config_list, chord_header = set_up_timeline_calculations(request)
+    job_config_list, chord_header, single_task = set_up_timeline_calculations(request)
 
-    chord_header.extend([exposure_total_signature])  # last job total exposure, all the rest impact calc
-    # this is such an ugly way to parallelise all this but I am extremely tired
+    # Read the total from the exposure's summed-area table if one exists, otherwise calculate it in the chord
+    exposure_total = get_exposure_total(**exposure_kwargs)
+    if exposure_total is None:
+        exposure_total_signature = get_exposure.s(**exposure_kwargs, aggregation_scale='all', aggregation_method='sum')
+        chord_header.extend([exposure_total_signature])  # last job total exposure, all the rest impact calc
+        # this is such an ugly way to parallelise all this but I am extremely tired
 
     callback_config = {
         'hazard_type': request.hazard_type,
@@ -48,7 +51,9 @@ def widget_timeline(data: schemas_widgets.TimelineWidgetRequest):
     chord_callback = combine_impacts_to_timeline_widget.s(
         job_config_list=job_config_list,
         report_year=data.scenario_year,
-        config=callback_config
+        config=callback_config,
+        exposure_total=exposure_total,
+        single_task=single_task
     )
 
     # with transaction.atomic():
@@ -60,8 +65,14 @@ def widget_timeline(data: schemas_widgets.TimelineWidgetRequest):
 def combine_impacts_to_timeline_widget(impacts_widget_data,
                                        job_config_list,
                                        report_year,
-                                       config):   # Yes this is horrible: fix it
-    exposure_total, impacts_list = impacts_widget_data[-1], impacts_widget_data[:-1]
+                                       config,
+                                       exposure_total=None,
+                                       single_task=False):   # Yes this is horrible: fix it
+    if exposure_total is None:
+        exposure_total, impacts_list = impacts_widget_data[-1], impacts_widget_data[:-1]
+    else:
+        impacts_list = impacts_widget_data
+    impacts_list = unpack_timeline_impacts(impacts_list, single_task)
     all_timelines = [tl.data for tl in combine_impacts_to_timeline_no_celery(impacts_list, job_config_list)]
     timeline, timeline_10yr, timeline_100yr = all_timelines
     future_analysis = [item for item in timeline.items if item.year_value == int(report_year)][0]
@@ -0,0 +1,88 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from calc_api.config import ClimadaCalcApiConfig
+
+conf = ClimadaCalcApiConfig()
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(getattr(logging, conf.LOG_LEVEL))
+
+
+class WorkerCache:
+    """
+    A per-process, memory-bounded LRU cache for large calculation inputs such as hazards and exposures.
+
+    Each Celery worker process holds its own instance, so nothing here is shared between processes. Cached objects
+    are returned without copying: callers must treat them as read-only.
+    """
+
+    def __init__(self, name, max_bytes, sizeof):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (value, nbytes), least recently used first
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key][0]
+
+    def put(self, key, value):
+        if self.max_bytes <= 0:
+            return value
+        nbytes = self.sizeof(value)
+        if nbytes > self.max_bytes:
+            LOGGER.debug(f'{self.name} cache: object of {nbytes} bytes is larger than the cache budget. Not caching.')
+            return value
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            while self._entries and self.current_bytes + nbytes > self.max_bytes:
+                old_key, (_, old_nbytes) = self._entries.popitem(last=False)
+                self.current_bytes -= old_nbytes
+                self.evictions += 1
+                LOGGER.debug(f'{self.name} cache: evicted {old_key}')
+            self._entries[key] = (value, nbytes)
+            self.current_bytes += nbytes
+        return value
+
+    def get_or_load(self, key, loader):
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is not sentinel:
+            LOGGER.debug(f'{self.name} cache hit: {key}. Stats: {self.stats()}')
+            return value
+        LOGGER.debug(f'{self.name} cache miss: {key}. Stats: {self.stats()}')
+        return self.put(key, loader())
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'entries': len(self._entries),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
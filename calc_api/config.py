@@ -51,5 +51,31 @@ class ClimadaCalcApiConfig:
         self.DEFAULT_N_TRACKS = cdac['defaults']['api_parameters']['n_tracks']
         self.DEFAULT_MIN_DIST_TO_CENTROIDS = float(cdac['defaults']['api_parameters']['min_dist_to_centroids'])
         self.CACHE_TIMEOUT = int(cdac['cache']['timeout'])
+        self.IMPACT_CONCURRENT_LOADING = bool(cdac['impact']['concurrent-loading'])
+        self.IMPACT_LOADING_THREADS = int(cdac['impact']['loading-threads'])
+        self.IMPACT_CHUNKED = bool(cdac['impact']['chunked'])
+        self.IMPACT_REUSE_COUNTRY_MATRIX = bool(cdac['impact']['reuse-country-matrix'])
+        self.IMPACT_FUNCTION_LOOKUP = bool(cdac['impact']['impf-lookup'])
+        self.TIMELINE_ENGINE = cdac['timeline']['engine']
+        self.TIMELINE_CHORD_COUNTRIES = cdac['timeline']['chord-countries'] or []
+        self.COSTBENEFIT_ENGINE = cdac['costbenefit']['engine']
+        self.EXPOSURE_PREFIX_SUM_MAX_CELLS = human_to_int(cdac['exposure']['prefix-sum-max-cells'])
+        self.HAZARD_CACHE_MEMORY = human_to_int(cdac['worker-cache']['hazard-memory'])
+        self.EXPOSURE_CACHE_MEMORY = human_to_int(cdac['worker-cache']['exposure-memory'])
+        self.IMPACT_MATRIX_CACHE_MEMORY = human_to_int(cdac['worker-cache']['impact-matrix-memory'])
+        self.HAZARD_MEMMAP = bool(cdac['worker-cache']['hazard-memmap'])
         self.JOB_TIMEOUT = int(cdac['job']['timeout'])
+        self.JOB_INFLIGHT_LEASE = int(cdac['job']['inflight-lease'])
         self.DATABASE_MODE = cdac['database_mode']
+        self.JOBLOG_COMPRESS_MIN_SIZE = human_to_int(cdac['joblog']['compress-min-size'])
+        self.DATABASE_CACHE_LOCAL_ENTRIES = int(cdac['database_cache']['local-entries'])
+        self.DATABASE_CACHE_LOCAL_TIMEOUT = int(cdac['database_cache']['local-timeout'])
+        self.DATABASE_CACHE_SHARED = bool(cdac['database_cache']['shared'])
+        self.DATABASE_CACHE_SHARED_TIMEOUT = int(cdac['database_cache']['shared-timeout'])
+        self.CACHE_TTL_DAYS = float(cdac['cache_eviction']['ttl-days'])
+        self.CACHE_JOBLOG_MAX_BYTES = human_to_int(cdac['cache_eviction']['joblog-max-size'])
+        self.CACHE_FILECACHE_MAX_BYTES = human_to_int(cdac['cache_eviction']['filecache-max-size'])
+        self.CACHE_IMPACT_MATRIX_MAX_BYTES = human_to_int(cdac['cache_eviction']['impact-matrix-max-size'])
+        self.CACHE_DEFAULT_COMPUTE_TIME = float(cdac['cache_eviction']['default-compute-time'])
+        self.CACHE_SWEEP_INTERVAL = int(cdac['cache_eviction']['sweep-interval'])
+        self.CACHE_ACCESS_FLUSH_INTERVAL = int(cdac['cache_eviction']['access-flush-interval'])
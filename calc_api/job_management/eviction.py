@@ -0,0 +1,217 @@
+import atexit
+import datetime
+import logging
+import os
+import threading
+
+from celery import shared_task
+from celery.signals import worker_process_shutdown
+from celery_singleton import Singleton
+from django.db import connection
+from django.db.models import DateTimeField, F, TextField, Value
+from django.db.models.functions import Cast, Coalesce, Length
+from django.utils import timezone
+
+from calc_api.config import ClimadaCalcApiConfig
+from calc_api.vizz.models import JobLog, FileCache
+from calc_api.job_management.result_cache import RESULT_CACHE
+
+conf = ClimadaCalcApiConfig()
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(getattr(logging, conf.LOG_LEVEL))
+
+SWEEP_BATCH_SIZE = 1000
+
+
+class AccessLog:
+    """
+    Hits on cached results in this process, written to the database in batches.
+
+    Most hits are served from the result cache without a database query, so recording each one as it happens
+    would put the database back on the read path. Instead hit counts and access times are collected here and
+    flushed by a timer cache_eviction: access-flush-interval seconds after the first unflushed hit, and when the
+    process exits.
+    """
+
+    def __init__(self, model, flush_interval):
+        self.model = model
+        self.flush_interval = flush_interval
+        self._pending = {}  # primary key -> (hits, last access)
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def record(self, pk):
+        with self._lock:
+            hits, _ = self._pending.get(pk, (0, None))
+            self._pending[pk] = (hits + 1, timezone.now())
+            if self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self._flush_from_timer)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        finally:
+            connection.close()  # the timer thread's own database connection
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        for pk, (hits, last_accessed) in pending.items():
+            try:
+                self.model.objects.filter(pk=pk).update(hit_count=F('hit_count') + hits, last_accessed=last_accessed)
+            except Exception as err:
+                LOGGER.warning(f'Could not record cache hits for {self.model.__name__} {pk}. Error: {err}')
+
+
+JOBLOG_ACCESS = AccessLog(JobLog, conf.CACHE_ACCESS_FLUSH_INTERVAL)
+FILECACHE_ACCESS = AccessLog(FileCache, conf.CACHE_ACCESS_FLUSH_INTERVAL)
+
+
+# Celery's pool processes exit without running atexit handlers, so they flush on the worker's shutdown signal
+@worker_process_shutdown.connect
+@atexit.register
+def flush_access_logs(**kwargs):
+    JOBLOG_ACCESS.flush()
+    FILECACHE_ACCESS.flush()
+
+
+def record_joblog_access(job_hash):
+    JOBLOG_ACCESS.record(str(job_hash))
+
+
+def record_filecache_access(pk):
+    FILECACHE_ACCESS.record(pk)
+
+
+def eviction_priority(compute_time, hit_count, size, idle_days):
+    """
+    How much an entry is worth keeping: the recompute time saved per byte, weighted by use and discounted by idleness.
+
+    The lowest priority entries are evicted first, so cheap-to-recompute, large, rarely read and long unread results
+    go before expensive, small, popular ones.
+    """
+    cost = compute_time if compute_time is not None else conf.CACHE_DEFAULT_COMPUTE_TIME
+    return cost * (1 + hit_count) / (max(size or 0, 1) * (1 + idle_days))
+
+
+def sweep_joblog(ttl_days=None, max_bytes=None, dry_run=False):
+    """
+    Evict JobLog entries unread for longer than the TTL, then the lowest priority entries until under budget.
+
+    Rows from before usage was recorded get a start time and a size, stored unless this is a dry run.
+    """
+    JOBLOG_ACCESS.flush()
+    queryset = JobLog.objects.all()
+    # Rows from before usage was recorded: measure their stored results in the database
+    stored_size = Coalesce(Length('result_blob'), Length(Cast('result', output_field=TextField())), Value(0))
+    unmeasured = queryset.filter(result_size__isnull=True)
+    if dry_run:
+        sizes = dict(unmeasured.annotate(stored_size=stored_size).values_list('job_hash', 'stored_size'))
+    else:
+        _start_usage(queryset)
+        unmeasured.update(result_size=stored_size)
+        sizes = {}
+    max_bytes = conf.CACHE_JOBLOG_MAX_BYTES if max_bytes is None else max_bytes
+    evicted = _select_evictions(queryset, 'job_hash', ttl_days, max_bytes, sizes)
+    if not dry_run:
+        _delete(JobLog, 'job_hash', evicted)
+        RESULT_CACHE.invalidate_many(evicted)
+    return evicted
+
+
+def sweep_filecache(ttl_days=None, max_bytes=None, dry_run=False):
+    """As sweep_joblog, for FileCache entries and their files. Entries still being computed are left alone."""
+    FILECACHE_ACCESS.flush()
+    queryset = FileCache.objects.filter(locked=False)
+    # Rows from before usage was recorded: measure their files
+    measured = [
+        FileCache(id=pk, result_size=os.path.getsize(path) if path and os.path.isfile(path) else 0)
+        for pk, path in queryset.filter(result_size__isnull=True).values_list('id', 'path')
+    ]
+    if dry_run:
+        sizes = {fc.id: fc.result_size for fc in measured}
+    else:
+        _start_usage(queryset)
+        FileCache.objects.bulk_update(measured, ['result_size'], batch_size=SWEEP_BATCH_SIZE)
+        sizes = {}
+
+    max_bytes = conf.CACHE_FILECACHE_MAX_BYTES if max_bytes is None else max_bytes
+    evicted = _select_evictions(queryset, 'id', ttl_days, max_bytes, sizes)
+    if not dry_run:
+        for start in range(0, len(evicted), SWEEP_BATCH_SIZE):
+            batch = FileCache.objects.filter(id__in=evicted[start:start + SWEEP_BATCH_SIZE])
+            for path in batch.values_list('path', flat=True):
+                if path and os.path.isfile(path):
+                    os.remove(path)
+        _delete(FileCache, 'id', evicted)
+    return evicted
+
+
+def _usage_start(now):
+    # Rows from before usage was recorded start their TTL at their creation, or now
+    return Coalesce(F('last_accessed'), F('created_at'), Value(now, output_field=DateTimeField()))
+
+
+def _start_usage(queryset):
+    queryset.filter(last_accessed__isnull=True).update(last_accessed=_usage_start(timezone.now()))
+
+
+def _select_evictions(queryset, pk_name, ttl_days, max_bytes, sizes):
+    """
+    The expired entries, then the lowest priority ones until under budget. sizes holds the sizes of rows with none
+    recorded, and rows with no recorded access are read as _start_usage would set them, so a dry run needs no writes.
+    """
+    now = timezone.now()
+    ttl_days = conf.CACHE_TTL_DAYS if ttl_days is None else ttl_days
+    expiry = now - datetime.timedelta(days=ttl_days)
+
+    # Only the usage columns are read: the results themselves never leave the database
+    expired, entries = [], []
+    usage = queryset.annotate(usage_start=_usage_start(now)).values_list(
+        pk_name, 'compute_time', 'hit_count', 'result_size', 'usage_start'
+    )
+    for pk, compute_time, hit_count, size, last_accessed in usage.iterator(chunk_size=SWEEP_BATCH_SIZE):
+        if size is None:
+            size = sizes.get(pk)
+        if last_accessed < expiry:
+            expired.append(pk)
+        else:
+            idle_days = (now - last_accessed).total_seconds() / 86400
+            entries.append((eviction_priority(compute_time, hit_count, size, idle_days), pk, size or 0))
+
+    total_bytes = sum(size for _, _, size in entries)
+    over_budget = []
+    for _, pk, size in sorted(entries, key=lambda entry: entry[0]):
+        if total_bytes <= max_bytes:
+            break
+        if size == 0:
+            continue  # e.g. jobs still running: evicting them frees nothing
+        over_budget.append(pk)
+        total_bytes -= size
+
+    LOGGER.info(f'{queryset.model.__name__}: {len(expired)} entries unread for over {ttl_days} days, '
+                f'{len(over_budget)} more evicted to get under {max_bytes} bytes')
+    return expired + over_budget
+
+
+def _delete(model, pk_name, pks):
+    for start in range(0, len(pks), SWEEP_BATCH_SIZE):
+        model.objects.filter(**{f'{pk_name}__in': pks[start:start + SWEEP_BATCH_SIZE]}).delete()
+
+
+@shared_task(base=Singleton)
+def sweep_caches():
+    """Periodic cache sweep, scheduled by Celery beat every cache_eviction: sweep-interval seconds."""
+    # Imported here: the web server imports this module too, and doesn't need CLIMADA for it
+    from calc_api.calc_methods.impact_matrices import sweep_matrices
+    n_jobs = len(sweep_joblog())
+    n_files = len(sweep_filecache())
+    n_matrices = len(sweep_matrices())
+    LOGGER.info(f'Cache sweep evicted {n_jobs} JobLog entries, {n_files} FileCache entries '
+                f'and {n_matrices} impact matrices')
+    return {'joblog': n_jobs, 'filecache': n_files, 'impact_matrices': n_matrices}
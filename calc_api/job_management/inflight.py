@@ -0,0 +1,53 @@
+import datetime
+import logging
+import os
+import socket
+
+from django.conf import settings
+from django.core.cache import cache
+
+from calc_api.config import ClimadaCalcApiConfig
+
+conf = ClimadaCalcApiConfig()
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(getattr(logging, conf.LOG_LEVEL))
+
+KEY_PREFIX = 'inflight_job:'
+
+
+def lease_timeout():
+    """
+    The in-flight lease, capped at how long Celery keeps results. A submission attaches to a job by its id and reads
+    its result from Celery, so the lease must not outlive the result: if nobody polls a finished job, later
+    submissions would attach to a result Celery has dropped and see PENDING until the lease expired.
+    """
+    result_expires = getattr(settings, 'CELERY_TASK_RESULT_EXPIRES', None)
+    if isinstance(result_expires, datetime.timedelta):
+        result_expires = result_expires.total_seconds()
+    if not result_expires:
+        return conf.JOB_INFLIGHT_LEASE
+    return int(min(conf.JOB_INFLIGHT_LEASE, result_expires))
+
+
+def claim(job_hash):
+    """
+    Try to become the one submission that computes a job. Returns True if this caller should submit it.
+
+    The claim is a lease in the Django cache (Redis) that is set only if no other submission holds it, so identical
+    requests arriving together can't both win. It's released when the job finishes, and expires after
+    lease_timeout() seconds in case the job's owner dies without finishing it or nobody collects its result. If the
+    cache can't be reached every caller submits, as before.
+    """
+    owner = f'{socket.gethostname()}:{os.getpid()}'
+    try:
+        return cache.add(KEY_PREFIX + str(job_hash), owner, timeout=lease_timeout())
+    except Exception as err:
+        LOGGER.warning(f'Could not claim job {job_hash} in the shared cache, submitting it anyway. Error: {err}')
+        return True
+
+
+def release(job_hash):
+    try:
+        cache.delete(KEY_PREFIX + str(job_hash))
+    except Exception as err:
+        LOGGER.warning(f'Could not release the claim on job {job_hash}. It will expire. Error: {err}')
@@ -1,9 +1,14 @@
+import json
 import logging
 from decorator import decorator
+from django.utils import timezone
 
 from calc_api.config import ClimadaCalcApiConfig
 from calc_api.vizz.models import JobLog
 from calc_api.util import get_hash, get_args_dict
+from calc_api.job_management.result_cache import RESULT_CACHE, MISSING
+from calc_api.job_management import result_store, eviction, inflight
+from calc_api.calc_methods.profile import timed
 
 conf = ClimadaCalcApiConfig()
 LOGGER = logging.getLogger(__name__)
@@ -27,25 +32,37 @@ def database_job(func, *args, **kwargs):
         try:
             return get_joblog_result(job_hash)
         except JobLog.DoesNotExist:
-            result = func(*args, **kwargs)
+            timings = {}
+            with timed(func.__name__, timings):
+                result = func(*args, **kwargs)
+            result, result_fields = _stored_result(result)
             _ = JobLog.objects.create(
                 job_hash=str(job_hash),
                 func=func.__name__,
                 args=str(args_dict),
                 kwargs=str(kwargs),
-                result=result
+                **result_fields,
+                **_usage_fields(timings[func.__name__])
             )
+            RESULT_CACHE.set(job_hash, result)
             return result
 
     elif conf.DATABASE_MODE == 'update':
-        result = func(*args, **kwargs)
+        timings = {}
+        with timed(func.__name__, timings):
+            result = func(*args, **kwargs)
+        result, result_fields = _stored_result(result)
         _, _ = JobLog.objects.update_or_create(
             job_hash=str(job_hash),
-            func=func.__name__,
-            args=str(args_dict),
-            kwargs=str(kwargs),
-            result=result
+            defaults={
+                'func': func.__name__,
+                'args': str(args_dict),
+                'kwargs': str(kwargs),
+                **result_fields,
+                **_usage_fields(timings[func.__name__])
+            }
         )
+        RESULT_CACHE.set(job_hash, result)
         return result
 
     elif conf.DATABASE_MODE == 'fail_missing':
@@ -62,7 +79,26 @@ def database_job(func, *args, **kwargs):
 
 
 def get_joblog_result(job_hash):
-    return JobLog.objects.get(job_hash=str(job_hash)).result
+    # Hot results are served from the result cache without a database query. Raises JobLog.DoesNotExist if missing.
+    result = RESULT_CACHE.get(job_hash)
+    if result is MISSING:
+        result = result_store.load_result(JobLog.objects.get(job_hash=str(job_hash)))
+        RESULT_CACHE.set(job_hash, result)
+    eviction.record_joblog_access(job_hash)
+    return result
+
+
+def _stored_result(result):
+    # Return the result as it will be read back from the JobLog, e.g. with tuples as lists, so that it's the same
+    # whether it comes from this call, the result cache or the database. Also return the JobLog fields storing it.
+    result_json = result_store.encode_result(result)
+    result = json.loads(result_json)
+    return result, result_store.result_fields(result, result_json)
+
+
+def _usage_fields(compute_time=None):
+    now = timezone.now()
+    return {'created_at': now, 'last_accessed': now, 'hit_count': 0, 'compute_time': compute_time}
 
 
 @decorator
@@ -90,7 +126,8 @@ def endpoint_cache(func, return_class=None, location_root=None, *args, **kwargs)
     elif conf.DATABASE_MODE == 'read':
         try:
             job = JobLog.objects.get(job_hash=str(job_hash))
-            if job.result is not None:
+            if result_store.has_result(job):
+                eviction.record_joblog_access(job_hash)
                 return return_class.from_joblog(job, location_root)
         except JobLog.DoesNotExist:
             pass  # This is fine
@@ -100,20 +137,34 @@ def endpoint_cache(func, return_class=None, location_root=None, *args, **kwargs)
         try:
             print("Create: checking for existing results")
             job = JobLog.objects.get(job_hash=str(job_hash))
-            if job.result is not None:
+            if result_store.has_result(job):
                 print("Found.\n" + str(job))
+                eviction.record_joblog_access(job_hash)
                 return return_class.from_joblog(job, location_root)
-            LOGGER.warning("Job with no result found, is the job already running? Resubmitting anyway.")
         except JobLog.DoesNotExist:
             print("Not found")
-            _ = JobLog.objects.create(
-                job_hash=str(job_hash),
-                func=return_class.__name__,
-                args=data,
-                kwargs={},
-                result=None
-            )
-        return func(request, data=data)
+
+        # Identical submissions share one computation: the Celery job id is the request's hash, so any submission
+        # that doesn't win the claim attaches to the job already running
+        if not inflight.claim(job_hash):
+            LOGGER.debug(f'Job {job_hash} is already running. Attaching to it.')
+            return return_class.from_task_id(str(job_hash), location_root)
+
+        _, _ = JobLog.objects.get_or_create(
+            job_hash=str(job_hash),
+            defaults={
+                'func': return_class.__name__,
+                'args': data,
+                'kwargs': {},
+                'result': None,
+                **_usage_fields()
+            }
+        )
+        try:
+            return func(request, data=data)
+        except Exception:
+            inflight.release(job_hash)
+            raise
 
     elif conf.DATABASE_MODE == 'update':
         job = JobLog.objects.filter(job_hash=str(job_hash))
@@ -123,14 +174,16 @@ def endpoint_cache(func, return_class=None, location_root=None, *args, **kwargs)
                 func=return_class.__name__,
                 args=data,
                 kwargs={},
-                result=None
+                result=None,
+                **_usage_fields()
             )
         return func(request, data=data)
 
     elif conf.DATABASE_MODE == 'fail_missing':
         try:
             job = JobLog.objects.get(job_hash=str(job_hash))
-            if job.result is not None:
+            if result_store.has_result(job):
+                eviction.record_joblog_access(job_hash)
                 return return_class.from_joblog(job, location_root)
             else:
                 raise JobLog.DoesNotExist('The job DOES exist but it has no result.')
@@ -0,0 +1,108 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+from calc_api.config import ClimadaCalcApiConfig
+
+conf = ClimadaCalcApiConfig()
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(getattr(logging, conf.LOG_LEVEL))
+
+KEY_PREFIX = 'joblog_result:'
+MISSING = object()
+
+
+class ResultCache:
+    """
+    Two cache tiers in front of the JobLog table for database_job results.
+
+    The first tier is an LRU in this process, the second is the Django cache (Redis), shared by every process.
+    Reads try each tier in turn and fill the faster tiers on the way back. Writes and invalidations go to every
+    tier. Another process's LRU only hears about an invalidation when its entry expires, so local entries live for
+    at most database_cache: local-timeout seconds.
+    """
+
+    def __init__(self, local_entries, local_timeout, shared, shared_timeout):
+        self.local_entries = local_entries
+        self.local_timeout = local_timeout
+        self.shared = shared
+        self.shared_timeout = shared_timeout
+        self._local = OrderedDict()  # job_hash -> (result, expiry time), least recently used first
+        self._lock = threading.RLock()
+
+    def get(self, job_hash):
+        """Return the cached result for a job, or MISSING. None is a valid result."""
+        job_hash = str(job_hash)
+        result = self._get_local(job_hash)
+        if result is not MISSING:
+            return result
+        result = self._get_shared(job_hash)
+        if result is not MISSING:
+            self._set_local(job_hash, result)
+        return result
+
+    def set(self, job_hash, result):
+        job_hash = str(job_hash)
+        self._set_local(job_hash, result)
+        if self.shared:
+            try:
+                cache.set(KEY_PREFIX + job_hash, result, timeout=self.shared_timeout)
+            except Exception as err:
+                LOGGER.warning(f'Could not write job result {job_hash} to the shared cache. Error: {err}')
+
+    def invalidate(self, job_hash):
+        self.invalidate_many([job_hash])
+
+    def invalidate_many(self, job_hashes):
+        job_hashes = [str(job_hash) for job_hash in job_hashes]
+        with self._lock:
+            for job_hash in job_hashes:
+                self._local.pop(job_hash, None)
+        if self.shared and job_hashes:
+            try:
+                cache.delete_many([KEY_PREFIX + job_hash for job_hash in job_hashes])
+            except Exception as err:
+                LOGGER.warning(f'Could not remove {len(job_hashes)} job results from the shared cache. Error: {err}')
+
+    def _get_local(self, job_hash):
+        if self.local_entries <= 0:
+            return MISSING
+        with self._lock:
+            entry = self._local.get(job_hash)
+            if entry is None:
+                return MISSING
+            result, expiry = entry
+            if expiry < time.monotonic():
+                del self._local[job_hash]
+                return MISSING
+            self._local.move_to_end(job_hash)
+            return result
+
+    def _set_local(self, job_hash, result):
+        if self.local_entries <= 0:
+            return
+        with self._lock:
+            self._local[job_hash] = (result, time.monotonic() + self.local_timeout)
+            self._local.move_to_end(job_hash)
+            while len(self._local) > self.local_entries:
+                self._local.popitem(last=False)
+
+    def _get_shared(self, job_hash):
+        if not self.shared:
+            return MISSING
+        try:
+            return cache.get(KEY_PREFIX + job_hash, MISSING)
+        except Exception as err:
+            LOGGER.warning(f'Could not read job result {job_hash} from the shared cache. Error: {err}')
+            return MISSING
+
+
+RESULT_CACHE = ResultCache(
+    conf.DATABASE_CACHE_LOCAL_ENTRIES,
+    conf.DATABASE_CACHE_LOCAL_TIMEOUT,
+    conf.DATABASE_CACHE_SHARED,
+    conf.DATABASE_CACHE_SHARED_TIMEOUT
+)
@@ -0,0 +1,91 @@
+import json
+import logging
+import zlib
+
+from calc_api.config import ClimadaCalcApiConfig
+
+conf = ClimadaCalcApiConfig()
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(getattr(logging, conf.LOG_LEVEL))
+
+COMPRESSION = 'zlib'
+COMPRESSION_LEVEL = 6
+
+
+def encode_result(result):
+    return json.dumps(result, separators=(',', ':'))
+
+
+def result_fields(result=None, result_json=None, uri=None):
+    """
+    The JobLog fields that store a job's result.
+
+    Pass either the result or its JSON encoding. Results smaller than joblog: compress-min-size are stored in the
+    result JSON column as before. Larger ones are stored as compressed JSON in result_blob, which the database
+    returns as bytes without parsing. Every row gets a small result_header with the result's status, uri and
+    size, so callers can check for a result without decoding it. result_size is the number of bytes stored.
+    """
+    if result_json is None:
+        result_json = encode_result(result)
+    header = {'status': 'SUCCESS', 'uri': uri, 'size': len(result_json)}
+
+    if len(result_json) < conf.JOBLOG_COMPRESS_MIN_SIZE:
+        return {
+            'result': json.loads(result_json) if result is None else result,
+            'result_blob': None,
+            'result_header': header,
+            'result_size': len(result_json)
+        }
+
+    blob = zlib.compress(result_json.encode('utf-8'), COMPRESSION_LEVEL)
+    header.update({'compression': COMPRESSION, 'compressed_size': len(blob)})
+    LOGGER.debug(f'Compressed job result from {len(result_json)} to {len(blob)} bytes')
+    return {'result': None, 'result_blob': blob, 'result_header': header, 'result_size': len(blob)}
+
+
+def has_result(job):
+    return job.result is not None or job.result_blob is not None
+
+
+class StoredResult:
+    """
+    A JobLog row's result, decoded only when the payload is first needed.
+
+    The header (status, uri, size) is available straight away. Rows written before results had headers, and small
+    results stored in the result column, are read the same way.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.header = job.result_header or {}
+        self._payload = None
+        self._decoded = False
+
+    @property
+    def uri(self):
+        if 'uri' in self.header:
+            return self.header['uri']
+        metadata = self.payload.get('metadata', {}) if isinstance(self.payload, dict) else {}
+        return metadata.get('uri')
+
+    @property
+    def payload(self):
+        if not self._decoded:
+            self._payload = self._decode()
+            self._decoded = True
+        return self._payload
+
+    def _decode(self):
+        if self.job.result_blob is not None:
+            if self.header.get('compression', COMPRESSION) != COMPRESSION:
+                raise ValueError(f'Unknown result compression for job {self.job.job_hash}: '
+                                 f'{self.header.get("compression")}')
+            return json.loads(zlib.decompress(bytes(self.job.result_blob)).decode('utf-8'))
+        # Older rows from JobSchema hold the response as a JSON string inside the JSON column
+        if isinstance(self.job.result, str):
+            return json.loads(self.job.result)
+        return self.job.result
+
+
+def load_result(job):
+    return StoredResult(job).payload
@@ -2,6 +2,7 @@ import logging
 from django.core.management import BaseCommand
 
 from calc_api.vizz.models import JobLog
+from calc_api.job_management.result_cache import RESULT_CACHE
 
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.INFO)
@@ -15,4 +16,6 @@ class Command(BaseCommand):
         LOGGER.info("Clearing cached DB results")
 
         # Clear out existing objects (this is a hacky bugfix)
-        JobLog.objects.all().delete()
\ No newline at end of file
+        job_hashes = list(JobLog.objects.values_list('job_hash', flat=True))
+        JobLog.objects.all().delete()
+        RESULT_CACHE.invalidate_many(job_hashes)
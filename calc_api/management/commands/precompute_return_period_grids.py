@@ -0,0 +1,47 @@
+import logging
+from django.core.management import BaseCommand
+
+from climada.util.api_client import Client
+
+from calc_api.vizz.models import Location
+from calc_api.vizz.enums import get_hazard_type_names, get_scenario_options, get_year_options
+from calc_api.calc_methods.calc_hazard import precompute_return_period_grid
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+# The dummy extreme heat hazard doesn't come from the Data API, so there's nothing to precompute
+SKIP_HAZARDS = ['extreme_heat']
+
+
+class Command(BaseCommand):
+    # Show this when the user types help
+    help = "Precomputes hazard intensity at each return period in options.json for every hazard dataset " \
+           "(hazard type, country, scenario, year). Defaults to the countries of the precalculated locations."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--countries', nargs='+', help='ISO3 codes of the countries to precompute')
+        parser.add_argument('--overwrite', action='store_true', help='Rebuild grids that already exist')
+
+    def handle(self, *args, **options):
+        countries = options['countries']
+        if not countries:
+            countries = sorted(set(Location.objects.values_list('country_id', flat=True)))
+        LOGGER.info(f"Precomputing return period grids for countries {countries}")
+
+        for hazard_type in get_hazard_type_names():
+            if hazard_type in SKIP_HAZARDS:
+                continue
+            scenarios = get_scenario_options(hazard_type, get_value='rcp_value')
+            years = get_year_options(hazard_type, get_value='value')
+            for country in countries:
+                for scenario_climate in scenarios:
+                    # Historical hazard doesn't vary by year
+                    scenario_years = years[:1] if scenario_climate == 'historical' else years
+                    for scenario_year in scenario_years:
+                        LOGGER.info(f'Working on {hazard_type} {country} {scenario_climate} {scenario_year}')
+                        try:
+                            precompute_return_period_grid(
+                                hazard_type, country, scenario_climate, scenario_year, options['overwrite'])
+                        except Client.NoResult as err:
+                            LOGGER.warning(f'No hazard dataset found. Skipping. Error: {err}')
@@ -0,0 +1,36 @@
+import logging
+from django.core.management import BaseCommand
+
+from calc_api.config import human_to_int
+from calc_api.job_management.eviction import sweep_joblog, sweep_filecache
+from calc_api.calc_methods.impact_matrices import sweep_matrices
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+
+class Command(BaseCommand):
+    # Show this when the user types help
+    help = "Evict expired and low priority results from the JobLog and FileCache tables and stored impact matrices."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl-days', type=float, default=None,
+                            help='Evict entries unread for this many days (default: cache_eviction: ttl-days)')
+        parser.add_argument('--joblog-max-size', type=human_to_int, default=None,
+                            help='Size budget for JobLog results, e.g. 2G (default: cache_eviction: joblog-max-size)')
+        parser.add_argument('--filecache-max-size', type=human_to_int, default=None,
+                            help='Size budget for cached files (default: cache_eviction: filecache-max-size)')
+        parser.add_argument('--impact-matrix-max-size', type=human_to_int, default=None,
+                            help='Size budget for stored impact matrices '
+                                 '(default: cache_eviction: impact-matrix-max-size)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be evicted without deleting anything')
+
+    def handle(self, *args, **options):
+        LOGGER.info("Sweeping cached results")
+        evicted_jobs = sweep_joblog(options['ttl_days'], options['joblog_max_size'], options['dry_run'])
+        evicted_files = sweep_filecache(options['ttl_days'], options['filecache_max_size'], options['dry_run'])
+        evicted_matrices = sweep_matrices(options['ttl_days'], options['impact_matrix_max_size'], options['dry_run'])
+        action = 'Would evict' if options['dry_run'] else 'Evicted'
+        LOGGER.info(f"{action} {len(evicted_jobs)} JobLog entries, {len(evicted_files)} FileCache entries "
+                    f"and {len(evicted_matrices)} impact matrices")
@@ -0,0 +1,23 @@
+# Generated by Django 4.0 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calc_api', '0007_alter_location_admin1_id_alter_location_admin2_id_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='joblog',
+            name='result_blob',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='joblog',
+            name='result_header',
+            field=models.JSONField(null=True),
+        ),
+    ]
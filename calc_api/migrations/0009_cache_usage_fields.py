@@ -0,0 +1,63 @@
+# Generated by Django 4.0 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calc_api', '0008_joblog_result_blob_joblog_result_header'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='joblog',
+            name='created_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='joblog',
+            name='last_accessed',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='joblog',
+            name='hit_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='joblog',
+            name='compute_time',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='joblog',
+            name='result_size',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='filecache',
+            name='created_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='filecache',
+            name='last_accessed',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='filecache',
+            name='hit_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='filecache',
+            name='compute_time',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='filecache',
+            name='result_size',
+            field=models.IntegerField(null=True),
+        ),
+    ]
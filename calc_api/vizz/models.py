@@ -43,6 +43,14 @@ class JobLog(models.Model):
     args = models.TextField()
     kwargs = models.TextField()
     result = models.JSONField(null=True)  # TODO a cleanup cron job that removes these
+    result_blob = models.BinaryField(null=True)  # large results, compressed: see job_management.result_store
+    result_header = models.JSONField(null=True)  # status, uri and size of the result
+    # Usage, for the cache sweeper: see job_management.eviction
+    created_at = models.DateTimeField(null=True)
+    last_accessed = models.DateTimeField(null=True)
+    hit_count = models.IntegerField(default=0)
+    compute_time = models.FloatField(null=True)  # seconds
+    result_size = models.IntegerField(null=True)  # bytes stored
 
 
 class Cobenefit(models.Model):
@@ -133,6 +141,12 @@ class FileCache(models.Model):
     kargs = models.TextField(null=True)
     path = models.TextField(null=True)
     locked = models.BooleanField()
+    # Usage, for the cache sweeper: see job_management.eviction
+    created_at = models.DateTimeField(null=True)
+    last_accessed = models.DateTimeField(null=True)
+    hit_count = models.IntegerField(default=0)
+    compute_time = models.FloatField(null=True)  # seconds
+    result_size = models.IntegerField(null=True)  # bytes stored
 
     class Meta:
         db_table = 'file_cache'
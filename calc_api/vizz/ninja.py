@@ -219,7 +219,7 @@ def _api_get_map_hazard_climate(request, job_id):
     response=schemas.MapJobSchema,
     summary="Submit job for single event hazard map data"
 )
-def _api_submit_map_hazard_event(request, data: schemas.MapHazardClimateRequest = None):
+def _api_submit_map_hazard_event(request, data: schemas.MapHazardEventRequest = None):
     job_id = mapping.map_hazard_event(data)
     return schemas.MapJobSchema.from_task_id(job_id, 'rest/vizz/map/hazard/event')
 
@@ -261,7 +261,7 @@ def _api_get_map_exposure(request, job_id):
     response=schemas.MapJobSchema,
     summary="Submit job for climatological risk map data"
 )
-def _api_submit_map_hazard_climate(request, data: schemas.MapHazardClimateRequest):
+def _api_submit_map_impact_climate(request, data: schemas.MapImpactClimateRequest):
     job_id = mapping.map_impact_climate(data)
     return schemas.MapJobSchema.from_task_id(job_id, 'rest/vizz/map/impact/climate')
 
@@ -282,7 +282,7 @@ def _api_get_map_hazard_climate(request, job_id):
     response=schemas.MapJobSchema,
     summary="Submit job for single event impact map data"
 )
-def _api_submit_map_hazard_event(request, data: schemas.MapHazardClimateRequest = None):
+def _api_submit_map_impact_event(request, data: schemas.MapImpactEventRequest = None):
     job_id = mapping.map_impact_event(data)
     return schemas.MapJobSchema.from_task_id(job_id, 'rest/vizz/map/impact/event')
 
@@ -1,9 +1,8 @@
 from django.utils import timezone
 from ninja import Schema, ModelSchema
-from typing import List
+from typing import List, Union
 import datetime
 import uuid
-import json
 from time import sleep
 import logging
 import numpy as np
@@ -19,6 +18,7 @@ from calc_api.vizz import schemas_geocoding
 from calc_api.vizz.enums import get_option_choices, get_option_parameter, get_exposure_types, get_hazard_type_names
 from calc_api.vizz import units
 from calc_api import util
+from calc_api.job_management import result_store, inflight
 
 conf = ClimadaCalcApiConfig()
 
@@ -71,14 +71,15 @@ class JobSchema(Schema):
 
     @classmethod
     def from_joblog(cls, job: JobLog, location_root):
-        if job.result is None:
+        if not result_store.has_result(job):
             raise ValueError('JobLog has no result')
 
         request = job.args
-        result = json.loads(job.result)
+        stored = result_store.StoredResult(job)
+        result = stored.payload
         if '__class__' in result.keys():
             _ = result.pop('__class__')
-        uri = result['metadata']['uri'] if 'uri' in result['metadata'] else None
+        uri = stored.uri
         output = cls(
             job_id=job.job_hash,
             location=location_root + '/' + job.job_hash,
@@ -144,16 +145,26 @@ class JobSchema(Schema):
                 print("UPDATING JOB")
                 print(str(task.id))
                 job = JobLog.objects.get(job_hash=str(task.id))
-                if not job.result:
+                if not result_store.has_result(job):
                     json_result = util.encode(response, include_class=False)
-                    job.result = json_result
-                    job.save(update_fields=['result'])
+                    for field, value in result_store.result_fields(result_json=json_result, uri=uri).items():
+                        setattr(job, field, value)
+                    # The placeholder row was created when the job was submitted, so its age is the compute time
+                    job.last_accessed = timezone.now()
+                    if job.created_at:
+                        job.compute_time = (job.last_accessed - job.created_at).total_seconds()
+                    job.save(update_fields=['result', 'result_blob', 'result_header', 'result_size',
+                                            'compute_time', 'last_accessed'])
                 else:
                     LOGGER.warning(
                         'Unexpectedly found a job with a result already saved. Are we using this in a new way?')
             except JobLog.DoesNotExist as e:
                 LOGGER.warning(f'Expected to find an existing record for this job. Investigate. Error: {e}')
 
+        # The result (or failure) is recorded, so identical requests no longer need to attach to this job
+        if task.ready():
+            inflight.release(task.id)
+
         return output
 
     @classmethod
@@ -445,7 +456,7 @@ class ScenarioSchema(PlaceSchema):
 
 class MapHazardClimateRequest(ScenarioSchema):
     hazard_type: enums.HazardTypeEnum
-    hazard_rp: str = None
+    hazard_rp: Union[str, List[str]] = None
     aggregation_scale: str = None
     aggregation_method: str = None
     format: str = conf.DEFAULT_IMAGE_FORMAT
@@ -513,6 +524,7 @@ class MapEntry(ResponseSchema):
     lon: float    # of floats
     geom: str = None  # of WKB/WKT geometries (tbd)
     value: float  # of floats
+    values: List[float] = None  # value at each of Map.return_periods, when several were requested
     color: str
 
 
@@ -520,6 +532,7 @@ class Map(ResponseSchema):
     items: List[MapEntry]
     legend: ColorbarLegend
     units: str
+    return_periods: List[str] = None
 
 
 class MapMetadata(ResponseSchema):
@@ -0,0 +1,63 @@
+import uuid
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+from ninja.testing import TestClient
+
+from calc_api.vizz import ninja, schemas
+from calc_api.calc_methods import mapping
+
+SCENARIO = {'scenario_name': 'historical', 'scenario_year': 2020, 'location_name': 'Jamaica'}
+AGGREGATION = {'aggregation_scale': 'admin1', 'aggregation_method': 'mean'}
+
+MAP_ENDPOINTS = {
+    '/map/hazard/climate': {'hazard_type': 'tropical_cyclone', 'hazard_rp': '100'},
+    '/map/hazard/event': {'hazard_type': 'tropical_cyclone', 'hazard_event_name': '1988_GILBERT'},
+    '/map/exposure': {'exposure_type': 'economic_assets'},
+    '/map/impact/climate': {'hazard_type': 'tropical_cyclone', 'hazard_rp': '100',
+                            'exposure_type': 'economic_assets', 'impact_type': 'economic_impact'},
+    '/map/impact/event': {'hazard_type': 'tropical_cyclone', 'hazard_event_name': '1988_GILBERT',
+                          'exposure_type': 'economic_assets', 'impact_type': 'economic_impact'},
+}
+
+
+def fake_standardise(self):
+    # Skip geocoding and unit checks: only the arguments passed to the calculation chain are under test
+    self.geocoding = SimpleNamespace(country_id='JAM')
+    self.location_poly = 'POLYGON ((-78.4 17.7, -76.2 17.7, -76.2 18.5, -78.4 18.5, -78.4 17.7))'
+
+
+def fake_job(task_id, location_root):
+    return schemas.MapJobSchema(job_id=uuid.uuid4(), location=location_root, status='PENDING', request={})
+
+
+class TestMapAggregation(SimpleTestCase):
+
+    def setUp(self):
+        self.client = TestClient(ninja._api)
+
+    def submit(self, path, payload):
+        with mock.patch.object(schemas.PlaceSchema, 'standardise', fake_standardise), \
+                mock.patch.object(schemas.MapJobSchema, 'from_task_id', fake_job), \
+                mock.patch.object(mapping, 'chain') as chain:
+            response = self.client.post(path, json=payload)
+        self.assertEqual(response.status_code, 200, response.content)
+        chain.assert_called_once()
+        calculation = chain.call_args.args[0]
+        return calculation.kwargs
+
+    def test_aggregation_forwarded(self):
+        for path, payload in MAP_ENDPOINTS.items():
+            with self.subTest(path=path):
+                kwargs = self.submit(path, {**SCENARIO, **AGGREGATION, **payload})
+                self.assertEqual(kwargs['aggregation_scale'], 'admin1')
+                self.assertEqual(kwargs['aggregation_method'], 'mean')
+                self.assertEqual(kwargs['country'], 'JAM')
+
+    def test_no_aggregation(self):
+        for path, payload in MAP_ENDPOINTS.items():
+            with self.subTest(path=path):
+                kwargs = self.submit(path, {**SCENARIO, **payload})
+                self.assertIsNone(kwargs['aggregation_scale'])
+                self.assertIsNone(kwargs['aggregation_method'])
@@ -13,6 +13,16 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 
 app.autodiscover_tasks()
 
+# Periodic tasks, run by a worker started with beat (-B)
+from calc_api.config import ClimadaCalcApiConfig
+conf = ClimadaCalcApiConfig()
+app.conf.beat_schedule = {
+    'sweep-caches': {
+        'task': 'calc_api.job_management.eviction.sweep_caches',
+        'schedule': float(conf.CACHE_SWEEP_INTERVAL),
+    },
+}
+
 @app.task(bind=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
\ No newline at end of file
@@ -173,7 +173,7 @@ CELERY_RESULT_SERIALIZER = 'pickle'
 CELERYD_PREFETCH_MULTIPLIER = 1  # Don't assign jobs to workers until they are free (recommended when some jobs are long)
 CELERY_TASK_TIME_LIMIT = 5 * 60
 CELERY_TASK_RESULT_EXPIRES = 10 * 60
-CELERY_IMPORTS = ['calc_api.vtest.ninja', 'calc_api.vizz.ninja']
+CELERY_IMPORTS = ['calc_api.vtest.ninja', 'calc_api.vizz.ninja', 'calc_api.job_management.eviction']
 
 CELERY_SINGLETON_BACKEND_URL = os.environ.get('REDIS_URL') + '/0'
 CELERY_SINGLETON_LOCK_EXPIRY = 30
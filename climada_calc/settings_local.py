@@ -164,7 +164,7 @@ CELERY_ACCEPT_CONTENT = ['application/json', 'application/x-python-serialize']
 CELERY_TASK_SERIALIZER = 'pickle'  # TODO Get this working with json
 CELERY_RESULT_SERIALIZER = 'pickle'
 CELERY_TASK_TIME_LIMIT: 10 * 60
-CELERY_IMPORTS = ['calc_api.vtest.ninja', 'calc_api.vizz.ninja']
+CELERY_IMPORTS = ['calc_api.vtest.ninja', 'calc_api.vizz.ninja', 'calc_api.job_management.eviction']
 
 CELERY_SINGLETON_BACKEND_URL = os.environ.get('REDIS_URL') + '/0'
 CELERY_SINGLETON_LOCK_EXPIRY = 300